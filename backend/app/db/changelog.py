@@ -0,0 +1,58 @@
+"""Triggers logging every write to users and contents in change_log (models.ChangeLog), in
+the writing transaction: whichever process or statement wrote (the API, an import, a
+script), every API worker learns of it from the log (services/change_feed.py).
+
+Created with the tables by create_all, and by migration 0009 on existing databases.
+"""
+from sqlalchemy import DDL, MetaData, event
+
+SQLITE_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS users_change_log_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', new.id, new.telegram_id); END",
+    "CREATE TRIGGER IF NOT EXISTS users_change_log_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', new.id, new.telegram_id); "
+    "INSERT INTO change_log (topic, row_id, telegram_id) "
+    "SELECT 'user', old.id, old.telegram_id WHERE old.telegram_id IS NOT new.telegram_id; END",
+    "CREATE TRIGGER IF NOT EXISTS users_change_log_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', old.id, old.telegram_id); END",
+    "CREATE TRIGGER IF NOT EXISTS contents_change_log_ai AFTER INSERT ON contents BEGIN "
+    "INSERT INTO change_log (topic, row_id) VALUES ('content', new.id); END",
+    "CREATE TRIGGER IF NOT EXISTS contents_change_log_au AFTER UPDATE ON contents BEGIN "
+    "INSERT INTO change_log (topic, row_id) VALUES ('content', new.id); END",
+    "CREATE TRIGGER IF NOT EXISTS contents_change_log_ad AFTER DELETE ON contents BEGIN "
+    "INSERT INTO change_log (topic, row_id) VALUES ('content', old.id); END",
+]
+
+# SQLite has one writer at a time, so ids are committed in order. On PostgreSQL the log rows are
+# written by deferred triggers, at COMMIT, after a transaction lock: a reader that saw id n never
+# gets a smaller id committed after it (ids come from a sequence, in the order the lock was taken).
+# The lock is held only from the writer's commit to its end, so writers of users and contents
+# don't wait for each other's transactions, only for each other's log inserts
+POSTGRES_DDL = [
+    "CREATE OR REPLACE FUNCTION change_log_users() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "PERFORM pg_advisory_xact_lock(hashtext('change_log')); "
+    "IF TG_OP = 'DELETE' THEN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', OLD.id, OLD.telegram_id); RETURN NULL; END IF; "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', NEW.id, NEW.telegram_id); "
+    "IF TG_OP = 'UPDATE' THEN IF OLD.telegram_id IS DISTINCT FROM NEW.telegram_id THEN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', OLD.id, OLD.telegram_id); END IF; END IF; "
+    "RETURN NULL; END $$",
+    "CREATE OR REPLACE FUNCTION change_log_contents() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "PERFORM pg_advisory_xact_lock(hashtext('change_log')); "
+    "IF TG_OP = 'DELETE' THEN INSERT INTO change_log (topic, row_id) VALUES ('content', OLD.id); "
+    "ELSE INSERT INTO change_log (topic, row_id) VALUES ('content', NEW.id); END IF; "
+    "RETURN NULL; END $$",
+    "DROP TRIGGER IF EXISTS users_change_log ON users",
+    "CREATE CONSTRAINT TRIGGER users_change_log AFTER INSERT OR UPDATE OR DELETE ON users "
+    "DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION change_log_users()",
+    "DROP TRIGGER IF EXISTS contents_change_log ON contents",
+    "CREATE CONSTRAINT TRIGGER contents_change_log AFTER INSERT OR UPDATE OR DELETE ON contents "
+    "DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION change_log_contents()",
+]
+
+def install(metadata: MetaData) -> None:
+    """Create the triggers in create_all, once users, contents and change_log all exist."""
+    for ddl in SQLITE_DDL:
+        event.listen(metadata, "after_create", DDL(ddl).execute_if(dialect="sqlite"))
+    for ddl in POSTGRES_DDL:
+        event.listen(metadata, "after_create", DDL(ddl).execute_if(dialect="postgresql"))
@@ -0,0 +1,27 @@
+from sqlalchemy import Float, cast, extract, func
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def insert_for(db: AsyncSession, table):
+    """INSERT construct with ON CONFLICT support for the session's backend (SQLite or PostgreSQL)."""
+    name = db.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects import postgresql  # not imported on SQLite: ~30 ms of startup
+
+        return postgresql.insert(table)
+    if name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upsert not supported on {name}")
+
+
+def unix_time(db: AsyncSession):
+    """The database's clock as a Unix time in seconds, read when the statement runs (after
+    any wait for a lock), for the session's backend (SQLite or PostgreSQL)."""
+    name = db.get_bind().dialect.name
+    if name == "postgresql":
+        return cast(extract("epoch", func.clock_timestamp()), Float)
+    if name == "sqlite":
+        # julianday('now') has millisecond precision; unixepoch('subsec') needs SQLite 3.42
+        return (func.julianday("now") - 2440587.5) * 86400.0
+    raise NotImplementedError(f"Database time not supported on {name}")
@@ -0,0 +1,120 @@
+"""Full-text index over contents.title/body, for GET /api/contents/search.
+
+SQLite: an external-content FTS5 table (contents_fts) kept in sync by triggers, ranked by
+bm25 with title matches weighted 10x. PostgreSQL: a generated tsvector column
+(contents.search_vector, title weighted A, body B) with a GIN index. Created together
+with the contents table by create_all, and by migration 0006 on existing databases.
+"""
+import re
+from typing import Callable, List, Optional
+
+from sqlalchemy import DDL, Select, Table, column, event, func, literal_column, null, or_, select, table
+from sqlalchemy.sql.elements import ColumnElement
+
+TS_CONFIG = "italian"
+SNIPPET_START, SNIPPET_END = "**", "**"
+MAX_TERMS = 8
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS contents_fts USING fts5("
+    "title, body, content='contents', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    # the default `rank` (so ORDER BY rank takes FTS5's fast path) weighs title over body
+    "INSERT INTO contents_fts(contents_fts, rank) VALUES('rank', 'bm25(10.0, 1.0)')",
+    "CREATE TRIGGER IF NOT EXISTS contents_fts_ai AFTER INSERT ON contents BEGIN "
+    "INSERT INTO contents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS contents_fts_ad AFTER DELETE ON contents BEGIN "
+    "INSERT INTO contents_fts(contents_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS contents_fts_au AFTER UPDATE OF title, body ON contents BEGIN "
+    "INSERT INTO contents_fts(contents_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO contents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+]
+
+POSTGRES_DDL = [
+    "ALTER TABLE contents ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    f"setweight(to_tsvector('{TS_CONFIG}', coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector('{TS_CONFIG}', coalesce(body, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_contents_search ON contents USING gin (search_vector)",
+]
+
+
+def install(table: Table) -> None:
+    """Create the index along with `table` (contents) in create_all."""
+    for ddl in SQLITE_DDL:
+        event.listen(table, "after_create", DDL(ddl).execute_if(dialect="sqlite"))
+    event.listen(table, "after_drop", DDL("DROP TABLE IF EXISTS contents_fts").execute_if(dialect="sqlite"))
+    for ddl in POSTGRES_DDL:
+        event.listen(table, "after_create", DDL(ddl).execute_if(dialect="postgresql"))
+
+
+def terms(q: str) -> List[str]:
+    """Words of a user query, "word*" for a prefix; other punctuation and operators are
+    dropped, so any input is a valid query."""
+    words = []
+    for word, star in re.findall(r"(\w+)(\*?)", q.lower())[:MAX_TERMS]:
+        # a short prefix would expand to a large part of the vocabulary
+        words.append(word + "*" if star and len(word) >= 3 else word)
+    return words
+
+
+_fts = table("contents_fts", column("rowid"), column("rank"))
+_contents = table("contents", column("id"), column("title"), column("body"), column("search_vector"))
+
+Visibility = Optional[Callable[[ColumnElement], ColumnElement]]
+
+
+def _match(words: List[str], fts=_fts):
+    # "word" or "word"*: FTS5 reads prefix terms' posting lists whole, so they are opt-in
+    phrases = [f'"{w[:-1]}"*' if w.endswith("*") else f'"{w}"' for w in words]
+    # the hidden column named after the FTS5 table, qualified so it works on an alias too
+    return literal_column(f"{fts.name}.contents_fts").op("MATCH")(" ".join(phrases))
+
+
+def _tsquery(words: List[str]):
+    # words are \w+ (plus a trailing *), so they can't carry other tsquery operators
+    query = " & ".join(w[:-1] + ":*" if w.endswith("*") else w for w in words)
+    return func.to_tsquery(literal_column(f"'{TS_CONFIG}'"), query)
+
+
+def broad(dialect: str, words: List[str], max_matches: int) -> Select:
+    """SELECT true if the query is too broad to rank: ranking then costs a pass over every
+    posting of its words. Reads at most max_matches postings per word."""
+    if dialect == "sqlite":
+        # bm25 counts each word's documents for its IDF, whatever the other words match
+        nth = [select(_fts.c.rowid).where(_match([w])).order_by(_fts.c.rowid.desc())
+               .limit(1).offset(max_matches - 1).scalar_subquery().isnot(None) for w in words]
+        return select(or_(*nth))
+    if dialect == "postgresql":
+        # ts_rank_cd has no global statistics: what counts is the rows matching the whole query
+        matches = select(_contents.c.id).where(_contents.c.search_vector.op("@@")(_tsquery(words))).limit(max_matches)
+        return select(select(func.count()).select_from(matches.subquery()).scalar_subquery() >= max_matches)
+    raise NotImplementedError(f"Full-text search not supported on {dialect}")
+
+
+def search(dialect: str, words: List[str], rank: bool, limit: int, offset: int,
+           visible: Visibility = None) -> Select:
+    """SELECT id, score, snippet for one page of the contents matching every word, the best
+    matches first, or the newest first (score NULL) when not `rank`; snippets wrap the matches
+    in SNIPPET_START/SNIPPET_END. `visible(id_column)` restricts them to what a user may see."""
+    filters = [visible(_fts.c.rowid if dialect == "sqlite" else _contents.c.id)] if visible is not None else []
+    if dialect == "sqlite":
+        # FTS5 ranks (ORDER BY rank) or walks newest first (ORDER BY rowid DESC) inside the
+        # virtual table, and builds snippets only for the rows returned
+        snippet = func.snippet(literal_column("contents_fts"), -1, SNIPPET_START, SNIPPET_END, "…", 16)
+        score = (-_fts.c.rank) if rank else null()
+        return (select(_fts.c.rowid.label("id"), score.label("score"), snippet.label("snippet"))
+                .where(_match(words), *filters)
+                .order_by(_fts.c.rank if rank else _fts.c.rowid.desc()).limit(limit).offset(offset))
+    if dialect == "postgresql":
+        score = func.ts_rank_cd(_contents.c.search_vector, _tsquery(words)) if rank else null()
+        page = (select(_contents.c.id, score.label("score"))
+                .where(_contents.c.search_vector.op("@@")(_tsquery(words)), *filters)
+                .order_by(*([score.desc()] if rank else []), _contents.c.id.desc())
+                .limit(limit).offset(offset).subquery("page"))
+        # ts_headline is costly: only for the rows of the page
+        options = f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=24, MinWords=8, MaxFragments=2"
+        snippet = func.ts_headline(literal_column(f"'{TS_CONFIG}'"), _contents.c.title + " — " + _contents.c.body,
+                                   _tsquery(words), options)
+        return (select(page.c.id, page.c.score, snippet.label("snippet"))
+                .join_from(page, _contents, _contents.c.id == page.c.id)
+                .order_by(*([page.c.score.desc()] if rank else []), page.c.id.desc()))
+    raise NotImplementedError(f"Full-text search not supported on {dialect}")
@@ -1,22 +1,136 @@
-from sqlalchemy import create_engine
+import asyncio
+import contextlib
+import importlib.util
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./data.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+from ..config import (
+    DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    SQLITE_PRAGMAS,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_MMAP_SIZE,
 )
 
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    cur = dbapi_conn.cursor()
+    # WAL lets readers run alongside the single writer; NORMAL is durable in WAL mode
+    # except for the last transactions on power loss
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.close()
+
+
+def _engine_args(url: str) -> dict:
+    pool = dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    if url.startswith("sqlite"):
+        in_memory = make_url(url).database in (None, "", ":memory:")
+        return dict(
+            connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+            **({} if in_memory else pool),
+        )
+    return dict(pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True, **pool)
+
+
+def _wants_pragmas(url: str, sqlite_pragmas: bool) -> bool:
+    return sqlite_pragmas and url.startswith("sqlite") and make_url(url).database not in (None, "", ":memory:")
+
+
+def _require_driver(url: str) -> None:
+    # the PostgreSQL drivers are optional: not installed by requirements.txt
+    driver = make_url(url).get_driver_name()
+    if make_url(url).get_backend_name() == "postgresql" and importlib.util.find_spec(driver) is None:
+        raise RuntimeError(f"DATABASE_URL is PostgreSQL but {driver} is not installed: "
+                           "pip install -r requirements-postgres.txt")
+
+
+def make_engine(url: str = SQLALCHEMY_DATABASE_URL, sqlite_pragmas: bool = SQLITE_PRAGMAS) -> Engine:
+    """Sync engine, used by Alembic, create_all and offline scripts."""
+    url = sync_url(url)
+    _require_driver(url)
+    engine = create_engine(url, **_engine_args(url))
+    if _wants_pragmas(url, sqlite_pragmas):
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+def make_async_engine(url: str = SQLALCHEMY_DATABASE_URL, sqlite_pragmas: bool = SQLITE_PRAGMAS) -> AsyncEngine:
+    """Engine used by the API: aiosqlite for SQLite, asyncpg for PostgreSQL."""
+    url = async_url(url)
+    _require_driver(url)
+    args = _engine_args(url)
+    if "pool_size" in args and url.startswith("sqlite"):
+        # aiosqlite defaults to NullPool; keep connections (and their pragmas) around
+        args["poolclass"] = AsyncAdaptedQueuePool
+    engine = create_async_engine(url, **args)
+    if _wants_pragmas(url, sqlite_pragmas):
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+def async_url(url: str) -> str:
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite":
+        u = u.set(drivername="sqlite+aiosqlite")
+    elif u.get_backend_name() == "postgresql":
+        u = u.set(drivername="postgresql+asyncpg")
+    return u.render_as_string(hide_password=False)
+
+
+def sync_url(url: str) -> str:
+    u = make_url(url)
+    if u.drivername == "sqlite+aiosqlite":
+        u = u.set(drivername="sqlite")
+    elif u.drivername in ("postgresql", "postgresql+asyncpg"):
+        u = u.set(drivername="postgresql+psycopg")
+    return u.render_as_string(hide_password=False)
+
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = make_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# SQLite has a single writer: queue writers here, in FIFO order, instead of letting them
+# spin in SQLite's busy handler (which starves some of them for seconds under load)
+_sqlite_write_lock = asyncio.Lock() if async_engine.dialect.name == "sqlite" else None
+
+
+@contextlib.asynccontextmanager
+async def write_lock(db: Optional[AsyncSession] = None) -> AsyncIterator[None]:
+    """Held around hot write statements; a no-op outside SQLite.
+
+    Pass the session that will write: its connection is checked out before queueing for
+    the lock, so the holder never waits for the pool while the queued writers hold every
+    connection (which deadlocks until pool_timeout once writers outnumber the pool).
+    """
+    if db is not None:
+        await db.connection()
+    if _sqlite_write_lock is None:
+        yield
+        return
+    async with _sqlite_write_lock:
+        yield
+
+
 class Base(DeclarativeBase):
     pass
 
 # Dependency
-from typing import Iterator
-
-def get_db() -> Iterator:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
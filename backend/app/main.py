@@ -1,45 +1,123 @@
+import logging
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from .routers import users as users_router
-from .routers import contents as contents_router
+from fastapi.responses import RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
-from .db.session import engine, Base
+from .services.supervisor import Supervisor
 from . import config
 
-app = FastAPI(title="FDI System API")
+logging.basicConfig(level=config.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+# httpx logs every request URL at INFO, and Bot API URLs contain the token
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# CORS (adjust in production)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-# DB init (create tables if not exist)
-Base.metadata.create_all(bind=engine)
+def create_supervisor() -> Supervisor:
+    from .db.session import async_engine
+    from .services.cache import user_cache
+    from .services.change_feed import change_feed
+    from .services.delivery import engine as delivery
+    from .services.membership import reconciler
+    from .services.outbox import outbox
+    from .services.scheduler import scheduler
+    from .services.telegram import close_telegram
 
-# Static files and simple admin panel
-app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
+    # started in this order, drained and stopped in reverse: the delivery queue is drained into the
+    # outbox while the DB is still open, the outbox finishes its batch before the Telegram client closes
+    supervisor = Supervisor(config.SHUTDOWN_TIMEOUT)
+    supervisor.add("database", stop=async_engine.dispose)
+    supervisor.add("user cache", stop=user_cache.close)
+    # the caches follow the writes of every process from here on
+    supervisor.add("change feed", start=change_feed.start, stop=change_feed.stop)
+    supervisor.add("telegram client", stop=close_telegram)
+    supervisor.add("outbox", start=outbox.start, drain=outbox.drain, stop=outbox.stop)
+    supervisor.add("delivery", start=delivery.start, drain=delivery.drain, stop=delivery.stop)
+    # before the delivery drain: the sends it moves to the outbox are left to the next process, a
+    # batch claimed now would be cut short by the deadline and repeated (its calls may have gone out)
+    supervisor.add("outbox claims", stop=outbox.hold)
+    supervisor.add("scheduler", start=scheduler.start, stop=scheduler.stop)
+    supervisor.add("membership reconciliation", start=reconciler.start, stop=reconciler.stop)
+    return supervisor
 
-app.include_router(users_router.router, prefix="/api/users", tags=["users"])
-app.include_router(contents_router.router, prefix="/api/contents", tags=["contents"])
 
-@app.get("/")
-def root():
-    return RedirectResponse(url="/docs")
+def create_app() -> FastAPI:
+    """Build the API. The schema isn't created here: run `alembic upgrade head` once before
+    starting the workers (scripts/run_api.sh does).
 
-@app.get("/admin")
-def admin():
-    return RedirectResponse(url="/static/admin.html")
+    Serve it with `uvicorn --factory backend.app.main:create_app`; `backend.app.main:app`
+    still works and builds the app on first access.
+    """
+    from .db.session import async_engine
+    from .routers import contents as contents_router
+    from .routers import events as events_router
+    from .routers import memberships as memberships_router
+    from .routers import users as users_router
+    from .services import metrics
 
-@app.get("/api/health")
-def health():
-    return {"status": "ok"}
+    supervisor = create_supervisor()
 
-# Placeholder: bot webhook can be added later
-# from .routers import bot_webhook
-# app.include_router(bot_webhook.router, prefix="/api/bot", tags=["bot"])
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        try:
+            await supervisor.start()
+            yield
+        finally:
+            await supervisor.shutdown()
+
+    app = FastAPI(title="FDI System API", lifespan=lifespan)
+    app.state.supervisor = supervisor
+
+    # CORS (adjust in production)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
+    # outermost, so the latency includes the other middleware
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(async_engine)
+
+    # Static files and simple admin panel
+    app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
+
+    app.include_router(users_router.router, prefix="/api/users", tags=["users"])
+    app.include_router(contents_router.router, prefix="/api/contents", tags=["contents"])
+    app.include_router(events_router.router, prefix="/api/events", tags=["events"])
+    app.include_router(memberships_router.router, prefix="/api/memberships", tags=["memberships"])
+
+    @app.get("/")
+    def root():
+        return RedirectResponse(url="/docs")
+
+    @app.get("/admin")
+    def admin():
+        return RedirectResponse(url="/static/admin.html")
+
+    @app.get("/api/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        body, media_type = metrics.render()
+        return Response(body, media_type=media_type)
+
+    # The bot's webhook is served by the bot process itself (BOT_MODE=webhook, see bot/webhook.py)
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # `backend.app.main:app` (uvicorn, the scripts): one app per process, built when first asked for
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,8 @@
 from datetime import datetime
-from sqlalchemy import BigInteger, Column, Integer, String, Text, DateTime, Enum, ForeignKey, UniqueConstraint
+from sqlalchemy import func, BigInteger, Boolean, Column, Float, Integer, String, Text, DateTime, Enum, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from ..db.session import Base
+from ..db import changelog, fulltext
 import enum
 
 class UserLevel(enum.IntEnum):
@@ -30,9 +31,22 @@ class User(Base):
     approved_by = Column(Integer, nullable=True)
     approved_at = Column(DateTime)
     registered_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # last write to the row (channel membership reconciliation looks at the users changed since its last run)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     contents_authored = relationship("Content", back_populates="author")
 
+    __table_args__ = (
+        # /api/users filters in id order
+        Index('ix_users_level_id', level, id),
+        Index('ix_users_status_id', status, id),
+        # prefix search (lower(x) range scans) and the last_name sort
+        Index('ix_users_first_name_lower', func.lower(first_name)),
+        Index('ix_users_last_name_lower_id', func.coalesce(func.lower(last_name), ''), id),
+        Index('ix_users_email_lower', func.lower(email)),
+        Index('ix_users_phone', phone),
+    )
+
 class Content(Base):
     __tablename__ = "contents"
     id = Column(Integer, primary_key=True, index=True)
@@ -45,6 +59,14 @@ class Content(Base):
     author = relationship("User", back_populates="contents_authored")
     visibility = relationship("ContentVisibility", back_populates="content", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # keyset pagination for /history
+        Index('ix_contents_published_at_id', 'published_at', 'id'),
+    )
+
+# full-text index for /api/contents/search (FTS5 table + triggers, or tsvector + GIN)
+fulltext.install(Content.__table__)
+
 class ContentVisibility(Base):
     __tablename__ = "content_visibility"
     id = Column(Integer, primary_key=True)
@@ -57,4 +79,145 @@ class ContentVisibility(Base):
     __table_args__ = (
         UniqueConstraint('content_id', 'user_id', name='ux_visibility_user'),
         UniqueConstraint('content_id', 'level_target', name='ux_visibility_level'),
+        # per-user feed: contents granted directly to a user
+        Index('ix_visibility_user_content', 'user_id', 'content_id'),
+    )
+
+
+class InviteLink(Base):
+    """Current shared invite link per channel, reused by the bot and the API."""
+    __tablename__ = "invite_links"
+    channel_id = Column(String, primary_key=True)
+    invite_link = Column(String, nullable=False)
+    expire_date = Column(DateTime, nullable=True)
+    member_limit = Column(Integer, nullable=True)
+    handed_out = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class OutboxStatus(str, enum.Enum):
+    pending = "pending"
+    done = "done"
+    failed = "failed"
+
+
+class TelegramOutbox(Base):
+    """Telegram side effect written in the same transaction as the change that causes it.
+
+    Drained by services/outbox.py; actions sharing an ordering_key run in id order.
+    """
+    __tablename__ = "telegram_outbox"
+    id = Column(Integer, primary_key=True)
+    idempotency_key = Column(String, nullable=False, unique=True)
+    batch_id = Column(String, nullable=True)
+    ordering_key = Column(String, nullable=False)
+    method = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(Enum(OutboxStatus), nullable=False, default=OutboxStatus.pending)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    done_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # claim: due actions, and the earlier-action-of-the-same-key check
+        Index('ix_outbox_status_next_attempt', status, next_attempt_at),
+        Index('ix_outbox_key_status_id', ordering_key, status, id),
+        Index('ix_outbox_batch', batch_id),
     )
+
+
+class ScheduleStatus(str, enum.Enum):
+    scheduled = "scheduled"
+    published = "published"
+    cancelled = "cancelled"
+
+
+class ScheduledContent(Base):
+    """Content to publish at publish_at, with its notifications (services/scheduler.py).
+
+    Publishing creates the Content and its visibility and sets status and content_id in
+    one transaction; batch_id is the outbox batch of its channel messages.
+    """
+    __tablename__ = "scheduled_contents"
+    id = Column(Integer, primary_key=True)
+    title = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    link = Column(String)
+    levels = Column(Text, nullable=False, default="[]")  # JSON
+    user_ids = Column(Text, nullable=False, default="[]")  # JSON
+    notify = Column(Boolean, nullable=False, default=True)
+    publish_at = Column(DateTime, nullable=False)
+    status = Column(Enum(ScheduleStatus), nullable=False, default=ScheduleStatus.scheduled)
+    content_id = Column(Integer, ForeignKey("contents.id", ondelete="SET NULL"), nullable=True)
+    batch_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # due contents, and the scheduler's next wake-up
+        Index('ix_scheduled_status_publish_at', status, publish_at),
+    )
+
+
+class ChannelMember(Base):
+    """Membership of a level channel, as last reported by Telegram (chat_member updates
+    forwarded by the bot). Checked against the users' level and status by
+    services/membership.py."""
+    __tablename__ = "channel_members"
+    channel_id = Column(String, primary_key=True)
+    telegram_id = Column(BigInteger, primary_key=True)
+    status = Column(String, nullable=False)  # Telegram ChatMember status: member, administrator, left, kicked...
+    changed_at = Column(DateTime, nullable=False)  # date of the update; older updates are ignored
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # the memberships of a changed user, and the ones changed since the last run
+        Index('ix_channel_members_telegram_id', telegram_id),
+        Index('ix_channel_members_updated_at', updated_at),
+    )
+
+
+class JobCheckpoint(Base):
+    """Where a periodic job stopped: it resumes from `position` on the next run."""
+    __tablename__ = "job_checkpoints"
+    name = Column(String, primary_key=True)
+    position = Column(DateTime, nullable=False)
+    batch_id = Column(String, nullable=True)  # outbox batch of the last run
+    ran_at = Column(DateTime, nullable=False)
+
+
+class ChangeLog(Base):
+    """A user or content row written, logged by triggers in the writing transaction
+    (db/changelog.py). Every API process follows it (services/change_feed.py) to drop
+    its cached copies and to tell the bot and the admin panels."""
+    __tablename__ = "change_log"
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, nullable=False)  # "user" or "content"
+    row_id = Column(Integer, nullable=False)  # users.id / contents.id
+    telegram_id = Column(BigInteger, nullable=True)  # users only
+
+    # AUTOINCREMENT on SQLite: ids never go back, even once the oldest rows are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+changelog.install(Base.metadata)
+
+
+class RateLimit(Base):
+    """A rate limit shared by the API processes (services/telegram.py): the theoretical
+    arrival time of the next call, as a Unix time."""
+    __tablename__ = "rate_limits"
+    name = Column(String, primary_key=True)
+    tat = Column(Float, nullable=False)
+
+
+class DeliveryProgress(Base):
+    """Progress of a delivery job (services/delivery.py), saved by the process running it
+    for the others to answer GET /api/contents/notifications/{job_id}."""
+    __tablename__ = "delivery_jobs"
+    id = Column(String, primary_key=True)
+    total = Column(Integer, nullable=False)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    errors = Column(Text, nullable=False, default="[]")  # JSON
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
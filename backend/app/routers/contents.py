@@ -1,68 +1,300 @@
 
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
-from datetime import datetime
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from ..schemas.contents import PublishIn, ContentOut, SendNotifIn
-from ..db.session import get_db
-from ..models.models import Content, ContentVisibility, User
-import os
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import json
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, or_, and_
+from ..schemas.contents import PublishIn, ContentOut, ContentSearchOut, SendNotifIn, ScheduleIn, ScheduledOut
+from ..db.session import get_db, write_lock, AsyncSessionLocal
+from ..db import fulltext
+from ..config import SEARCH_RANK_MAX_MATCHES, LEVEL_CHANNELS
+from ..models.models import Content, ContentVisibility, DeliveryProgress, ScheduledContent, ScheduleStatus, User, UserStatus
+from ..services.delivery import engine as delivery, DeliveryJob, QueueFullError
+from ..services.outbox import batch_status as outbox_batch_status
+from ..services.scheduler import scheduler, notification_text
+from ..services.admin_events import admin_events
+from ..services.change_feed import change_feed
+from ..services.responses import json_response
+from ..services.telegram import get_telegram, split_message
 
 router = APIRouter()
 
-LEVEL_CHANNELS = {
-    1: os.getenv("TELEGRAM_LEVEL1_CHANNEL_ID"),
-    2: os.getenv("TELEGRAM_LEVEL2_CHANNEL_ID"),
-    3: os.getenv("TELEGRAM_LEVEL3_CHANNEL_ID"),
-    4: os.getenv("TELEGRAM_LEVEL4_CHANNEL_ID"),
-}
-
-def _to_content_out(c: Content, db: Session) -> ContentOut:
-    levels = db.execute(select(ContentVisibility.level_target).where(ContentVisibility.content_id == c.id, ContentVisibility.level_target.isnot(None))).scalars().all()
-    return ContentOut(
-        id=c.id,
-        title=c.title,
-        body=c.body,
-        link=c.link,
-        author_id=c.author_id,
-        published_at=c.published_at.isoformat() if c.published_at else datetime.utcnow().isoformat(),
-        levels=list(set(levels))
-    )
+# ContentOut's columns but the levels: the history pages select these as plain rows
+CONTENT_OUT_COLUMNS = (Content.id, Content.title, Content.body, Content.link, Content.author_id, Content.published_at)
+
+def _content_dict(c, levels: List[int]) -> dict:
+    """ContentOut as a plain dict, from a Content or a row of CONTENT_OUT_COLUMNS."""
+    return {
+        "id": c.id,
+        "title": c.title,
+        "body": c.body,
+        "link": c.link,
+        "author_id": c.author_id,
+        "published_at": c.published_at.isoformat() if c.published_at else datetime.utcnow().isoformat(),
+        "levels": sorted(set(levels)),
+    }
+
+def _to_content_out(c: Content, levels: List[int]) -> ContentOut:
+    return ContentOut(**_content_dict(c, levels))
+
+async def _levels_by_content(db: AsyncSession, content_ids: List[int]) -> Dict[int, List[int]]:
+    # one query for the whole page instead of one per content
+    levels: Dict[int, List[int]] = {cid: [] for cid in content_ids}
+    if not content_ids:
+        return levels
+    rows = (await db.execute(
+        select(ContentVisibility.content_id, ContentVisibility.level_target)
+        .where(ContentVisibility.content_id.in_(content_ids), ContentVisibility.level_target.isnot(None))
+    )).all()
+    for content_id, level_target in rows:
+        levels[content_id].append(level_target)
+    return levels
+
+async def _contents_changed(changes, position: int):
+    """Change feed handler (services/change_feed.py): contents published, by this process or
+    another one (e.g. the scheduler), for the admin panels."""
+    if changes is None:
+        return  # the users' handler resets the admin log
+    last = {c.row_id: c.id for c in changes}
+    async with AsyncSessionLocal() as db:
+        contents = {c.id: c for c in (await db.execute(select(Content).where(Content.id.in_(list(last))))).scalars()}
+        levels = await _levels_by_content(db, list(contents))
+    for c in changes:
+        if last[c.row_id] == c.id and c.row_id in contents:
+            admin_events.publish("content", _content_dict(contents[c.row_id], levels[c.row_id]), seq=c.id)
+
+change_feed.subscribe("content", _contents_changed)
+
+def _parse_cursor(cursor: str) -> Tuple[datetime, int]:
+    # cursor format: "<published_at isoformat>,<content id>"
+    try:
+        ts, cid = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(ts), int(cid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _make_cursor(c) -> str:
+    return f"{c.published_at.isoformat()},{c.id}"
 
 @router.post("/publish_content")
-def publish_content(payload: PublishIn, db: Session = Depends(get_db)):
+async def publish_content(payload: PublishIn, db: AsyncSession = Depends(get_db)):
     # author_id=0 for MVP (no auth yet)
     content = Content(title=payload.title, body=payload.body, link=payload.link, author_id=0)
-    db.add(content)
-    db.flush()
+    async with write_lock(db):
+        db.add(content)
+        await db.flush()
+
+        # store visibility
+        for lvl in (payload.levels or []):
+            db.add(ContentVisibility(content_id=content.id, level_target=lvl))
+        for uid in set(payload.user_ids or []):
+            db.add(ContentVisibility(content_id=content.id, user_id=uid))
 
-    # store visibility
-    for lvl in (payload.levels or []):
-        db.add(ContentVisibility(content_id=content.id, level_target=lvl))
+        await db.commit()
+    await change_feed.poll()
 
-    db.commit()
+    return {"content_id": content.id, "levels": payload.levels, "user_ids": payload.user_ids}
 
-    return {"content_id": content.id, "levels": payload.levels}
+def _notification_parts(c: Content) -> List[str]:
+    # Telegram's limit is in UTF-16 units: a long content is sent whole, as several messages
+    return split_message(notification_text(c.title, c.body, c.link))
 
 @router.post("/send_notification")
-def send_notification(payload: SendNotifIn, db: Session = Depends(get_db)):
-    c = db.get(Content, payload.content_id)
+async def send_notification(payload: SendNotifIn, db: AsyncSession = Depends(get_db)):
+    c = await db.get(Content, payload.content_id)
     if not c:
         raise HTTPException(status_code=404, detail="Content not found")
+    if payload.level is None and not payload.user_ids:
+        raise HTTPException(status_code=400, detail="Specify a level or user_ids")
+    if not get_telegram().enabled:
+        raise HTTPException(status_code=503, detail="Telegram bot token not configured")
+
+    chat_ids = []
+    channel_id = None
+    if payload.level is not None:
+        channel_id = LEVEL_CHANNELS.get(payload.level)
+        if not channel_id:
+            raise HTTPException(status_code=400, detail=f"Channel for level {payload.level} not configured")
+        chat_ids.append(channel_id)
+    if payload.user_ids:
+        chat_ids += (await db.execute(select(User.telegram_id).where(User.id.in_(payload.user_ids)))).scalars().all()
+
+    # queued for the delivery workers; poll /notifications/{job_id} for progress
+    parts = _notification_parts(c)
+    try:
+        # a chat's parts are queued in order, and its sends are served in order
+        job = delivery.submit("sendMessage", [{"chat_id": chat_id, "text": part}
+                                              for chat_id in chat_ids for part in parts])
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    # saved right away, so the other API workers can report it too
+    await delivery.flush()
+
+    return {"content_id": c.id, "level": payload.level, "channel_id": channel_id,
+            "job_id": job.id, "recipients": len(chat_ids), "messages": job.total, "status": job.status}
 
-    channel_id = LEVEL_CHANNELS.get(payload.level)
-    if not channel_id:
-        raise HTTPException(status_code=400, detail=f"Channel for level {payload.level} not configured")
+def _to_scheduled_out(s: ScheduledContent) -> ScheduledOut:
+    return ScheduledOut(
+        id=s.id,
+        title=s.title,
+        publish_at=s.publish_at.isoformat(),
+        levels=json.loads(s.levels),
+        user_ids=json.loads(s.user_ids),
+        notify=s.notify,
+        status=s.status.value,
+        content_id=s.content_id,
+        job_id=s.batch_id,
+    )
+
+@router.post("/schedule_content", response_model=ScheduledOut)
+async def schedule_content(payload: ScheduleIn, db: AsyncSession = Depends(get_db)):
+    """Publish (and announce, unless notify=false) at publish_at; a time in the past publishes right away."""
+    publish_at = payload.publish_at
+    if publish_at.tzinfo is not None:
+        publish_at = publish_at.astimezone(timezone.utc).replace(tzinfo=None)
+    s = ScheduledContent(title=payload.title, body=payload.body, link=payload.link,
+                         levels=json.dumps(sorted(set(payload.levels))), user_ids=json.dumps(sorted(set(payload.user_ids))),
+                         notify=payload.notify, publish_at=publish_at, status=ScheduleStatus.scheduled)
+    async with write_lock(db):
+        db.add(s)
+        await db.commit()
+    scheduler.schedule(s.publish_at)
+    return _to_scheduled_out(s)
+
+@router.get("/scheduled", response_model=List[ScheduledOut])
+async def list_scheduled(limit: int = Query(100, ge=1, le=1000), db: AsyncSession = Depends(get_db)):
+    """Contents still waiting to be published, soonest first."""
+    rows = (await db.execute(
+        select(ScheduledContent).where(ScheduledContent.status == ScheduleStatus.scheduled)
+        .order_by(ScheduledContent.publish_at, ScheduledContent.id).limit(limit)
+    )).scalars().all()
+    return [_to_scheduled_out(s) for s in rows]
+
+@router.get("/scheduled/{schedule_id}", response_model=ScheduledOut)
+async def get_scheduled(schedule_id: int, db: AsyncSession = Depends(get_db)):
+    s = await db.get(ScheduledContent, schedule_id)
+    if not s:
+        raise HTTPException(status_code=404, detail="Scheduled content not found")
+    return _to_scheduled_out(s)
+
+@router.delete("/scheduled/{schedule_id}", response_model=ScheduledOut)
+async def cancel_scheduled(schedule_id: int, db: AsyncSession = Depends(get_db)):
+    # conditional, so it can't race with the scheduler publishing it
+    async with write_lock(db):
+        cancelled = (await db.execute(
+            update(ScheduledContent)
+            .where(ScheduledContent.id == schedule_id, ScheduledContent.status == ScheduleStatus.scheduled)
+            .values(status=ScheduleStatus.cancelled)
+            .returning(ScheduledContent.id)
+        )).scalar()
+        await db.commit()
+    s = await db.get(ScheduledContent, schedule_id, populate_existing=True)
+    if not s:
+        raise HTTPException(status_code=404, detail="Scheduled content not found")
+    if cancelled is None:
+        raise HTTPException(status_code=409, detail=f"Content already {s.status.value}")
+    return _to_scheduled_out(s)
+
+@router.get("/notifications/{job_id}")
+async def notification_status(job_id: str, db: AsyncSession = Depends(get_db)):
+    job = delivery.get_job(job_id)
+    if job:
+        return job.as_dict()
+    # sends still queued at a shutdown were moved to the outbox under the job id
+    spilled = await outbox_batch_status(db, job_id)
+    if spilled:
+        return spilled
+    # running in another API worker (or finished before a restart): its last saved progress
+    saved = await db.get(DeliveryProgress, job_id)
+    if not saved:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return DeliveryJob(id=saved.id, total=saved.total, sent=saved.sent, failed=saved.failed,
+                       errors=json.loads(saved.errors)).as_dict()
 
-    # Here you would implement the logic to send a message to the Telegram channel
-    # For now, we just simulate it by printing to the console
-    print(f"Simulating sending notification for content {c.id} to channel {channel_id} for level {payload.level}")
-    
-    return {"content_id": c.id, "level": payload.level, "channel_id": channel_id, "status": "sent"}
+def _page(q, before: Optional[str], limit: int):
+    if before:
+        ts, cid = _parse_cursor(before)
+        q = q.where(or_(Content.published_at < ts, and_(Content.published_at == ts, Content.id < cid)))
+    return q.order_by(Content.published_at.desc(), Content.id.desc()).limit(limit)
+
+async def _history_page(db: AsyncSession, q, request: Request, before: Optional[str], limit: int):
+    """A page of q (a select of CONTENT_OUT_COLUMNS), 304 when If-None-Match has its ETag."""
+    rows = (await db.execute(_page(q, before, limit))).all()
+    levels = await _levels_by_content(db, [row.id for row in rows])
+    headers = {"X-Next-Cursor": _make_cursor(rows[-1])} if len(rows) == limit else None
+    return json_response(request, [_content_dict(row, levels[row.id]) for row in rows], headers)
+
+def visible_to(user: User, content_id):
+    """Filter on the content_id column: direct grants, plus level targets <= user.level when active."""
+    if user.status != UserStatus.active:
+        # only direct grants: few rows, resolved through ix_visibility_user_content
+        granted = select(ContentVisibility.content_id).where(ContentVisibility.user_id == user.id)
+        return content_id.in_(granted)
+    # probe the (content_id, ...) unique indexes per row: walking ix_contents_published_at_id
+    # newest first, a page costs ~limit index lookups regardless of table size
+    visible = select(ContentVisibility.id).where(
+        ContentVisibility.content_id == content_id,
+        or_(ContentVisibility.level_target <= user.level, ContentVisibility.user_id == user.id),
+    )
+    return visible.exists()
+
+def feed_query(user: User):
+    """Contents visible to `user`, as rows of CONTENT_OUT_COLUMNS."""
+    return select(*CONTENT_OUT_COLUMNS).where(visible_to(user, Content.id))
+
+@router.get("/search", response_model=List[ContentSearchOut])
+async def search_contents(
+    q: str = Query(..., min_length=1, max_length=200),
+    telegram_id: Optional[int] = Query(None, description="only the contents this user can see"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    db: AsyncSession = Depends(get_db),
+):
+    """Contents matching every word of `q` ("word*" for a prefix), best match first, through
+    the full-text index (db/fulltext.py). Queries too broad to rank quickly (a word in more
+    than SEARCH_RANK_MAX_MATCHES posts) come newest first, with a null score."""
+    words = fulltext.terms(q)
+    if not words:
+        return []
+    visible = None
+    if telegram_id is not None:
+        u = (await db.execute(select(User).where(User.telegram_id == telegram_id))).scalar_one_or_none()
+        if not u:
+            raise HTTPException(status_code=404, detail="User not found")
+        visible = lambda content_id: visible_to(u, content_id)  # noqa: E731
+    dialect = db.get_bind().dialect.name
+    rank = not (await db.execute(fulltext.broad(dialect, words, SEARCH_RANK_MAX_MATCHES))).scalar()
+    hits = (await db.execute(fulltext.search(dialect, words, rank, limit, offset, visible))).all()
+    ids = [h.id for h in hits]
+    if not ids:
+        return []
+    contents = {c.id: c for c in (await db.execute(select(Content).where(Content.id.in_(ids)))).scalars()}
+    levels = await _levels_by_content(db, ids)
+    return [
+        ContentSearchOut(**_to_content_out(contents[h.id], levels[h.id]).model_dump(),
+                         score=round(h.score, 4) if h.score is not None else None, snippet=h.snippet or "")
+        for h in hits if h.id in contents
+    ]
 
 @router.get("/history", response_model=List[ContentOut])
-def get_history(db: Session = Depends(get_db)):
-    items = db.execute(select(Content)).scalars().all()
-    items.sort(key=lambda c: c.published_at, reverse=True)
-    return [_to_content_out(c, db) for c in items]
+async def get_history(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Cursor returned in X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db),
+):
+    return await _history_page(db, select(*CONTENT_OUT_COLUMNS), request, before, limit)
+
+@router.get("/history/{telegram_id}", response_model=List[ContentOut])
+async def get_user_history(
+    telegram_id: int,
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Cursor returned in X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db),
+):
+    u = (await db.execute(select(User).where(User.telegram_id == telegram_id))).scalar_one_or_none()
+    if not u:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await _history_page(db, feed_query(u), request, before, limit)
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Header, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from ..services.admin_events import admin_events
+from ..services.change_feed import change_feed
+
+router = APIRouter()
+
+@router.get("")
+async def stream_events(
+    last_event_id: Optional[str] = Header(None),
+    after: Optional[str] = Query(None, description="id of the last event seen, for clients that can't set Last-Event-ID"),
+):
+    """Server-sent events for the admin panels (see services/admin_events.py).
+
+    event: user (UserOut), user_deleted ({"id"}), users_changed (import: reload the list),
+    content (ContentOut), reset (events were missed: reload everything). EventSource sends
+    the last id back on reconnection, to whichever worker, so nothing is lost across a
+    dropped connection.
+    """
+    # the client may come from a worker ahead of this one
+    await change_feed.poll()
+    return StreamingResponse(
+        admin_events.stream(last_event_id or after),
+        media_type="text/event-stream",
+        # no caching or proxy buffering of the stream (nginx honours X-Accel-Buffering)
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,43 @@
+from datetime import timezone
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db.session import get_db, write_lock
+from ..models.models import JobCheckpoint
+from ..schemas.memberships import MemberUpdatesIn
+from ..services import membership
+from ..services.outbox import batch_status as outbox_batch_status
+
+router = APIRouter()
+
+@router.post("")
+async def record_memberships(payload: MemberUpdatesIn, db: AsyncSession = Depends(get_db)):
+    """Joins/leaves of the level channels (chat_member updates forwarded by the bot)."""
+    async with write_lock(db):
+        updates = [u.model_dump() for u in payload.updates]
+        for u in updates:
+            if u["date"].tzinfo is not None:
+                u["date"] = u["date"].astimezone(timezone.utc).replace(tzinfo=None)
+        applied = await membership.record(db, updates)
+        await db.commit()
+    return {"applied": applied}
+
+@router.post("/reconcile")
+async def reconcile(full: bool = Query(False, description="check every membership, not only the changed ones"),
+                    force: bool = Query(False, description="kick even more than RECONCILE_MAX_KICKS members")):
+    """Run the channel membership reconciliation now; the kicks go to the outbox (job_id)."""
+    return await membership.reconciler.run(full=full, force=force)
+
+@router.get("/reconcile")
+async def reconcile_status(db: AsyncSession = Depends(get_db)):
+    """Checkpoint of the last run and progress of its kicks."""
+    checkpoint = (await db.execute(
+        select(JobCheckpoint).where(JobCheckpoint.name == membership.CHECKPOINT)
+    )).scalar_one_or_none()
+    job = await outbox_batch_status(db, checkpoint.batch_id) if checkpoint and checkpoint.batch_id else None
+    return {
+        "checkpoint": checkpoint.position.isoformat() if checkpoint else None,
+        "ran_at": checkpoint.ran_at.isoformat() if checkpoint else None,
+        "last_run": membership.reconciler.last_run,
+        "job": job,
+    }
@@ -1,49 +1,120 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
-from typing import Optional, List
-from sqlalchemy.orm import Session
-from ..schemas.users import RegisterUserIn, UserOut, ApproveUserIn
-from ..db.session import get_db
-from ..models.models import User, UserStatus
-from ..config import TELEGRAM_BOT_TOKEN, LEVEL_CHANNELS
-import httpx
+from fastapi import APIRouter, HTTPException, Header, Query, Depends, Request
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, List, Literal, Optional
+from datetime import datetime
+from pydantic import ValidationError
+from sqlalchemy import and_, case, func, literal_column, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..schemas.users import RegisterUserIn, UserOut, ApproveUserIn, ImportUserIn, BulkApproveIn, BulkLevelIn
+from ..db.session import get_db, write_lock, AsyncSessionLocal
+from ..db.dialect import insert_for
+from ..models.models import ChannelMember, User, UserStatus
+from ..config import LEVEL_CHANNELS
+from ..services.telegram import TelegramClient, get_telegram
+from ..services.invite_links import invite_links as invite_link_cache
+from ..services.user_stats import user_stats
+from ..services.user_events import user_events
+from ..services.admin_events import admin_events
+from ..services.cache import user_cache
+from ..services.change_feed import change_feed
+from ..services.outbox import outbox, action as outbox_action, enqueue as outbox_enqueue, batch_status as outbox_batch_status
+from ..services.responses import json_response
+import asyncio
+import csv
+import io
+import json
+import logging
+import uuid
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+EXPORT_COLUMNS = ["id", "telegram_id", "first_name", "last_name", "phone", "email", "indirizzo",
+                  "varie", "level", "status", "approved_by", "registered_at"]
+EXPORT_CHUNK = 1000   # rows fetched from the server-side cursor and sent per chunk
+IMPORT_BATCH = 1000   # rows per executemany upsert
+IMPORT_MAX_ERRORS = 20
+BULK_CHUNK = 500      # ids per IN (...) of the bulk UPDATEs, well under SQLite's variable limit
+ADMIN_EVENTS_MAX_USERS = 500  # users changed at once beyond which the admin panels just reload
 
-def _to_user_out(u: User) -> UserOut:
-    return UserOut(
-        id=u.id,
-        telegram_id=u.telegram_id,
-        first_name=u.first_name,
-        last_name=u.last_name,
-        phone=u.phone,
-        email=u.email,
-        indirizzo=u.indirizzo,
-        varie=u.varie,
-        level=u.level,
-        status=u.status.value if isinstance(u.status, UserStatus) else u.status,
-        approved_by=u.approved_by,
+# UserOut's columns: the read endpoints select these as plain rows, no ORM objects
+USER_OUT_FIELDS = tuple(UserOut.model_fields)
+USER_OUT_COLUMNS = [User.__table__.c[name] for name in USER_OUT_FIELDS]
+
+
+def _user_dict(row) -> dict:
+    """UserOut as a plain dict, from a row of USER_OUT_COLUMNS."""
+    d = dict(zip(USER_OUT_FIELDS, row))
+    if isinstance(d["status"], UserStatus):
+        d["status"] = d["status"].value
+    return d
+
+def _to_user_out(u) -> UserOut:
+    return UserOut(**_user_dict([getattr(u, name) for name in USER_OUT_FIELDS]))
+
+async def _users_changed(changes, position: int):
+    """Change feed handler (services/change_feed.py): users were written, by this process or
+    another one. Drop the cached totals and lookups and publish the changes to user caches
+    (the bot) and to the admin panels; `changes` None means they were missed: start over."""
+    user_stats.invalidate()
+    if changes is None:
+        await user_cache.invalidate()
+        user_events.start_at(position)
+        admin_events.start_at(position)  # for the contents too
+        return
+    await user_cache.invalidate({c.telegram_id for c in changes if c.telegram_id is not None})
+    user_events.changed((c.id, c.telegram_id) for c in changes if c.telegram_id is not None)
+    last = {c.row_id: c.id for c in changes}
+    if len(last) > ADMIN_EVENTS_MAX_USERS:
+        admin_events.publish("users_changed", {}, seq=position)
+        return
+    users = {}
+    async with AsyncSessionLocal() as db:
+        for ids in _chunks(list(last)):
+            users.update((u.id, u) for u in (await db.execute(select(*USER_OUT_COLUMNS).where(User.id.in_(ids)))))
+    # one event per user, for its last change
+    for c in changes:
+        if last[c.row_id] != c.id:
+            continue
+        if c.row_id in users:
+            admin_events.publish("user", _user_dict(users[c.row_id]), seq=c.id)
+        else:
+            admin_events.publish("user_deleted", {"id": c.row_id}, seq=c.id)
+
+change_feed.subscribe("user", _users_changed)
+
+def _status_for_level(level: int) -> UserStatus:
+    return UserStatus.active if level == 1 else UserStatus.pending
+
+def _upsert_users(db: AsyncSession, keep_active: bool = True):
+    """INSERT ... ON CONFLICT(telegram_id) DO UPDATE for users.
+
+    With keep_active an already active user stays active and anyone else gets the
+    inserted status (the /register rules); without it the inserted status always wins.
+    """
+    stmt = insert_for(db, User)
+    status = stmt.excluded.status
+    if keep_active:
+        status = case((User.status == UserStatus.active, User.status), else_=stmt.excluded.status)
+    return stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={
+            "first_name": stmt.excluded.first_name,
+            "last_name": stmt.excluded.last_name,
+            "phone": stmt.excluded.phone,
+            "email": stmt.excluded.email,
+            "indirizzo": stmt.excluded.indirizzo,
+            "varie": stmt.excluded.varie,
+            "level": stmt.excluded.level,
+            "status": status,
+            "updated_at": stmt.excluded.updated_at,
+        },
     )
 
 @router.post("/register_user", response_model=UserOut)
-def register_user(payload: RegisterUserIn, db: Session = Depends(get_db)):
-    # upsert by telegram_id
-    u = db.query(User).filter(User.telegram_id == payload.telegram_id).first()
-    target_status = UserStatus.active if payload.level == 1 else UserStatus.pending
-    if u:
-        if u.status != UserStatus.active:
-            u.status = target_status
-        u.first_name = payload.first_name
-        u.last_name = payload.last_name
-        u.phone = payload.phone
-        u.email = payload.email
-        u.indirizzo = payload.indirizzo
-        u.varie = payload.varie
-        u.level = payload.level
-        db.commit()
-        db.refresh(u)
-        return _to_user_out(u)
-    u = User(
+async def register_user(payload: RegisterUserIn, db: AsyncSession = Depends(get_db)):
+    # upsert by telegram_id in one statement: concurrent /register for the same user can't race
+    stmt = _upsert_users(db).values(
         telegram_id=payload.telegram_id,
         first_name=payload.first_name,
         last_name=payload.last_name,
@@ -52,155 +123,490 @@ def register_user(payload: RegisterUserIn, db: Session = Depends(get_db)):
         indirizzo=payload.indirizzo,
         varie=payload.varie,
         level=payload.level,
-        status=target_status,
-    )
-    db.add(u)
-    db.commit()
-    db.refresh(u)
+        status=_status_for_level(payload.level),
+    ).returning(*User.__table__.columns)
+    # a single statement needs no surrounding transaction: in autocommit the SQLite write
+    # lock is held for the statement only, not across an event loop round-trip to COMMIT
+    conn = await db.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+    async with write_lock():
+        u = (await conn.execute(stmt)).one()
+    # hand the connection back: kept, it would be held while change_feed.poll() waits for
+    # one of its own, and a burst of registrations would hold every pooled connection
+    await db.close()
+    await change_feed.poll()
     return _to_user_out(u)
 
 @router.post("/approve_user")
-def approve_user(payload: ApproveUserIn, db: Session = Depends(get_db)):
-    u = db.get(User, payload.user_id)
-    if not u:
-        raise HTTPException(status_code=404, detail="User not found")
-    u.status = UserStatus.active if payload.approve else UserStatus.rejected
-    db.commit()
+async def approve_user(payload: ApproveUserIn, db: AsyncSession = Depends(get_db)):
+    async with write_lock(db):
+        u = await db.get(User, payload.user_id)
+        if not u:
+            raise HTTPException(status_code=404, detail="User not found")
+        u.status = UserStatus.active if payload.approve else UserStatus.rejected
+        await db.commit()
+    await change_feed.poll()
     return {"user_id": u.id, "status": u.status.value}
 
-@router.get("", response_model=List[UserOut])
-def list_users(level: Optional[int] = Query(None), status: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    q = db.query(User)
+def _filter_users(q, level: Optional[int], status: Optional[str]):
     if level is not None:
-        q = q.filter(User.level == level)
+        q = q.where(User.level == level)
     if status is not None:
         try:
             st = UserStatus(status)
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid status")
-        q = q.filter(User.status == st)
-    users = q.order_by(User.id.asc()).all()
-    return [_to_user_out(u) for u in users]
+        q = q.where(User.status == st)
+    return q
+
+# sort key -> (key expression or None for plain id order, descending)
+# '' inline, not bound: SQLite only uses an expression index for the identical expression
+LAST_NAME_KEY = func.coalesce(func.lower(User.last_name), literal_column("''"))
+USER_SORTS = {"id": (None, False), "-id": (None, True), "last_name": (LAST_NAME_KEY, False), "-last_name": (LAST_NAME_KEY, True)}
+
+def _prefix_range(expr, prefix: str):
+    # expr LIKE 'prefix%' as a range, so the (expression) index on expr is used
+    return and_(expr >= prefix, expr < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+def _search_users(q, prefix: str):
+    terms = [
+        _prefix_range(func.lower(User.first_name), prefix),
+        _prefix_range(LAST_NAME_KEY, prefix),
+        _prefix_range(func.lower(User.email), prefix),
+        _prefix_range(User.phone, prefix),
+    ]
+    if prefix.isdigit():
+        terms.append(User.telegram_id == int(prefix))
+    return q.where(or_(*terms))
+
+def _user_page(q, sort: str, after: Optional[str], limit: int, search: bool = False):
+    """Keyset page over (key, id): `after` is the X-Next-Cursor of the previous page."""
+    key, desc = USER_SORTS[sort]
+    # "+ 0" hides the primary key order from SQLite's planner, which otherwise walks the
+    # whole table in id order instead of the (much smaller) indexed OR of a prefix search
+    id_order = User.id + 0 if search else User.id
+    if after is not None:
+        # cursor: "<id>" for the id sorts, "<key>,<id>" otherwise
+        after_key, _, after_id = after.rpartition(",")
+        try:
+            after_id = int(after_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if key is None:
+            q = q.where(User.id < after_id if desc else User.id > after_id)
+        elif desc:
+            # the bare range on key lets the (key, id) index seek straight to the cursor
+            q = q.where(key <= after_key, or_(key < after_key, User.id < after_id))
+        else:
+            q = q.where(key >= after_key, or_(key > after_key, User.id > after_id))
+    order = [id_order.desc() if desc else id_order.asc()]
+    if key is not None:
+        order.insert(0, key.desc() if desc else key.asc())
+    return q.order_by(*order).limit(limit + 1)
+
+def _user_cursor(row, sort: str) -> str:
+    # the key comes from the database: its lower() may differ from str.lower() outside ASCII
+    if USER_SORTS[sort][0] is None:
+        return str(row.id)
+    return f"{row.sort_key},{row.id}"
+
+@router.get("", response_model=List[UserOut])
+async def list_users(
+    request: Request,
+    level: Optional[int] = Query(None),
+    status: Optional[str] = Query(None),
+    q: Optional[str] = Query(None, max_length=100, description="prefix of first/last name, email or phone, or a telegram_id"),
+    sort: Literal["id", "-id", "last_name", "-last_name"] = Query("id"),
+    after: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    after_id: Optional[int] = Query(None, description="shorthand for `after` with the id sorts"),
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """One page of users; the cursor for the next one is in the X-Next-Cursor header.
+    Answers 304 when If-None-Match has the page's ETag."""
+    if after is None and after_id is not None:
+        if USER_SORTS[sort][0] is not None:
+            raise HTTPException(status_code=400, detail="after_id requires sort=id or sort=-id")
+        after = str(after_id)
+    key = USER_SORTS[sort][0]
+    columns = USER_OUT_COLUMNS if key is None else USER_OUT_COLUMNS + [key.label("sort_key")]
+    query = _filter_users(select(*columns), level, status)
+    q = (q or "").strip().lower()
+    if q:
+        query = _search_users(query, q)
+    rows = (await db.execute(_user_page(query, sort, after, limit, search=bool(q)))).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = _user_cursor(rows[-1], sort)
+    return json_response(request, [_user_dict(row) for row in rows], headers)
+
+@router.get("/stats")
+async def get_user_stats():
+    """Totals per level and per status (cached, see services/user_stats.py)."""
+    return await user_stats.get()
+
+@router.get("/changes")
+async def get_user_changes(
+    after: int = Query(0, ge=0),
+    timeout: float = Query(25, ge=0, le=60),
+):
+    """Long poll: telegram_ids of the users changed after `after` (see services/user_events.py).
+
+    Answers as soon as there is a change, or after `timeout` seconds with an empty list;
+    pass back the returned seq. reset=true means: drop every cached user.
+    """
+    if after > user_events.seq:
+        # the client's last answer came from a worker ahead of this one
+        await change_feed.poll()
+    return await user_events.since(after, timeout)
+
+@router.get("/cache_stats")
+async def get_cache_stats():
+    """Hit/miss counters of the user lookup cache (services/cache.py)."""
+    return user_cache.stats()
+
+def _export_value(v):
+    if isinstance(v, UserStatus):
+        return v.value
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v
+
+async def _export_rows(q, format: str) -> AsyncIterator[str]:
+    # own session: the request's get_db session is closed before a streamed body is sent
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(q.execution_options(yield_per=EXPORT_CHUNK))
+        if format == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(EXPORT_COLUMNS)
+            async for rows in result.partitions():
+                writer.writerows([_export_value(v) for v in row] for row in rows)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            yield buf.getvalue()
+        else:
+            async for rows in result.partitions():
+                yield "".join(
+                    json.dumps(dict(zip(EXPORT_COLUMNS, map(_export_value, row))), ensure_ascii=False) + "\n"
+                    for row in rows
+                )
+
+@router.get("/export")
+async def export_users(
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    level: Optional[int] = Query(None),
+    status: Optional[str] = Query(None),
+):
+    """Stream all (filtered) users as NDJSON or CSV without loading them in memory."""
+    q = _filter_users(select(*(User.__table__.c[name] for name in EXPORT_COLUMNS)), level, status)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_rows(q.order_by(User.id.asc()), format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="users.{format}"'},
+    )
+
+async def _body_lines(request: Request) -> AsyncIterator[str]:
+    # split the request body into lines as it arrives, never holding the whole upload
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig") + "\n"
+    if pending:
+        yield pending.decode("utf-8-sig")
+
+async def _import_records(request: Request, format: str) -> AsyncIterator[tuple]:
+    """(line number, dict) per record of an NDJSON or CSV (with header) upload."""
+    lineno, header, record = 0, None, ""
+    async for line in _body_lines(request):
+        lineno += 1
+        if format == "ndjson":
+            if line.strip():
+                try:
+                    yield lineno, json.loads(line)
+                except ValueError as e:
+                    yield lineno, e
+            continue
+        # a quoted CSV field may span lines: keep reading until the quotes are balanced
+        record += line
+        if record.count('"') % 2:
+            continue
+        fields, record = next(csv.reader([record]), []), ""
+        if not fields:
+            continue
+        if header is None:
+            header = [f.strip() for f in fields]
+            continue
+        row = {k: v for k, v in zip(header, fields) if v != ""}
+        if "level" in row and row["level"].isdigit():
+            row["level"] = int(row["level"])
+        yield lineno, row
+
+def _import_error(e: ValueError) -> str:
+    if isinstance(e, ValidationError):
+        err = e.errors(include_url=False)[0]
+        return f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}"
+    return str(e)
+
+@router.post("/import")
+async def import_users(request: Request, format: Literal["ndjson", "csv"] = Query("ndjson"), db: AsyncSession = Depends(get_db)):
+    """Bulk upsert users by telegram_id from an NDJSON or CSV request body (same columns as /export).
+
+    Rows with a status keep it; rows without one follow the /register rules. Rows are
+    written in batches of IMPORT_BATCH, so memory stays flat whatever the file size.
+    """
+    imported, failed, errors = 0, 0, []
+    # rows with an explicit status and rows following the register rules need different statements
+    batches: Dict[bool, List[dict]] = {True: [], False: []}
+
+    async def flush(explicit: bool):
+        nonlocal imported
+        rows = batches[explicit]
+        if not rows:
+            return
+        async with write_lock(db):
+            await db.execute(_upsert_users(db, keep_active=not explicit), rows)
+            await db.commit()
+        await change_feed.poll()
+        imported += len(rows)
+        batches[explicit] = []
+
+    async for lineno, record in _import_records(request, format):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            u = ImportUserIn.model_validate(record)
+        except ValueError as e:  # also pydantic's ValidationError
+            failed += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({"line": lineno, "error": _import_error(e)})
+            continue
+        explicit = u.status is not None
+        row = u.model_dump(exclude={"status"})
+        row["status"] = UserStatus(u.status) if explicit else _status_for_level(u.level)
+        batches[explicit].append(row)
+        if len(batches[explicit]) >= IMPORT_BATCH:
+            await flush(explicit)
+    await flush(True)
+    await flush(False)
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+@router.get("/invite_links")
+async def get_invite_links(level: int = Query(..., ge=1, le=4)):
+    """Shared invite links for channels 1..level (served from the invite link cache)."""
+    tg = get_telegram()
+    levels = list(range(1, level + 1))
+
+    async def _link(l: int) -> dict:
+        channel_id = LEVEL_CHANNELS.get(l)
+        if not channel_id:
+            return {"level": l, "invite_link": None, "error": "Canale non configurato"}
+        if not tg.enabled:
+            return {"level": l, "invite_link": None, "error": "Bot Telegram non configurato"}
+        try:
+            return {"level": l, "invite_link": await invite_link_cache.get(channel_id), "error": None}
+        except Exception as e:
+            return {"level": l, "invite_link": None, "error": str(e)}
+
+    return {"links": await asyncio.gather(*(_link(l) for l in levels))}
 
 @router.post("/change_level")
-async def change_level(user_id: int, level: int, db: Session = Depends(get_db)):
+async def change_level(user_id: int, level: int, db: AsyncSession = Depends(get_db),
+                       idempotency_key: Optional[str] = Header(None)):
     if level not in (1,2,3,4):
         raise HTTPException(status_code=400, detail="Invalid level")
-    u = db.get(User, user_id)
-    if not u:
-        raise HTTPException(status_code=404, detail="User not found")
-    old_level = u.level
-    u.level = level
-    db.commit()
+    async with write_lock(db):
+        u = await db.get(User, user_id)
+        if not u:
+            raise HTTPException(status_code=404, detail="User not found")
+        old_level = u.level
+        u.level = level
+        # channel updates are committed with the level and sent by the outbox worker
+        queued = 0
+        if get_telegram().enabled and u.telegram_id:
+            request_key = f"change_level:{user_id}:{idempotency_key}" if idempotency_key else None
+            queued = await outbox_enqueue(db, _channel_actions(u.telegram_id, old_level, level), request_key)
+        await db.commit()
+    await change_feed.poll()
+    outbox.notify()
+    return {"user_id": u.id, "level": u.level, "queued": queued}
+
+def _channel_actions(telegram_id: int, old_level: int, level: int) -> List[dict]:
+    """Outbox actions for a level change: kick from the channels above the new level, then
+    message the user with invite links up to it. Bans/unbans are ordered per channel and user,
+    messages per user chat."""
+    removed = [LEVEL_CHANNELS[l] for l in range(level + 1, old_level + 1) if LEVEL_CHANNELS.get(l)]
+    actions = []
     # Kick from channels beyond new level if level decreased (kick without permanent ban)
-    if TELEGRAM_BOT_TOKEN and u.telegram_id and old_level > level:
-        for l in range(level + 1, old_level + 1):
-            channel_id = LEVEL_CHANNELS.get(l)
-            if channel_id:
-                url_kick = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/banChatMember"
-                payload_kick = {
-                    "chat_id": channel_id,
-                    "user_id": u.telegram_id,
-                    "revoke_messages": False
-                }
-                try:
-                    async with httpx.AsyncClient() as client:
-                        await client.post(url_kick, json=payload_kick)
-                        # Immediately unban to kick without permanent ban
-                        await client.post(f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/unbanChatMember", json={
-                            "chat_id": channel_id,
-                            "user_id": u.telegram_id,
-                            "only_if_banned": True
-                        })
-                    print(f"Kicked {u.telegram_id} from {channel_id} without permanent ban")
-                except Exception as e:
-                    print(f"Error kicking {u.telegram_id} from {channel_id}: {e}")
-    # Generate invite links for all levels 1 to current level
+    for ch in removed:
+        key = f"{ch}:{telegram_id}"
+        actions.append(outbox_action("banChatMember", {"chat_id": ch, "user_id": telegram_id, "revoke_messages": False}, key))
+        actions.append(outbox_action("unbanChatMember", {"chat_id": ch, "user_id": telegram_id, "only_if_banned": True}, key))
+    actions.append(outbox_action("sendLevelMessage", {"chat_id": telegram_id, "level": level}, str(telegram_id)))
+    return actions
+
+async def _send_level_message(tg: TelegramClient, payload: dict):
+    """Outbox handler: level change message, with the invite links current at send time."""
+    level = payload["level"]
+    kept = [(l, LEVEL_CHANNELS[l]) for l in range(1, level + 1) if LEVEL_CHANNELS.get(l)]
+    results = await asyncio.gather(*(invite_link_cache.get(ch) for _, ch in kept), return_exceptions=True)
     invite_links = []
-    for l in range(1, level + 1):
-        channel_id = LEVEL_CHANNELS.get(l)
-        if TELEGRAM_BOT_TOKEN and channel_id:
-            url_invite = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/createChatInviteLink"
-            payload_invite = {"chat_id": channel_id, "expires_in": 0}
-            try:
-                async with httpx.AsyncClient() as client:
-                    r = await client.post(url_invite, json=payload_invite)
-                    if r.status_code == 200:
-                        data = r.json()
-                        if data.get("ok"):
-                            invite_link = data.get("result", {}).get("invite_link")
-                            if invite_link:
-                                invite_links.append(f"Livello {l}: {invite_link}")
-            except Exception as e:
-                print(f"Error generating invite link for level {l}: {e}")
-    if TELEGRAM_BOT_TOKEN and u.telegram_id:
-        text = f"Il tuo livello è stato aggiornato a {level}."
-        if invite_links:
-            text += "\nLink per unirti ai canali:\n" + "\n".join(invite_links)
-        else:
-            text += "\nContatta l'admin per accedere ai canali."
-        url_send = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload_send = {"chat_id": u.telegram_id, "text": text}
-        try:
-            async with httpx.AsyncClient() as client:
-                await client.post(url_send, json=payload_send)
-        except Exception as e:
-            print(f"Error sending message to {u.telegram_id}: {e}")
-    return {"user_id": u.id, "level": u.level}
+    for (l, ch), res in zip(kept, results):
+        if isinstance(res, Exception):
+            logger.warning("Error generating invite link for level %s: %s", l, res)
+        elif res:
+            invite_links.append(f"Livello {l}: {res}")
+
+    text = f"Il tuo livello è stato aggiornato a {level}."
+    if invite_links:
+        text += "\nLink per unirti ai canali:\n" + "\n".join(invite_links)
+    else:
+        text += "\nContatta l'admin per accedere ai canali."
+    return await tg.call("sendMessage", {"chat_id": payload["chat_id"], "text": text})
+
+outbox.register("sendLevelMessage", _send_level_message)
+
+def _chunks(ids: List[int]):
+    ids = list(dict.fromkeys(ids))
+    for i in range(0, len(ids), BULK_CHUNK):
+        yield ids[i:i + BULK_CHUNK]
+
+@router.post("/bulk/approve")
+async def bulk_approve(payload: BulkApproveIn, db: AsyncSession = Depends(get_db)):
+    """Approve (or reject) many users with set-based UPDATEs in a single transaction."""
+    status = UserStatus.active if payload.approve else UserStatus.rejected
+    updated = {}
+    async with write_lock(db):
+        for ids in _chunks(payload.user_ids):
+            res = await db.execute(
+                update(User).where(User.id.in_(ids)).values(status=status).returning(*User.__table__.columns)
+            )
+            updated.update((row.id, row) for row in res)
+        await db.commit()
+    await change_feed.poll()
+    return {
+        "status": status.value,
+        "updated": len(updated),
+        "missing": [uid for uid in dict.fromkeys(payload.user_ids) if uid not in updated],
+    }
+
+@router.post("/bulk/change_level")
+async def bulk_change_level(payload: BulkLevelIn, db: AsyncSession = Depends(get_db),
+                            idempotency_key: Optional[str] = Header(None)):
+    """Move many users to one level in a single transaction.
+
+    The per-user kicks and messages are written to the outbox in the same transaction
+    under one batch id; poll GET /api/users/jobs/{job_id} for their progress.
+    """
+    tg = get_telegram()
+    batch_id = uuid.uuid4().hex
+    old_levels: Dict[int, tuple] = {}
+    async with write_lock(db):
+        for ids in _chunks(payload.user_ids):
+            rows = await db.execute(
+                select(User.id, User.telegram_id, User.level).where(User.id.in_(ids)).with_for_update()
+            )
+            old_levels.update((uid, (telegram_id, old)) for uid, telegram_id, old in rows)
+        changed = [uid for uid, (_, old) in old_levels.items() if old != payload.level]
+        rows = []
+        for ids in _chunks(changed):
+            rows += (await db.execute(
+                update(User).where(User.id.in_(ids)).values(level=payload.level).returning(*User.__table__.columns)
+            )).all()
+        if tg.enabled:
+            actions = [
+                a for uid in changed if old_levels[uid][0]
+                for a in _channel_actions(old_levels[uid][0], old_levels[uid][1], payload.level)
+            ]
+            request_key = f"bulk_change_level:{idempotency_key}" if idempotency_key else None
+            await outbox_enqueue(db, actions, request_key, batch_id=batch_id)
+        await db.commit()
+    await change_feed.poll()
+    outbox.notify()
+    job = await outbox_batch_status(db, batch_id) or {
+        "job_id": None, "status": "done", "total": 0, "sent": 0, "failed": 0, "errors": []}
+    return {
+        "level": payload.level,
+        "updated": len(changed),
+        "unchanged": len(old_levels) - len(changed),
+        "missing": [uid for uid in dict.fromkeys(payload.user_ids) if uid not in old_levels],
+        **job,
+    }
+
+@router.get("/jobs/{job_id}")
+async def bulk_job_status(job_id: str, db: AsyncSession = Depends(get_db)):
+    job = await outbox_batch_status(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.get("/{telegram_id}", response_model=UserOut)
-def get_user(telegram_id: int, db: Session = Depends(get_db)):
-    u = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not u:
+async def get_user(telegram_id: int, db: AsyncSession = Depends(get_db)):
+    async def load():
+        row = (await db.execute(select(*USER_OUT_COLUMNS).where(User.telegram_id == telegram_id))).one_or_none()
+        return _user_dict(row) if row else None
+
+    # read-through: "not registered" is cached too, /register invalidates it
+    user = await user_cache.get(telegram_id, load)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return _to_user_out(u)
+    return json_response(None, user)
 
 @router.put("/{user_id}", response_model=UserOut)
-def update_user(user_id: int, payload: RegisterUserIn, db: Session = Depends(get_db)):
-    u = db.get(User, user_id)
-    if not u:
-        raise HTTPException(status_code=404, detail="User not found")
-    u.first_name = payload.first_name
-    u.last_name = payload.last_name
-    u.phone = payload.phone
-    u.email = payload.email
-    u.indirizzo = payload.indirizzo
-    u.varie = payload.varie
-    # level can be updated but need to handle carefully, maybe separate endpoint for level
-    # u.level = payload.level or something, but for now not update level here
-    db.commit()
-    db.refresh(u)
+async def update_user(user_id: int, payload: RegisterUserIn, db: AsyncSession = Depends(get_db)):
+    async with write_lock(db):
+        u = await db.get(User, user_id)
+        if not u:
+            raise HTTPException(status_code=404, detail="User not found")
+        u.first_name = payload.first_name
+        u.last_name = payload.last_name
+        u.phone = payload.phone
+        u.email = payload.email
+        u.indirizzo = payload.indirizzo
+        u.varie = payload.varie
+        # level can be updated but need to handle carefully, maybe separate endpoint for level
+        # u.level = payload.level or something, but for now not update level here
+        await db.flush()
+        # read back before the commit: a refresh after it would hold a pooled connection
+        # while change_feed.poll() waits for one of its own
+        await db.refresh(u)
+        await db.commit()
+    await change_feed.poll()
     return _to_user_out(u)
 
 @router.delete("/{user_id}")
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    u = db.get(User, user_id)
-    if not u:
-        raise HTTPException(status_code=404, detail="User not found")
-    # Kick from all channels the user had access to
-    if TELEGRAM_BOT_TOKEN and u.telegram_id:
-        for l in range(1, u.level + 1):
-            channel_id = LEVEL_CHANNELS.get(l)
-            if channel_id:
-                url_kick = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/banChatMember"
-                payload_kick = {
-                    "chat_id": channel_id,
-                    "user_id": u.telegram_id,
-                    "revoke_messages": False
-                }
-                try:
-                    async with httpx.AsyncClient() as client:
-                        await client.post(url_kick, json=payload_kick)
-                    print(f"Kicked {u.telegram_id} from {channel_id} on delete")
-                except Exception as e:
-                    print(f"Error kicking {u.telegram_id} from {channel_id}: {e}")
-    db.delete(u)
-    db.commit()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db),
+                      idempotency_key: Optional[str] = Header(None)):
+    async with write_lock(db):
+        u = await db.get(User, user_id)
+        if not u:
+            raise HTTPException(status_code=404, detail="User not found")
+        # Kick from all channels the user had access to (sent by the outbox worker)
+        if get_telegram().enabled and u.telegram_id:
+            actions = [
+                outbox_action("banChatMember", {"chat_id": LEVEL_CHANNELS[l], "user_id": u.telegram_id, "revoke_messages": False},
+                              f"{LEVEL_CHANNELS[l]}:{u.telegram_id}")
+                for l in range(1, u.level + 1) if LEVEL_CHANNELS.get(l)
+            ]
+            request_key = f"delete_user:{user_id}:{idempotency_key}" if idempotency_key else None
+            await outbox_enqueue(db, actions, request_key)
+        # the reconciliation's next run checks the user's memberships (it's gone from users)
+        await db.execute(update(ChannelMember).where(ChannelMember.telegram_id == u.telegram_id)
+                         .values(updated_at=datetime.utcnow()))
+        await db.delete(u)
+        await db.commit()
+    await change_feed.poll()
+    outbox.notify()
+    return {"deleted": True, "user_id": user_id}
+
 @router.post("/login")
-def login(payload: dict, db: Session = Depends(get_db)):
+def login(payload: dict):
     password = payload.get("password")
     # Hardcoded password for demo - in production use env or secure method
     if password == "admin123":
         return {"access_token": "fake_token", "token_type": "bearer"}
     raise HTTPException(status_code=401, detail="Invalid credentials")
-    return {"deleted": True, "user_id": user_id}
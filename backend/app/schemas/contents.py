@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, List, Literal
+from datetime import datetime
 
 Level = Literal[1,2,3,4]
 
@@ -8,6 +9,22 @@ class PublishIn(BaseModel):
     body: str
     link: Optional[str] = None
     levels: List[Level] = []
+    user_ids: List[int] = []
+
+class ScheduleIn(PublishIn):
+    publish_at: datetime  # naive = UTC
+    notify: bool = True  # announce it in the level channels and to user_ids
+
+class ScheduledOut(BaseModel):
+    id: int
+    title: str
+    publish_at: str
+    levels: List[Level] = []
+    user_ids: List[int] = []
+    notify: bool
+    status: str
+    content_id: Optional[int] = None
+    job_id: Optional[str] = None  # outbox batch of the notifications, see /api/users/jobs/{job_id}
 
 class ContentOut(BaseModel):
     id: int
@@ -18,6 +35,11 @@ class ContentOut(BaseModel):
     published_at: str
     levels: List[Level] = []
 
+class ContentSearchOut(ContentOut):
+    score: Optional[float]  # None: query too broad to rank, results newest first
+    snippet: str  # matches wrapped in ** **
+
 class SendNotifIn(BaseModel):
     content_id: int
-    level: Level
\ No newline at end of file
+    level: Optional[Level] = None
+    user_ids: List[int] = []
@@ -0,0 +1,15 @@
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import List, Literal
+
+MemberStatus = Literal['creator', 'administrator', 'member', 'restricted', 'left', 'kicked']
+
+class MemberUpdateIn(BaseModel):
+    # a chat_member update of a level channel, as forwarded by the bot
+    channel_id: str
+    telegram_id: int
+    status: MemberStatus
+    date: datetime
+
+class MemberUpdatesIn(BaseModel):
+    updates: List[MemberUpdateIn] = Field(min_length=1, max_length=1000)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 
 Level = Literal[1,2,3,4]
 Status = Literal['active','pending','rejected']
@@ -14,6 +14,10 @@ class RegisterUserIn(BaseModel):
     varie: Optional[str] = None
     level: Level = 1
 
+class ImportUserIn(RegisterUserIn):
+    # explicit status from an export; when missing the register rules apply
+    status: Optional[Status] = None
+
 class UserOut(BaseModel):
     id: int
     telegram_id: int
@@ -31,6 +35,14 @@ class ApproveUserIn(BaseModel):
     user_id: int
     approve: bool = True
 
+class BulkApproveIn(BaseModel):
+    user_ids: List[int] = Field(min_length=1, max_length=10000)
+    approve: bool = True
+
+class BulkLevelIn(BaseModel):
+    user_ids: List[int] = Field(min_length=1, max_length=10000)
+    level: Level
+
 class ListUsersQuery(BaseModel):
     level: Optional[Level] = Field(default=None)
     status: Optional[Status] = Field(default=None)
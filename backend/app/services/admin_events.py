@@ -0,0 +1,95 @@
+import asyncio
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
+from operator import itemgetter
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from ..config import ADMIN_EVENTS_BUFFER, ADMIN_EVENTS_HEARTBEAT
+from .responses import dumps
+
+RETRY_MS = 3000  # EventSource reconnection delay
+MAX_CHUNK = 500  # events written to a connection at once
+
+
+class AdminEvents:
+    """User and content changes for the admin panels, streamed as server-sent events by
+    GET /api/events.
+
+    The change feed (services/change_feed.py) publishes every committed change, whichever
+    worker made it, with the change log's id as seq; each event is rendered once, in a log
+    of the last `size` events shared by every connection. A connection only keeps its
+    position in the log and is sent what follows it as fast as it takes it (the response
+    waits for the client to read the previous chunk), so a slow panel delays only itself
+    and costs no buffer of its own. A client reconnecting with Last-Event-ID, to any
+    worker, gets the events it missed; one that fell more than `size` events behind, or
+    whose id is from before this process started, gets a `reset` event and reloads once.
+    """
+
+    def __init__(self, size: int = ADMIN_EVENTS_BUFFER, heartbeat: float = ADMIN_EVENTS_HEARTBEAT):
+        self.heartbeat = heartbeat
+        self._log = deque(maxlen=size)  # (seq, rendered event)
+        self._seq = 0
+        self._base = 0  # seq of the last event not in the log any more
+        self._wakeup = asyncio.Event()
+
+    def _render(self, seq: int, event: str, data: str) -> str:
+        return f"id: {seq}\nevent: {event}\ndata: {data}\n\n"
+
+    def publish(self, event: str, data: Dict[str, Any], seq: Optional[int] = None) -> None:
+        """Record a committed change, e.g. ("user", UserOut) or ("content", ContentOut), under
+        `seq` (increasing; by default the next one)."""
+        self._seq = self._seq + 1 if seq is None else seq
+        if len(self._log) == self._log.maxlen:
+            self._base = self._log[0][0]
+        self._log.append((self._seq, self._render(self._seq, event, dumps(data).decode())))
+        self._wake()
+
+    def start_at(self, seq: int) -> None:
+        """Log from `seq` on: the events up to it are unknown to this process (it just
+        started, or fell behind the change log), clients resuming before it are reset."""
+        self._log.clear()
+        self._seq = self._base = seq
+        self._wake()
+
+    def _wake(self) -> None:
+        # wake the connections waiting now; later ones wait on a fresh event
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    def _position(self, last_event_id: Optional[str]) -> Tuple[int, bool]:
+        """Seq to resume after, and whether the client must reset."""
+        if not last_event_id:
+            return self._seq, False
+        seq = last_event_id.strip()
+        if not seq.isdigit() or int(seq) > self._seq or int(seq) < self._base:
+            return self._seq, True
+        return int(seq), False
+
+    async def stream(self, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        """SSE body: the events after last_event_id (or from now on), then new ones as
+        they come, with a comment line every `heartbeat` seconds of silence."""
+        cursor, reset = self._position(last_event_id)
+        yield f"retry: {RETRY_MS}\n\n"
+        if reset:
+            yield self._render(cursor, "reset", "{}")
+        while True:
+            if cursor >= self._seq:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                continue
+            if cursor < self._base:
+                # fell out of the log while the client was slow
+                cursor = self._seq
+                yield self._render(cursor, "reset", "{}")
+                continue
+            # seqs are the change log's ids: increasing, with gaps
+            start = bisect_right(self._log, cursor, key=itemgetter(0))
+            chunk = list(islice(self._log, start, start + MAX_CHUNK))
+            cursor = chunk[-1][0]
+            yield "".join(event for _, event in chunk)
+
+
+admin_events = AdminEvents()
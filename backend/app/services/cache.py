@@ -0,0 +1,208 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from ..config import CACHE_URL, CACHE_SIZE, USER_LOOKUP_TTL
+
+logger = logging.getLogger(__name__)
+
+# lookup() result: (hit, value, fill token to pass back to store() on a miss)
+Lookup = Tuple[bool, Any, Any]
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry TTL. Each worker has its own copy: a write made
+    through another worker drops it when the change feed (services/change_feed.py)
+    reads it, within CHANGE_FEED_POLL seconds; Redis shares one copy instead.
+
+    A miss hands out a fill token; invalidate() revokes it, so a value loaded before a
+    write can't be stored after that write's invalidation.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires, value)
+        self._fills: Dict[str, object] = {}
+
+    async def lookup(self, key: str) -> Lookup:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() < entry[0]:
+                self._entries.move_to_end(key)
+                return True, entry[1], None
+            del self._entries[key]
+        token = self._fills[key] = object()
+        return False, None, token
+
+    async def store(self, key: str, token: Any, value: Any, ttl: float) -> None:
+        if self._fills.get(key) is not token:
+            return
+        del self._fills[key]
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+            self._fills.pop(key, None)
+
+    async def clear(self, namespace: str) -> None:
+        prefix = f"{namespace}:"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+        for key in [k for k in self._fills if k.startswith(prefix)]:
+            del self._fills[key]
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """Shared cache in Redis (or anything speaking its API, e.g. a fake client).
+
+    Every key has a version counter, bumped by invalidate(); a namespace-wide counter is
+    bumped by clear(). Entries are stored with the versions read at lookup time and only
+    count as hits while both still match, so a value loaded before a write is never
+    served after it, whichever process wrote. Lookups are one MGET.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        if client is None:
+            try:
+                from redis import asyncio as aioredis
+            except ImportError as e:
+                raise RuntimeError("CACHE_URL is a redis:// URL but the redis package is not installed") from e
+            client = aioredis.from_url(url)
+        self.client = client
+
+    @staticmethod
+    def _namespace(key: str) -> str:
+        return key.split(":", 1)[0]
+
+    async def lookup(self, key: str) -> Lookup:
+        raw, version, generation = await self.client.mget(
+            key, f"{key}:v", f"{self._namespace(key)}:gen")
+        token = f"{int(generation or 0)}.{int(version or 0)}"
+        if raw is not None:
+            entry = json.loads(raw)
+            if entry["v"] == token:
+                return True, entry["data"], None
+        return False, None, token
+
+    async def store(self, key: str, token: Any, value: Any, ttl: float) -> None:
+        await self.client.set(key, json.dumps({"v": token, "data": value}), px=max(1, int(ttl * 1000)))
+
+    async def invalidate(self, keys: Iterable[str]) -> None:
+        # the counters don't expire: an entry stored under an old version must never match again
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(f"{key}:v")
+        await pipe.execute()
+
+    async def clear(self, namespace: str) -> None:
+        await self.client.incr(f"{namespace}:gen")
+
+    def size(self) -> Optional[int]:
+        return None
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def make_backend(url: str):
+    """Backend for CACHE_URL: "memory://" (default), "redis://host:6379/0", or "" for none."""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+class ReadThroughCache:
+    """Read-through cache of one kind of lookup (keys "<namespace>:<key>") with hit/miss counters.
+
+    A backend error is logged and the lookup served from the loader, so the cache being
+    down costs latency, not availability.
+    """
+
+    def __init__(self, backend, namespace: str, ttl: float):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = self.misses = self.invalidations = self.errors = 0
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        if self.backend is None:
+            return await load()
+        k = self._key(key)
+        try:
+            hit, value, token = await self.backend.lookup(k)
+        except Exception:
+            logger.exception("Cache lookup failed for %s", k)
+            self.errors += 1
+            return await load()
+        if hit:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = await load()
+        try:
+            await self.backend.store(k, token, value, self.ttl)
+        except Exception:
+            logger.exception("Cache store failed for %s", k)
+            self.errors += 1
+        return value
+
+    async def invalidate(self, keys: Optional[Iterable[Hashable]] = None) -> None:
+        """Drop the given keys (after the write that changed them committed), or all of them."""
+        if self.backend is None:
+            return
+        try:
+            if keys is None:
+                await self.backend.clear(self.namespace)
+                self.invalidations += 1
+            else:
+                keys = [self._key(key) for key in keys]
+                if keys:
+                    await self.backend.invalidate(keys)
+                    self.invalidations += len(keys)
+        except Exception:
+            logger.exception("Cache invalidation failed for %s", self.namespace)
+            self.errors += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name if self.backend is not None else None,
+            "ttl": self.ttl,
+            "entries": self.backend.size() if self.backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+    async def close(self) -> None:
+        if self.backend is not None:
+            await self.backend.close()
+
+
+# GET /api/users/{telegram_id}: hit by the bot on every /my_level
+user_cache = ReadThroughCache(make_backend(CACHE_URL), "user", USER_LOOKUP_TTL)
@@ -0,0 +1,146 @@
+import asyncio
+import inspect
+import logging
+import time
+from itertools import groupby
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Union
+
+from sqlalchemy import delete, func, select
+
+from ..config import CHANGE_FEED_POLL, CHANGE_LOG_SIZE
+from ..db.session import AsyncSessionLocal, write_lock
+from ..models.models import ChangeLog
+
+logger = logging.getLogger(__name__)
+
+# handler(rows, position): rows of change_log (id, topic, row_id, telegram_id) of one topic in id
+# order, ending at position; rows None = the changes up to position were missed
+Handler = Callable[[Optional[Sequence], int], Union[None, Awaitable[None]]]
+
+
+class ChangeFeed:
+    """This process's reader of change_log, where triggers log every write to users and
+    contents in the writing transaction (db/changelog.py), whichever process made it.
+
+    Every `interval` seconds, and right after a write by this process (poll()), the new
+    rows are handed in id order to the handlers of their topic: they drop the cached
+    users and totals, and feed GET /api/users/changes and GET /api/events. So caches
+    in memory stay correct with several API workers (a change made through another one
+    is seen within `interval`), and the seqs given to clients are the log's ids, the same
+    on every worker and across restarts.
+
+    At start, and if this process fell behind the log's retention (`keep` rows), the
+    handlers get None instead of rows: every cached copy must go, and clients asking
+    for changes from before that position are reset.
+    """
+
+    PRUNE_EVERY = 60.0  # seconds
+
+    def __init__(self, interval: float = CHANGE_FEED_POLL, keep: int = CHANGE_LOG_SIZE, batch: int = 1000,
+                 session_factory=AsyncSessionLocal):
+        self.interval = interval
+        self.keep = keep
+        self.batch = batch
+        self._session_factory = session_factory
+        self._handlers: Dict[str, List[Handler]] = {}
+        self.position = 0  # id of the last change applied; start() skips the ones made before
+        self._lock = asyncio.Lock()
+        self._next: Optional[asyncio.Future] = None  # read not started yet, shared by whoever asks for one
+        self._task: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        """Call handler(rows, position) for each run of changes of `topic`; handlers may be async."""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    async def start(self) -> None:
+        if self._task is None:
+            await self._start_position()
+            # what happened before is unknown here: clients further behind are reset
+            await self._dispatch(None, self.position)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _start_position(self) -> None:
+        async with self._session_factory() as db:
+            self.position = (await db.execute(select(func.max(ChangeLog.id)))).scalar() or 0
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+                if time.monotonic() - self._pruned_at > self.PRUNE_EVERY:
+                    await self.prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reading the change log failed")
+
+    async def poll(self) -> int:
+        """Apply every change committed so far; returns the position reached.
+
+        Writers await it after committing, so their own change is applied in this
+        process before they answer; the other processes get it on their next poll.
+        Callers arriving while a read runs share the next one, which starts after
+        their commits: a burst of writes costs two reads, not one each.
+        """
+        if self._next is None:
+            self._next = asyncio.ensure_future(self._read())
+        # shielded: a request cancelled while waiting doesn't cancel the others' read
+        return await asyncio.shield(self._next)
+
+    async def _read(self) -> int:
+        async with self._lock:
+            self._next = None  # from here on, callers need a read starting after their call
+            while True:
+                async with self._session_factory() as db:
+                    rows = (await db.execute(
+                        select(ChangeLog.id, ChangeLog.topic, ChangeLog.row_id, ChangeLog.telegram_id)
+                        .where(ChangeLog.id > self.position).order_by(ChangeLog.id).limit(self.batch)
+                    )).all()
+                    if rows and rows[0].id > self.position + 1:
+                        # ids have gaps (rolled back on PostgreSQL); a gap before the oldest row was pruned
+                        oldest = (await db.execute(select(func.min(ChangeLog.id)))).scalar()
+                        if oldest == rows[0].id and self.position:
+                            logger.warning("Change log pruned past this process (at %d, oldest %d): "
+                                           "dropping every cached copy", self.position, oldest)
+                            await self._dispatch(None, rows[0].id - 1)
+                if not rows:
+                    return self.position
+                for topic, run in groupby(rows, key=lambda row: row.topic):
+                    run = list(run)
+                    await self._dispatch(topic, run[-1].id, run)
+                if len(rows) < self.batch:
+                    return self.position
+
+    async def _dispatch(self, topic: Optional[str], position: int, rows: Optional[list] = None) -> None:
+        handlers = self._handlers.get(topic, []) if topic else [h for hs in self._handlers.values() for h in hs]
+        # a handler failing must not hold back the others, nor the log
+        self.position = position
+        for handler in handlers:
+            try:
+                result = handler(rows, position)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Change handler %s failed", getattr(handler, "__name__", handler))
+
+    async def prune(self) -> None:
+        """Drop all but the last `keep` changes (any process may do it)."""
+        self._pruned_at = time.monotonic()
+        async with self._session_factory() as db:
+            oldest, newest = (await db.execute(select(func.min(ChangeLog.id), func.max(ChangeLog.id)))).one()
+            if newest is None or newest - oldest < self.keep:
+                return
+            async with write_lock(db):
+                await db.execute(delete(ChangeLog).where(ChangeLog.id <= newest - self.keep))
+                await db.commit()
+
+
+change_feed = ChangeFeed()
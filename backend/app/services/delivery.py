@@ -0,0 +1,279 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete
+
+from ..config import DELIVERY_WORKERS, DELIVERY_QUEUE_SIZE, DELIVERY_PROGRESS_INTERVAL
+from ..db.dialect import insert_for
+from ..db.session import AsyncSessionLocal, write_lock
+from ..models.models import DeliveryProgress
+from .metrics import Gauge, delivery_queue_wait, delivery_rejected, delivery_spilled, registry
+from .outbox import Action, action as outbox_action, enqueue as outbox_enqueue
+from .telegram import TelegramClient, get_telegram
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class DeliveryJob:
+    id: str
+    total: int
+    sent: int = 0
+    failed: int = 0
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def status(self) -> str:
+        if self.sent + self.failed < self.total:
+            return "queued" if self.sent + self.failed == 0 else "running"
+        return "done" if self.failed == 0 else "done_with_errors"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+Task = Tuple[Any, Callable[[], Awaitable[Any]]]  # (label used in errors, coroutine factory)
+# queued task: job, label, coroutine factory, the same send as an outbox action (None if it
+# can't be persisted), time it was queued
+_Item = Tuple[DeliveryJob, Any, Callable[[], Awaitable[Any]], Optional[Action], float]
+
+
+class DeliveryEngine:
+    """Fan-out of Telegram sends through a bounded queue drained by a pool of asyncio workers.
+
+    Rate limits (global, per chat, 429 retry_after) are enforced by the shared TelegramClient.
+    Besides single Bot API calls (submit) a job can hold arbitrary per-user tasks made of
+    several calls (submit_tasks), e.g. the kicks, invites and message of a level change.
+
+    On shutdown drain() stops taking jobs and lets the workers empty the queue within the
+    deadline; the Bot API calls still queued then are moved to the outbox (batch = job id)
+    for the next process to send, and the sends in progress are allowed to finish rather
+    than cancelled, since Telegram may already have them: nothing is dropped or sent twice.
+
+    Jobs live in the process that queued them; their progress is saved to delivery_jobs
+    every `progress_interval` seconds (and at drain), so any API worker can report it.
+    """
+
+    MAX_JOBS = 1000
+    KEEP_PROGRESS = timedelta(days=7)
+    PRUNE_EVERY = 3600.0  # seconds
+
+    def __init__(self, workers: int = DELIVERY_WORKERS, queue_size: int = DELIVERY_QUEUE_SIZE,
+                 client: Optional[TelegramClient] = None, session_factory=AsyncSessionLocal,
+                 progress_interval: float = DELIVERY_PROGRESS_INTERVAL):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.progress_interval = progress_interval
+        self._client = client
+        self._session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+        self._closing = False  # workers exit after their current send
+        self.in_flight = 0
+        self.jobs: "OrderedDict[str, DeliveryJob]" = OrderedDict()
+        self._dirty: Dict[str, DeliveryJob] = {}  # progress not saved yet
+        self._flusher: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+
+    @property
+    def client(self) -> TelegramClient:
+        return self._client or get_telegram()
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._accepting, self._closing = True, False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        tasks = self._tasks + ([self._flusher] if self._flusher else [])
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._flusher = None
+        self._queue = None
+        self._accepting = False
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def has_room(self, n: int) -> bool:
+        return self._queue is None or self._queue.qsize() + n <= self.queue_size
+
+    def submit(self, method: str, payloads: List[Dict[str, Any]]) -> DeliveryJob:
+        """Queue one Bot API call per payload and return immediately; raises QueueFullError."""
+        return self._submit([
+            (payload.get("chat_id"), lambda payload=payload: self.client.call(method, payload),
+             outbox_action(method, payload, str(payload.get("chat_id"))))
+            for payload in payloads
+        ])
+
+    def submit_tasks(self, tasks: List[Task]) -> DeliveryJob:
+        """Queue (label, coroutine factory) tasks as one job; a task counts as failed if it raises."""
+        return self._submit([(label, fn, None) for label, fn in tasks])
+
+    def _submit(self, tasks: List[Tuple[Any, Callable[[], Awaitable[Any]], Optional[Action]]]) -> DeliveryJob:
+        if self._queue is not None and not self._accepting:
+            delivery_rejected.inc("shutdown")
+            raise QueueFullError("Delivery queue closed: shutting down")
+        self.start()
+        if not self.has_room(len(tasks)):
+            delivery_rejected.inc("full")
+            raise QueueFullError(f"Delivery queue full ({self._queue.qsize()}/{self.queue_size})")
+        job = DeliveryJob(id=uuid.uuid4().hex, total=len(tasks))
+        self.jobs[job.id] = job
+        self._dirty[job.id] = job
+        while len(self.jobs) > self.MAX_JOBS:
+            self.jobs.popitem(last=False)
+        now = time.monotonic()
+        for label, fn, action in tasks:
+            self._queue.put_nowait((job, label, fn, action, now))
+        if not tasks:
+            job.finished_at = time.time()
+        return job
+
+    def get_job(self, job_id: str) -> Optional[DeliveryJob]:
+        return self.jobs.get(job_id)
+
+    async def flush(self) -> None:
+        """Save the progress of the jobs changed since the last save; on failure they are
+        saved with the next ones."""
+        if not self._dirty:
+            return
+        jobs, self._dirty = list(self._dirty.values()), {}
+        now = datetime.utcnow()
+        try:
+            async with self._session_factory() as db:
+                stmt = insert_for(db, DeliveryProgress).values([
+                    {"id": job.id, "total": job.total, "sent": job.sent, "failed": job.failed,
+                     "errors": json.dumps(job.errors), "updated_at": now}
+                    for job in jobs
+                ])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[DeliveryProgress.id],
+                    set_={name: stmt.excluded[name] for name in ("sent", "failed", "errors", "updated_at")},
+                )
+                async with write_lock(db):
+                    await db.execute(stmt)
+                    await db.commit()
+        except Exception:
+            logger.exception("Saving the delivery progress failed")
+            for job in jobs:
+                self._dirty.setdefault(job.id, job)
+
+    async def _prune(self) -> None:
+        self._pruned_at = time.monotonic()
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                await db.execute(delete(DeliveryProgress).where(
+                    DeliveryProgress.updated_at < datetime.utcnow() - self.KEEP_PROGRESS))
+                await db.commit()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self.flush()
+            if time.monotonic() - self._pruned_at > self.PRUNE_EVERY:
+                try:
+                    await self._prune()
+                except Exception:
+                    logger.exception("Pruning the delivery progress failed")
+
+    async def drain(self, timeout: float) -> None:
+        """Stop taking jobs and send what is queued within timeout; move the rest to the outbox."""
+        if self._queue is None:
+            return
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            await self.flush()
+            return
+        except asyncio.TimeoutError:
+            pass
+        self._closing = True
+        left: List[_Item] = []
+        while not self._queue.empty():
+            left.append(self._queue.get_nowait())
+            self._queue.task_done()
+        await self._spill(left)
+        # let the sends in progress end (bounded by the client's timeout): cancelled, a message
+        # Telegram already got would count as not sent
+        give_up = time.monotonic() + 2 * self.client.timeout
+        while self.in_flight and time.monotonic() < give_up:
+            await asyncio.sleep(0.05)
+        if self.in_flight:
+            logger.warning("%d sends still in progress at shutdown, cancelled", self.in_flight)
+        await self.flush()
+
+    async def _spill(self, items: List[_Item]) -> None:
+        by_job: Dict[str, List[Action]] = {}
+        for job, label, fn, action, _ in items:
+            if action is not None:
+                by_job.setdefault(job.id, []).append(action)
+            else:
+                job.failed += 1
+                self._dirty[job.id] = job
+                logger.warning("Delivery %s to %s dropped at shutdown", job.id, label)
+        if not by_job:
+            return
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                for job_id, actions in by_job.items():
+                    await outbox_enqueue(db, actions, request_key=f"delivery:{job_id}", batch_id=job_id)
+                await db.commit()
+        # not notifying the outbox worker: it claims nothing more by now, the next process sends them
+        spilled = sum(len(actions) for actions in by_job.values())
+        delivery_spilled.inc(value=spilled)
+        logger.info("Moved %d queued sends of %d jobs to the outbox", spilled, len(by_job))
+
+    async def _worker(self) -> None:
+        while not self._closing:
+            job, label, fn, _, queued_at = await self._queue.get()
+            delivery_queue_wait.observe(time.monotonic() - queued_at)
+            self.in_flight += 1
+            try:
+                await fn()
+                job.sent += 1
+            except Exception as e:
+                job.failed += 1
+                if len(job.errors) < 20:
+                    job.errors.append(f"{label}: {e}")
+                logger.warning("Delivery %s to %s failed: %s", job.id, label, e)
+            finally:
+                self.in_flight -= 1
+                self._dirty[job.id] = job
+                if job.sent + job.failed == job.total:
+                    job.finished_at = time.time()
+                self._queue.task_done()
+
+engine = DeliveryEngine()
+
+registry.register(Gauge("delivery_queue_depth", "Sends waiting in the delivery queue", lambda: engine.depth))
+registry.register(Gauge("delivery_queue_capacity", "Size of the delivery queue (DELIVERY_QUEUE_SIZE)",
+                        lambda: engine.queue_size))
+registry.register(Gauge("delivery_in_flight", "Sends being made by the delivery workers", lambda: engine.in_flight))
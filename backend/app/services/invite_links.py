@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from sqlalchemy import update
+
+from ..config import INVITE_LINK_TTL, INVITE_LINK_REFRESH_AHEAD, INVITE_LINK_MEMBER_LIMIT
+from ..db.dialect import insert_for
+from ..db.session import AsyncSessionLocal, write_lock
+from ..models.models import InviteLink
+from .telegram import TelegramClient, get_telegram
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    invite_link: str
+    expire_date: Optional[datetime]
+    member_limit: Optional[int]
+    handed_out: int = 0
+
+
+class InviteLinkCache:
+    """One shared, time/member-limited invite link per channel.
+
+    Links live in memory and in the `invite_links` table, so every API worker (and the
+    bot, through /api/users/invite_links) hands out the same link until it expires or
+    reaches its member limit. Each use is counted with a conditional UPDATE, so a link
+    filled up by another worker is not handed out again. A replacement is minted in the
+    background once a link enters the last `refresh_ahead` seconds of its life; concurrent
+    misses for the same channel share a single createChatInviteLink call.
+    """
+
+    def __init__(self, ttl: int = INVITE_LINK_TTL, refresh_ahead: int = INVITE_LINK_REFRESH_AHEAD,
+                 member_limit: int = INVITE_LINK_MEMBER_LIMIT, client: Optional[TelegramClient] = None,
+                 session_factory=AsyncSessionLocal):
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl // 2)
+        self.member_limit = member_limit or None
+        self._client = client
+        self._session_factory = session_factory
+        self._entries: Dict[str, _Entry] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def client(self) -> TelegramClient:
+        return self._client or get_telegram()
+
+    def _remaining(self, entry: _Entry) -> float:
+        if entry.expire_date is None:
+            return float("inf")
+        return (entry.expire_date - datetime.utcnow()).total_seconds()
+
+    def _usable(self, entry: Optional[_Entry]) -> bool:
+        if entry is None or self._remaining(entry) <= 0:
+            return False
+        return not entry.member_limit or entry.handed_out < entry.member_limit
+
+    def _lock(self, channel_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(channel_id, asyncio.Lock())
+
+    async def get(self, channel_id: str) -> str:
+        channel_id = str(channel_id)
+        entry = self._entries.get(channel_id)
+        if self._usable(entry) and await self._hand_out(channel_id, entry):
+            if self._remaining(entry) < self.refresh_ahead:
+                self._schedule_refresh(channel_id)
+            return entry.invite_link
+        async with self._lock(channel_id):
+            # another worker may already have stored a fresh link
+            entry = await self._load(channel_id)
+            if not (self._usable(entry) and await self._hand_out(channel_id, entry)):
+                entry = await self._create(channel_id)
+                # counted even if another worker replaced it meanwhile: Telegram still enforces its limit
+                await self._hand_out(channel_id, entry)
+        return entry.invite_link
+
+    def invalidate(self, channel_id: str) -> None:
+        self._entries.pop(str(channel_id), None)
+
+    async def _load(self, channel_id: str) -> Optional[_Entry]:
+        async with self._session_factory() as db:
+            row = await db.get(InviteLink, channel_id)
+            if row is None:
+                return None
+            entry = _Entry(row.invite_link, row.expire_date, row.member_limit, row.handed_out)
+        self._entries[channel_id] = entry
+        return entry
+
+    async def _create(self, channel_id: str) -> _Entry:
+        expire_date = datetime.utcnow() + timedelta(seconds=self.ttl)
+        payload = {"chat_id": channel_id, "expire_date": int((expire_date - datetime(1970, 1, 1)).total_seconds())}
+        if self.member_limit:
+            payload["member_limit"] = self.member_limit
+        result = await self.client.call("createChatInviteLink", payload)
+        entry = _Entry(result["invite_link"], expire_date, self.member_limit)
+        async with self._session_factory() as db:
+            # an upsert: another worker may store its own link for the channel at the same time
+            stmt = insert_for(db, InviteLink).values(
+                channel_id=channel_id,
+                invite_link=entry.invite_link,
+                expire_date=entry.expire_date,
+                member_limit=entry.member_limit,
+                handed_out=0,
+                created_at=datetime.utcnow(),
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[InviteLink.channel_id],
+                set_={name: stmt.excluded[name]
+                      for name in ("invite_link", "expire_date", "member_limit", "handed_out", "created_at")},
+            )
+            async with write_lock(db):
+                await db.execute(stmt)
+                await db.commit()
+        self._entries[channel_id] = entry
+        return entry
+
+    async def _hand_out(self, channel_id: str, entry: _Entry) -> bool:
+        """Count one more use of the link in the DB, if it is still the channel's link and not
+        full there (other workers hand it out too); False otherwise."""
+        if not entry.member_limit:
+            return True
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                handed_out = (await db.execute(
+                    update(InviteLink)
+                    .where(InviteLink.channel_id == channel_id, InviteLink.invite_link == entry.invite_link,
+                           InviteLink.handed_out < entry.member_limit)
+                    .values(handed_out=InviteLink.handed_out + 1)
+                    .returning(InviteLink.handed_out)
+                )).scalar()
+                await db.commit()
+        entry.handed_out = entry.member_limit if handed_out is None else handed_out
+        return handed_out is not None
+
+    def _schedule_refresh(self, channel_id: str) -> None:
+        if channel_id in self._refreshing:
+            return
+        self._refreshing.add(channel_id)
+        task = asyncio.create_task(self._refresh(channel_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, channel_id: str) -> None:
+        try:
+            async with self._lock(channel_id):
+                entry = await self._load(channel_id)
+                if entry is None or self._remaining(entry) < self.refresh_ahead:
+                    await self._create(channel_id)
+        except Exception:
+            logger.exception("Error refreshing invite link for %s", channel_id)
+        finally:
+            self._refreshing.discard(channel_id)
+
+
+invite_links = InviteLinkCache()
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import String, and_, case, cast, exists, literal, not_, or_, select, tuple_, union, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import LEVEL_CHANNELS, RECONCILE_INTERVAL, RECONCILE_KICK_UNKNOWN, RECONCILE_MAX_KICKS, RECONCILE_OVERLAP
+from ..db.dialect import insert_for
+from ..db.session import AsyncSessionLocal, write_lock
+from ..models.models import ChannelMember, JobCheckpoint, OutboxStatus, TelegramOutbox, User, UserStatus
+from .outbox import action as outbox_action, enqueue as outbox_enqueue, outbox
+from .telegram import get_telegram
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = "membership_reconcile"
+# members the reconciliation may remove; administrators and the creator are left alone
+REMOVABLE = ("member", "restricted")
+# members without a user listed in a run's result and log; the count covers all of them
+REPORT_LIMIT = 20
+
+
+async def record(db: AsyncSession, updates: List[Dict[str, Any]]) -> int:
+    """Store chat_member updates ({channel_id, telegram_id, status, date}) in the caller's
+    transaction; an update older than the stored one (Telegram doesn't guarantee the
+    order across getUpdates/webhook retries) is ignored. Returns how many were applied."""
+    if not updates:
+        return 0
+    now = datetime.utcnow()
+    stmt = insert_for(db, ChannelMember)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ChannelMember.channel_id, ChannelMember.telegram_id],
+        set_={"status": stmt.excluded.status, "changed_at": stmt.excluded.changed_at, "updated_at": now},
+        where=ChannelMember.changed_at <= stmt.excluded.changed_at,
+    )
+    conn = await db.connection()
+    return (await conn.execute(stmt, [{
+        "channel_id": str(u["channel_id"]), "telegram_id": u["telegram_id"], "status": u["status"],
+        "changed_at": u["date"], "updated_at": now,
+    } for u in updates])).rowcount
+
+
+def kick_key(channel_id: str, telegram_id: int) -> str:
+    """Outbox ordering key of the kicks of a user from a channel (the same as change_level's)."""
+    return f"{channel_id}:{telegram_id}"
+
+
+class MembershipReconciler:
+    """Removes from the level channels whoever shouldn't be there any more.
+
+    channel_members holds who Telegram says is in each channel. A member is entitled to
+    the channel of level L if a user with its telegram_id is active with level >= L;
+    anyone else (downgraded, pending, rejected or deleted) is kicked through the outbox,
+    which retries and keeps within Telegram's rate limits. Members without a user (never
+    registered, e.g. added by an administrator) are only reported and logged, unless
+    `kick_unknown`.
+
+    Each run only looks at what changed since the previous one (the checkpoint): the
+    memberships updated since, the memberships of the users updated since and the kicks
+    that failed since. The diff is one UNION of indexed queries, so a run costs the same
+    with 100k members as with 100. The checkpoint is moved back by `overlap` seconds to
+    cover writes committed after a run read past their timestamp; a kick already waiting
+    in the outbox isn't queued again. A run with more than `max_kicks` kicks (e.g. the
+    channel ids were swapped in the config) is refused unless forced.
+    """
+
+    def __init__(self, interval: float = RECONCILE_INTERVAL, overlap: float = RECONCILE_OVERLAP,
+                 max_kicks: int = RECONCILE_MAX_KICKS, kick_unknown: bool = RECONCILE_KICK_UNKNOWN,
+                 channels: Dict[int, Optional[str]] = LEVEL_CHANNELS, session_factory=AsyncSessionLocal):
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self.max_kicks = max_kicks
+        self.kick_unknown = kick_unknown
+        self.channels = {lvl: str(ch) for lvl, ch in channels.items() if ch}
+        self._levels = {ch: lvl for lvl, ch in self.channels.items()}  # channel id -> level
+        self._session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0 and self.channels:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # the checkpoint didn't move: the next run covers this one's changes
+                logger.exception("Membership reconciliation failed")
+            await asyncio.sleep(self.interval)
+
+    def _unentitled(self, since: Optional[datetime], failed: List[tuple]):
+        """SELECT channel_id, telegram_id, unknown (no user row) of the unentitled members, among
+        those changed since `since`."""
+        level = case(self._levels, value=ChannelMember.channel_id)
+        pending_kick = exists().where(
+            TelegramOutbox.ordering_key == ChannelMember.channel_id + ":" + cast(ChannelMember.telegram_id, String),
+            TelegramOutbox.status == OutboxStatus.pending,
+            TelegramOutbox.method == "banChatMember",
+        )
+        members = and_(
+            # a level channel; not as channel_id IN (...), which SQLite would pick over the
+            # updated_at / telegram_id indexes and scan every membership
+            level.isnot(None),
+            ChannelMember.status.in_(REMOVABLE),
+            ~pending_kick,
+        )
+        entitled = and_(User.status == UserStatus.active, User.level >= level)
+        cols = (ChannelMember.channel_id, ChannelMember.telegram_id)
+        # members without a user row are unentitled too, hence the outer join
+        by_member = (select(*cols, User.id.is_(None).label("unknown")).select_from(ChannelMember)
+                     .outerjoin(User, User.telegram_id == ChannelMember.telegram_id)
+                     .where(members, or_(User.id.is_(None), not_(entitled))))
+        if since is None:
+            return by_member
+        by_user = (select(*cols, literal(False).label("unknown")).select_from(User)
+                   .join(ChannelMember, ChannelMember.telegram_id == User.telegram_id)
+                   .where(User.updated_at > since, members, not_(entitled)))
+        queries = [by_member.where(ChannelMember.updated_at > since), by_user]
+        if failed:
+            queries.append(by_member.where(ChannelMember.telegram_id.in_({tid for _, tid in failed}),
+                                           tuple_(*cols).in_(failed)))
+        return union(*queries)
+
+    async def _failed_kicks(self, db: AsyncSession, since: datetime) -> List[tuple]:
+        keys = (await db.execute(
+            select(TelegramOutbox.ordering_key).where(
+                TelegramOutbox.status == OutboxStatus.failed, TelegramOutbox.method == "banChatMember",
+                TelegramOutbox.done_at > since)
+        )).scalars().all()
+        pairs = {tuple(k.rsplit(":", 1)) for k in keys}
+        return [(ch, int(tid)) for ch, tid in pairs if ch in self._levels and tid.lstrip("-").isdigit()]
+
+    async def _claim(self, db: AsyncSession, checkpoint: Optional[JobCheckpoint], now: datetime) -> bool:
+        # compare-and-set on the checkpoint: of two processes starting the same run, one wins
+        if checkpoint is None:
+            stmt = insert_for(db, JobCheckpoint).values(name=CHECKPOINT, position=now, ran_at=now)
+            return (await db.execute(stmt.on_conflict_do_nothing(index_elements=[JobCheckpoint.name]))).rowcount == 1
+        return (await db.execute(
+            update(JobCheckpoint)
+            .where(JobCheckpoint.name == CHECKPOINT, JobCheckpoint.position == checkpoint.position)
+            .values(position=now, ran_at=now)
+        )).rowcount == 1
+
+    async def run(self, full: bool = False, force: bool = False) -> Dict[str, Any]:
+        """One reconciliation; `full` checks every membership instead of the changed ones."""
+        now = datetime.utcnow()
+        t0 = asyncio.get_running_loop().time()
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                checkpoint = (await db.execute(
+                    select(JobCheckpoint).where(JobCheckpoint.name == CHECKPOINT)
+                )).scalar_one_or_none()
+                since = None if full or checkpoint is None else checkpoint.position - self.overlap
+                result = {"full": since is None, "since": since.isoformat() if since else None, "kicked": 0, "job_id": None}
+                if not self.channels:
+                    await db.rollback()
+                    return {**result, "status": "no_channels"}
+                if not await self._claim(db, checkpoint, now):
+                    await db.rollback()
+                    return {**result, "status": "running_elsewhere"}
+                failed = await self._failed_kicks(db, since) if since is not None else []
+                rows = (await db.execute(self._unentitled(since, failed))).all()
+                kicks = [(ch, tid) for ch, tid, unknown in rows if self.kick_unknown or not unknown]
+                unknown = [(ch, tid) for ch, tid, unknown in rows if unknown and not self.kick_unknown]
+                result.update(unknown=len(unknown), unknown_members=[
+                    {"channel_id": ch, "telegram_id": tid} for ch, tid in unknown[:REPORT_LIMIT]])
+                if len(kicks) > self.max_kicks and not force:
+                    await db.rollback()
+                    logger.error("Membership reconciliation refused: %d kicks (limit %d), run it with force",
+                                 len(kicks), self.max_kicks)
+                    self.last_run = {**result, "status": "refused", "to_kick": len(kicks), "ran_at": now.isoformat()}
+                    return self.last_run
+                actions = []
+                for channel_id, telegram_id in kicks:
+                    key = kick_key(channel_id, telegram_id)
+                    actions.append(outbox_action("banChatMember", {"chat_id": channel_id, "user_id": telegram_id, "revoke_messages": False}, key))
+                    actions.append(outbox_action("unbanChatMember", {"chat_id": channel_id, "user_id": telegram_id, "only_if_banned": True}, key))
+                if actions and not get_telegram().enabled:
+                    logger.warning("Telegram bot token not configured: %d members not kicked", len(kicks))
+                    actions = []
+                if actions:
+                    batch_id = uuid.uuid4().hex
+                    await outbox_enqueue(db, actions, request_key=f"reconcile:{batch_id}", batch_id=batch_id)
+                    await db.execute(update(JobCheckpoint).where(JobCheckpoint.name == CHECKPOINT).values(batch_id=batch_id))
+                    result.update(kicked=len(kicks), job_id=batch_id)
+                await db.commit()
+        if actions:
+            outbox.notify()
+        took = asyncio.get_running_loop().time() - t0
+        if unknown:
+            logger.warning("Membership reconciliation: %d members without a user not kicked (RECONCILE_KICK_UNKNOWN=0), "
+                           "telegram_id in channel: %s%s", len(unknown),
+                           ", ".join(f"{tid} in {ch}" for ch, tid in unknown[:REPORT_LIMIT]),
+                           ", ..." if len(unknown) > REPORT_LIMIT else "")
+        logger.info("Membership reconciliation (%s): %d members to kick, %.0f ms",
+                    "full" if since is None else f"since {since:%Y-%m-%d %H:%M:%S}", len(kicks), took * 1000)
+        self.last_run = {**result, "status": "done", "ran_at": now.isoformat(), "ms": round(took * 1000, 1)}
+        return self.last_run
+
+
+reconciler = MembershipReconciler()
@@ -0,0 +1,305 @@
+import cProfile
+import contextvars
+import importlib.util
+import logging
+import os
+import random
+import re
+import time
+from bisect import bisect_left
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ..config import SLOW_REQUEST_MS, PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILER
+
+logger = logging.getLogger(__name__)
+
+PYINSTRUMENT_AVAILABLE = importlib.util.find_spec("pyinstrument") is not None
+
+# long poll / event stream: open for as long as the client listens, never "slow"
+LONG_LIVED_ROUTES = ("/api/users/changes", "/api/events")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    """Prometheus histogram: per label set, a count per bucket plus sum and count."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series):
+                cumulative += n
+                le = _labels(self.labels + ("le",), labels + (bound if bound == "+Inf" else f"{bound:g}",))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {series[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+class Gauge:
+    """Value read when /metrics is scraped."""
+
+    def __init__(self, name: str, help: str, read: Callable[[], Optional[float]]):
+        self.name, self.help, self.read = name, help, read
+
+    def render(self) -> Iterable[str]:
+        value = self.read()
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]))
+http_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"]))
+http_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements run per HTTP request", ["method", "route"], QUERY_COUNT_BUCKETS))
+http_db_time = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per HTTP request", ["method", "route"]))
+db_queries = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency (requests and background workers)", ["operation"]))
+telegram_calls = registry.register(Histogram(
+    "telegram_request_duration_seconds", "Bot API call latency, per attempt", ["method", "status"]))
+delivery_queue_wait = registry.register(Histogram(
+    "delivery_queue_wait_seconds", "Time a send waited in the delivery queue for a worker",
+    buckets=LATENCY_BUCKETS + (30.0, 60.0, 300.0)))
+delivery_rejected = registry.register(Counter(
+    "delivery_rejected_total", "Jobs refused by the delivery queue (full, or closed at shutdown)", ["reason"]))
+delivery_spilled = registry.register(Counter(
+    "delivery_spilled_total", "Queued sends moved to the outbox at shutdown"))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "telegram_calls", "telegram_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.telegram_calls = 0
+        self.telegram_seconds = 0.0
+
+
+# set by the middleware for the duration of a request; the SQL hook runs in the request's context
+_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    operation = statement.lstrip()[:6].upper()
+    db_queries.observe(elapsed, operation if operation in _OPERATIONS else "OTHER")
+    stats = _request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Time every SQL statement run through engine and charge it to the current request."""
+    sync_engine = engine.sync_engine
+    if event.contains(sync_engine, "after_cursor_execute", _after_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    registry.register(Gauge("db_pool_connections_in_use", "Connections checked out of the API's pool",
+                            lambda: getattr(sync_engine.pool, "checkedout", lambda: None)()))
+
+
+def observe_telegram(method: str, status: str, seconds: float) -> None:
+    telegram_calls.observe(seconds, method, status)
+    stats = _request.get()
+    if stats is not None:
+        stats.telegram_calls += 1
+        stats.telegram_seconds += seconds
+
+
+class _Profile:
+    """One sampled request: cProfile (whole thread, so concurrent requests show up too)
+    or pyinstrument's async mode, which follows the request's own awaits."""
+
+    _active = False  # cProfile/sys.setprofile can profile one thing at a time
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled")
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @classmethod
+    def start(cls, kind: str) -> Optional["_Profile"]:
+        if cls._active:
+            return None
+        try:
+            profile = cls(kind)
+        except ValueError:  # another profiler (e.g. a debugger) holds the hook
+            return None
+        cls._active = True
+        return profile
+
+    def stop(self) -> None:
+        _Profile._active = False
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def dump(self, directory: str, name: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        if self.kind == "pyinstrument":
+            path += ".html"
+            with open(path, "w") as f:
+                f.write(self._profiler.output_html())
+        else:
+            path += ".prof"
+            self._profiler.dump_stats(path)
+        return path
+
+
+def _route(scope) -> str:
+    route = scope.get("route")
+    # the route template, not the raw path, keeps one series per endpoint
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Per-request latency, SQL statement count and DB time, as metrics and a slow request log.
+
+    Plain ASGI (no BaseHTTPMiddleware task/queue per request) so it can stay on in
+    production: a request costs two clock reads, a context variable and a few dict
+    updates. A `profile_rate` fraction of requests is profiled; the profile is written to
+    `profile_dir` only if the request turns out slower than `slow_ms`.
+    """
+
+    def __init__(self, app, slow_ms: float = SLOW_REQUEST_MS, profile_rate: float = PROFILE_SAMPLE_RATE,
+                 profile_dir: str = PROFILE_DIR, profiler: str = PROFILER):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        if profiler == "pyinstrument" and not PYINSTRUMENT_AVAILABLE:
+            logger.warning("PROFILER=pyinstrument but pyinstrument is not installed; using cProfile")
+            self.profiler = "cprofile"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profile = None
+        if self.profile_rate and random.random() < self.profile_rate:
+            profile = _Profile.start(self.profiler)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.stop()
+            _request.reset(token)
+            self._record(scope, status, elapsed, stats, profile)
+
+    def _record(self, scope, status: int, elapsed: float, stats: RequestStats, profile: Optional[_Profile]) -> None:
+        method, route = scope["method"], _route(scope)
+        http_requests.inc(method, route, str(status))
+        http_duration.observe(elapsed, method, route)
+        http_db_queries.observe(stats.queries, method, route)
+        http_db_time.observe(stats.db_seconds, method, route)
+        if not self.slow_ms or elapsed * 1000 < self.slow_ms or route in LONG_LIVED_ROUTES:
+            return
+        logger.warning("Slow request %s %s -> %d: %.0f ms, %d SQL statements (%.0f ms), %d Telegram calls (%.0f ms)",
+                       method, scope["path"], status, elapsed * 1000, stats.queries, stats.db_seconds * 1000,
+                       stats.telegram_calls, stats.telegram_seconds * 1000)
+        if profile is not None:
+            name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{method}-{re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_')}-{elapsed * 1000:.0f}ms"
+            try:
+                logger.warning("Profile of %s %s written to %s", method, scope["path"], profile.dump(self.profile_dir, name))
+            except OSError:
+                logger.exception("Could not write the profile of %s %s", method, scope["path"])
+
+
+def render() -> Tuple[str, str]:
+    """Body and content type of GET /metrics."""
+    return registry.render(), "text/plain; version=0.0.4; charset=utf-8"
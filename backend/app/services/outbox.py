@@ -0,0 +1,328 @@
+import asyncio
+import json
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from ..config import (
+    OUTBOX_BATCH, OUTBOX_CONCURRENCY, OUTBOX_POLL_INTERVAL, OUTBOX_LEASE, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETENTION_DAYS,
+)
+from ..db.dialect import insert_for
+from ..db.session import AsyncSessionLocal, write_lock
+from ..models.models import OutboxStatus, TelegramOutbox
+from .telegram import TelegramClient, TelegramError, get_telegram
+
+logger = logging.getLogger(__name__)
+
+Action = Dict[str, Any]  # {"method", "payload", "ordering_key"}
+
+
+def action(method: str, payload: Dict[str, Any], ordering_key: str) -> Action:
+    return {"method": method, "payload": payload, "ordering_key": ordering_key}
+
+
+async def enqueue(db: AsyncSession, actions: List[Action], request_key: Optional[str] = None,
+                  batch_id: Optional[str] = None) -> int:
+    """Add actions to the outbox inside the caller's transaction (committed with the change);
+    returns how many were new.
+
+    Each action's idempotency key is "<request_key>:<position>", so replaying a request
+    with the same Idempotency-Key doesn't queue its side effects twice.
+    """
+    if not actions:
+        return 0
+    request_key = request_key or uuid.uuid4().hex
+    now = datetime.utcnow()
+    rows = [{
+        "idempotency_key": f"{request_key}:{i}",
+        "batch_id": batch_id,
+        "ordering_key": a["ordering_key"],
+        "method": a["method"],
+        "payload": json.dumps(a["payload"]),
+        "status": OutboxStatus.pending,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    } for i, a in enumerate(actions)]
+    stmt = insert_for(db, TelegramOutbox).on_conflict_do_nothing(index_elements=[TelegramOutbox.idempotency_key])
+    # through the session's connection: the ORM bulk path doesn't report rowcount
+    conn = await db.connection()
+    return (await conn.execute(stmt, rows)).rowcount
+
+
+async def batch_status(db: AsyncSession, batch_id: str) -> Optional[Dict[str, Any]]:
+    """Progress of the actions queued under batch_id, shaped like a delivery job."""
+    counts = dict((await db.execute(
+        select(TelegramOutbox.status, func.count()).where(TelegramOutbox.batch_id == batch_id)
+        .group_by(TelegramOutbox.status)
+    )).all())
+    total = sum(counts.values())
+    if not total:
+        return None
+    done, failed = counts.get(OutboxStatus.done, 0), counts.get(OutboxStatus.failed, 0)
+    errors = (await db.execute(
+        select(TelegramOutbox.ordering_key, TelegramOutbox.last_error)
+        .where(TelegramOutbox.batch_id == batch_id, TelegramOutbox.status == OutboxStatus.failed)
+        .order_by(TelegramOutbox.id).limit(20)
+    )).all()
+    if done + failed < total:
+        status = "queued" if done + failed == 0 else "running"
+    else:
+        status = "done" if failed == 0 else "done_with_errors"
+    return {
+        "job_id": batch_id,
+        "status": status,
+        "total": total,
+        "sent": done,
+        "failed": failed,
+        "errors": [f"{key}: {error}" for key, error in errors],
+    }
+
+
+class OutboxWorker:
+    """Drains telegram_outbox in batches, at least once, keeping per-ordering_key order.
+
+    A claim leases due actions by pushing their next_attempt_at forward, so another
+    worker (or this one after a crash) only picks them up again once the lease expires.
+    While a batch runs, the lease of its actions is renewed every lease/3 seconds, so a
+    batch slowed down by the rate limits or a 429 can outlive the first lease without
+    being claimed and sent again by another worker.
+    An action is not claimed while an earlier action with the same ordering_key is
+    leased or waiting for a retry. Claimed actions run concurrently across keys and in
+    id order within a key; a retryable failure (network, 429, 5xx) backs off exponentially
+    and holds back the rest of its key, other 4xx errors fail the action for good.
+
+    drain() stops claiming and lets the batch in progress finish and be recorded. If the
+    deadline cuts it short, what was sent is still recorded and what wasn't started is
+    handed back right away rather than after the lease. A call cut mid-request may still
+    reach Telegram, so it keeps its lease (holding back the rest of its key, e.g. an unban
+    must not overtake its ban) and is repeated after it.
+    """
+
+    def __init__(self, batch: int = OUTBOX_BATCH, concurrency: int = OUTBOX_CONCURRENCY,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, lease: int = OUTBOX_LEASE,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, client: Optional[TelegramClient] = None,
+                 session_factory=AsyncSessionLocal):
+        self.batch = batch
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._client = client
+        self._session_factory = session_factory
+        self._handlers: Dict[str, Callable[[TelegramClient, Dict[str, Any]], Awaitable[Any]]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._draining = False
+
+    @property
+    def client(self) -> TelegramClient:
+        return self._client or get_telegram()
+
+    def register(self, method: str, handler: Callable[[TelegramClient, Dict[str, Any]], Awaitable[Any]]) -> None:
+        """Handle a pseudo-method (e.g. a message built at send time) instead of calling the Bot API."""
+        self._handlers[method] = handler
+
+    def notify(self) -> None:
+        """Wake the worker after committing new actions instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._draining = False
+            self._task = asyncio.create_task(self._run())
+
+    def hold(self) -> None:
+        """Claim nothing more; the batch in progress goes on (drain() waits for it)."""
+        self._draining = True
+        self._wakeup.set()
+
+    async def drain(self, timeout: float) -> None:
+        """Claim nothing more and wait up to timeout for the batch in progress."""
+        if self._task is None:
+            return
+        self.hold()
+        await asyncio.wait([self._task], timeout=timeout)
+
+    async def stop(self) -> None:
+        # a batch cut short records what was sent and releases the rest (see drain_once)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        last_cleanup = datetime.min
+        while not self._draining:
+            try:
+                processed = await self.drain_once()
+                if datetime.utcnow() - last_cleanup > timedelta(hours=1):
+                    await self._cleanup()
+                    last_cleanup = datetime.utcnow()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox worker iteration failed")
+                processed = 0
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def drain_once(self) -> int:
+        """Claim one batch of due actions and run it; returns how many were claimed."""
+        claimed, expires = await self._claim()
+        if not claimed:
+            return 0
+        by_key: Dict[str, List[Any]] = {}
+        for row in claimed:
+            by_key.setdefault(row.ordering_key, []).append(row)
+        sem = asyncio.Semaphore(self.concurrency)
+        results: Dict[int, Optional[BaseException]] = {}
+        started: Set[int] = set()
+
+        async def run_key(rows):
+            async with sem:
+                for row in rows:
+                    started.add(row.id)
+                    try:
+                        await self._execute(row.method, json.loads(row.payload))
+                        results[row.id] = None
+                    except Exception as e:
+                        results[row.id] = e
+                        if self._retryable(e) and row.attempts + 1 < self.max_attempts:
+                            break  # the rest of this key waits for the retry
+
+        heartbeat = asyncio.create_task(self._renew([row.id for row in claimed], expires))
+        try:
+            await asyncio.gather(*(run_key(rows) for rows in by_key.values()))
+        except asyncio.CancelledError:
+            heartbeat.cancel()
+            # stopped mid-batch: keep what was sent, the rest is due again for the next worker
+            await asyncio.shield(self._record(claimed, results, cut=started - set(results)))
+            raise
+        finally:
+            heartbeat.cancel()
+        await self._record(claimed, results)
+        return len(claimed)
+
+    async def _renew(self, ids: List[int], expires: datetime) -> None:
+        """Extend the lease of the claimed actions until cancelled: those already sent too, as
+        they are only recorded done at the end of the batch."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            renewed = datetime.utcnow() + timedelta(seconds=self.lease)
+            try:
+                async with self._session_factory() as db:
+                    async with write_lock(db):
+                        # only while still ours: a lease already expired and claimed again stays lost
+                        res = await db.execute(
+                            update(TelegramOutbox)
+                            .where(TelegramOutbox.id.in_(ids), TelegramOutbox.status == OutboxStatus.pending,
+                                   TelegramOutbox.next_attempt_at == expires)
+                            .values(next_attempt_at=renewed)
+                        )
+                        await db.commit()
+            except Exception as e:
+                logger.warning("Outbox lease not renewed: %s", e)
+                continue
+            if res.rowcount < len(ids):
+                logger.warning("Outbox lease of %d actions expired before renewal; they may be sent twice",
+                               len(ids) - res.rowcount)
+            expires = renewed
+
+    async def _execute(self, method: str, payload: Dict[str, Any]) -> Any:
+        handler = self._handlers.get(method)
+        if handler is not None:
+            return await handler(self.client, payload)
+        return await self.client.call(method, payload)
+
+    @staticmethod
+    def _retryable(e: BaseException) -> bool:
+        if isinstance(e, TelegramError):
+            return e.status_code in (0, 429) or e.status_code >= 500
+        return True
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(600, 2 ** attempts) * (0.5 + random.random() / 2))
+
+    async def _claim(self) -> Tuple[List[Any], datetime]:
+        """Lease up to `batch` due actions; returns them, in id order, and the lease's expiry."""
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self.lease)
+        earlier = aliased(TelegramOutbox)
+        blocked = exists().where(
+            earlier.ordering_key == TelegramOutbox.ordering_key,
+            earlier.status == OutboxStatus.pending,
+            earlier.id < TelegramOutbox.id,
+            earlier.next_attempt_at > now,
+        )
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                ids = (await db.execute(
+                    select(TelegramOutbox.id)
+                    .where(TelegramOutbox.status == OutboxStatus.pending, TelegramOutbox.next_attempt_at <= now, ~blocked)
+                    .order_by(TelegramOutbox.id).limit(self.batch)
+                )).scalars().all()
+                if not ids:
+                    await db.rollback()
+                    return [], expires
+                rows = (await db.execute(
+                    update(TelegramOutbox)
+                    .where(TelegramOutbox.id.in_(ids), TelegramOutbox.status == OutboxStatus.pending,
+                           TelegramOutbox.next_attempt_at <= now)
+                    .values(next_attempt_at=expires)
+                    .returning(TelegramOutbox.id, TelegramOutbox.ordering_key, TelegramOutbox.method,
+                               TelegramOutbox.payload, TelegramOutbox.attempts)
+                )).all()
+                await db.commit()
+        return sorted(rows, key=lambda r: r.id), expires
+
+    async def _record(self, claimed: List[Any], results: Dict[int, Optional[BaseException]],
+                      cut: Set[int] = frozenset()) -> None:
+        now = datetime.utcnow()
+        done = [row.id for row in claimed if row.id in results and results[row.id] is None]
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                if done:
+                    await db.execute(update(TelegramOutbox).where(TelegramOutbox.id.in_(done))
+                                     .values(status=OutboxStatus.done, done_at=now, last_error=None))
+                for row in claimed:
+                    if row.id in cut:
+                        continue  # left leased
+                    if row.id not in results:
+                        # skipped behind a failure of its key: due again right away, but held back
+                        # by the earlier action until that one is retried
+                        values = {"next_attempt_at": now}
+                    elif results[row.id] is None:
+                        continue
+                    else:
+                        e, attempts = results[row.id], row.attempts + 1
+                        logger.warning("Outbox %s %s failed (attempt %d): %s", row.method, row.ordering_key, attempts, e)
+                        values = {"attempts": attempts, "last_error": str(e)[:1000]}
+                        if self._retryable(e) and attempts < self.max_attempts:
+                            values["next_attempt_at"] = now + self._backoff(attempts)
+                        else:
+                            values.update(status=OutboxStatus.failed, done_at=now)
+                    await db.execute(update(TelegramOutbox).where(TelegramOutbox.id == row.id).values(**values))
+                await db.commit()
+
+    async def _cleanup(self) -> None:
+        cutoff = datetime.utcnow() - timedelta(days=OUTBOX_RETENTION_DAYS)
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                await db.execute(delete(TelegramOutbox).where(
+                    TelegramOutbox.status == OutboxStatus.done, TelegramOutbox.done_at < cutoff))
+                await db.commit()
+
+
+outbox = OutboxWorker()
@@ -0,0 +1,47 @@
+import hashlib
+import importlib.util
+import json
+from typing import Any, Mapping, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# orjson encodes several times faster than json; optional, like h2 and pyinstrument
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+if ORJSON_AVAILABLE:
+    import orjson
+
+
+def dumps(content: Any) -> bytes:
+    """JSON bytes of plain dicts/lists/str/int/float/None, as JSONResponse would render them."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def etag(body: bytes) -> str:
+    # from the body, so every worker gives the same tag for the same content
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def json_response(request: Optional[Request], content: Any, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Pre-built JSON content (no response_model validation), with an ETag when a request is
+    given: a client sending it back in If-None-Match gets 304 and no body if nothing changed.
+
+    The endpoint's response_model still documents the shape; content must already match it.
+    """
+    body = dumps(content)
+    headers = dict(headers or {})
+    if request is not None:
+        tag = headers["ETag"] = etag(body)
+        if _matches(request.headers.get("if-none-match"), tag):
+            return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    # weak comparison, as If-None-Match asks for
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return tag in tags or "*" in tags
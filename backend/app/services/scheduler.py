@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select, update
+
+from ..config import LEVEL_CHANNELS, SCHEDULER_RESYNC
+from ..db.session import AsyncSessionLocal, write_lock
+from ..models.models import Content, ContentVisibility, ScheduledContent, ScheduleStatus, User
+from .change_feed import change_feed
+from .outbox import action as outbox_action, enqueue as outbox_enqueue, outbox
+from .telegram import get_telegram, pack_messages
+
+logger = logging.getLogger(__name__)
+
+
+def notification_text(title: str, body: str, link: Optional[str]) -> str:
+    text = f"{title}\n\n{body}"
+    if link:
+        text += f"\n{link}"
+    return text
+
+
+class PublishScheduler:
+    """Publishes scheduled contents when their publish_at comes.
+
+    Due times are kept in a heap, loaded from scheduled_contents at start and fed by
+    schedule(); the loop sleeps until the earliest one instead of polling the table.
+    Every `resync` seconds it also reads the earliest pending publish_at (one index
+    lookup) to pick up contents scheduled through another process.
+
+    A wake-up publishes everything due in one transaction: the rows are claimed with
+    UPDATE ... WHERE status = 'scheduled', their contents and visibility are created and
+    the channel notifications go to the outbox, packed per chat into as few messages as
+    the length limit allows. A restart or a second process can't publish or announce a
+    content twice: either the whole transaction committed or nothing did.
+    """
+
+    def __init__(self, resync: float = SCHEDULER_RESYNC, channels: Dict[int, Optional[str]] = LEVEL_CHANNELS,
+                 session_factory=AsyncSessionLocal):
+        self.resync = resync
+        self.channels = channels
+        self._session_factory = session_factory
+        self._timers: List[datetime] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, publish_at: datetime) -> None:
+        """Add a timer for a committed ScheduledContent."""
+        heapq.heappush(self._timers, publish_at)
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        async with self._session_factory() as db:
+            self._timers = list((await db.execute(
+                select(ScheduledContent.publish_at).where(ScheduledContent.status == ScheduleStatus.scheduled)
+            )).scalars())
+        heapq.heapify(self._timers)
+        next_resync = datetime.utcnow() + timedelta(seconds=self.resync)
+        while True:
+            now = datetime.utcnow()
+            try:
+                if self._timers and self._timers[0] <= now:
+                    while self._timers and self._timers[0] <= now:
+                        heapq.heappop(self._timers)
+                    await self.publish_due(now)
+                elif now >= next_resync:
+                    next_resync = now + timedelta(seconds=self.resync)
+                    await self._resync()
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # the timers are gone, the rows are still scheduled: the next resync retries them
+                logger.exception("Scheduled publishing failed")
+            wait = min([next_resync] + self._timers[:1]) - datetime.utcnow()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, wait.total_seconds()))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _resync(self) -> None:
+        async with self._session_factory() as db:
+            earliest = (await db.execute(
+                select(func.min(ScheduledContent.publish_at)).where(ScheduledContent.status == ScheduleStatus.scheduled)
+            )).scalar()
+        if earliest is not None and (not self._timers or earliest < self._timers[0]):
+            heapq.heappush(self._timers, earliest)
+
+    async def publish_due(self, now: Optional[datetime] = None) -> List[int]:
+        """Publish every content due at `now` in one transaction; returns the new content ids."""
+        now = now or datetime.utcnow()
+        async with self._session_factory() as db:
+            async with write_lock(db):
+                due = (await db.execute(
+                    update(ScheduledContent)
+                    .where(ScheduledContent.status == ScheduleStatus.scheduled, ScheduledContent.publish_at <= now)
+                    .values(status=ScheduleStatus.published)
+                    .returning(ScheduledContent)
+                )).scalars().all()
+                if not due:
+                    await db.rollback()
+                    return []
+                due = sorted(due, key=lambda s: (s.publish_at, s.id))
+                contents = [Content(title=s.title, body=s.body, link=s.link, author_id=0, published_at=now) for s in due]
+                db.add_all(contents)
+                await db.flush()
+
+                user_ids = {uid for s in due for uid in json.loads(s.user_ids)}
+                telegram_ids = dict((await db.execute(
+                    select(User.id, User.telegram_id).where(User.id.in_(user_ids))
+                )).all()) if user_ids else {}
+                chats: Dict[Any, List[str]] = {}  # chat_id -> texts, in publishing order
+                for s, c in zip(due, contents):
+                    levels, uids = sorted(set(json.loads(s.levels))), sorted(set(json.loads(s.user_ids)))
+                    db.add_all([ContentVisibility(content_id=c.id, level_target=lvl) for lvl in levels])
+                    db.add_all([ContentVisibility(content_id=c.id, user_id=uid) for uid in uids])
+                    s.content_id = c.id
+                    if not s.notify:
+                        continue
+                    text = notification_text(c.title, c.body, c.link)
+                    for chat_id in [self.channels.get(lvl) for lvl in levels] + [telegram_ids.get(uid) for uid in uids]:
+                        if chat_id:
+                            chats.setdefault(chat_id, []).append(text)
+
+                actions = [outbox_action("sendMessage", {"chat_id": chat_id, "text": message}, str(chat_id))
+                           for chat_id, texts in chats.items() for message in pack_messages(texts)]
+                if actions and not get_telegram().enabled:
+                    logger.warning("Telegram bot token not configured: %d scheduled notifications dropped", len(actions))
+                    actions = []
+                if actions:
+                    batch_id = uuid.uuid4().hex
+                    # each schedule row is claimed once, so its id keys this batch's actions
+                    await outbox_enqueue(db, actions, request_key=f"schedule:{due[0].id}", batch_id=batch_id)
+                    for s in due:
+                        if s.notify:
+                            s.batch_id = batch_id
+                await db.commit()
+        if actions:
+            outbox.notify()
+        # the admin panels learn of the new contents from the change log
+        await change_feed.poll()
+        logger.info("Published %d scheduled contents, %d messages to %d chats", len(due), len(actions), len(chats))
+        return [c.id for c in contents]
+
+
+scheduler = PublishScheduler()
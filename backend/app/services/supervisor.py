@@ -0,0 +1,80 @@
+import asyncio
+import inspect
+import logging
+import signal
+import time
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], Union[None, Awaitable[None]]]
+Drain = Callable[[float], Awaitable[None]]
+
+
+async def _call(hook: Hook) -> None:
+    result = hook()
+    if inspect.isawaitable(result):
+        await result
+
+
+class Supervisor:
+    """The background services of a process (the API's lifespan, the bot's main): started
+    in the order they were added and shut down in reverse, so a service is stopped before
+    the ones it uses (the outbox before the DB engine).
+
+    On shutdown each service is first drained (stop taking work, finish or hand over what
+    it accepted) with what is left of one overall deadline, then stopped. Drains and stops
+    are independent: one failing is logged and the others still run.
+
+    Standard library only: the bot imports it too.
+    """
+
+    def __init__(self, drain_timeout: float):
+        self.drain_timeout = drain_timeout
+        self._services: List[Tuple[str, Optional[Hook], Optional[Drain], Optional[Hook]]] = []
+        self._started: List[Tuple[str, Optional[Hook], Optional[Drain], Optional[Hook]]] = []
+
+    def add(self, name: str, start: Optional[Hook] = None, drain: Optional[Drain] = None,
+            stop: Optional[Hook] = None) -> None:
+        """start() and stop() may be sync or async; drain(timeout) is async."""
+        self._services.append((name, start, drain, stop))
+
+    async def start(self) -> None:
+        for service in self._services:
+            if service in self._started:
+                continue
+            if service[1] is not None:
+                await _call(service[1])
+            self._started.append(service)
+
+    async def shutdown(self) -> None:
+        deadline = time.monotonic() + self.drain_timeout
+        for name, _, drain, stop in reversed(self._started):
+            t0 = time.monotonic()
+            if drain is not None:
+                try:
+                    await drain(max(0.0, deadline - t0))
+                except Exception:
+                    logger.exception("Draining %s failed", name)
+            if stop is not None:
+                try:
+                    await _call(stop)
+                except Exception:
+                    logger.exception("Stopping %s failed", name)
+            logger.info("Stopped %s in %.0f ms", name, (time.monotonic() - t0) * 1000)
+        self._started = []
+
+    @staticmethod
+    async def wait_for_signal(signals: Sequence[signal.Signals] = (signal.SIGTERM, signal.SIGINT)) -> signal.Signals:
+        """Wait for SIGTERM/SIGINT (for processes without a server doing it, e.g. the bot)."""
+        loop = asyncio.get_running_loop()
+        received = loop.create_future()
+        for sig in signals:
+            loop.add_signal_handler(sig, lambda sig=sig: received.done() or received.set_result(sig))
+        try:
+            sig = await received
+            logger.info("Received %s, shutting down", sig.name)
+            return sig
+        finally:
+            for sig in signals:
+                loop.remove_signal_handler(sig)
@@ -0,0 +1,373 @@
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional
+
+from sqlalchemy import case
+
+from ..config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_API_BASE,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_GLOBAL_BURST,
+    TELEGRAM_PER_CHAT_RATE,
+    TELEGRAM_TIMEOUT,
+    TELEGRAM_MAX_RETRIES,
+    TELEGRAM_RATE_SHARED,
+    TELEGRAM_RATE_RESERVE,
+)
+from .metrics import observe_telegram
+
+if TYPE_CHECKING:
+    import httpx  # imported on the first call: ~200 ms of startup for processes that never call Telegram
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class TelegramError(Exception):
+    def __init__(self, description: str, status_code: int = 0):
+        super().__init__(description)
+        self.description = description
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Async token bucket; waiters are served in FIFO order."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        # capacity 1 spaces calls evenly, so no 1s window ever sees more than `rate`
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def pause(self, seconds: float) -> None:
+        # async like SharedTokenBucket.pause, which writes to the database: the client's global
+        # bucket is either one. Drive the bucket negative so nobody gets a token for `seconds`
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class SharedTokenBucket:
+    """The limit of a TokenBucket(rate, capacity), shared by every process through the
+    database (table rate_limits), e.g. the API workers sending as the same bot.
+
+    Kept as a theoretical arrival time (GCRA): a round trip moves the row's `tat` one
+    interval further per slot in a single upsert ... RETURNING, `capacity` calls being
+    allowed ahead of the rate. Slots are reserved for the callers waiting at that moment,
+    up to `reserve` at a time, so a busy process does one write (under SQLite's write lock)
+    per batch rather than per call. A slot may be used from `capacity - 1` intervals before
+    its time (the burst) to one interval after it; a slot missed by more is dropped, as
+    using it would bunch up with the next ones. The reservation starts from the database's
+    clock when the upsert runs, not from when it was sent: a write waiting for the lock
+    doesn't hand out slots already past. Unix time, so the processes (and on PostgreSQL the
+    database server) must share a clock. If the database fails, the process falls back on
+    its own bucket.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float = 1.0, reserve: int = TELEGRAM_RATE_RESERVE,
+                 session_factory=None):
+        self.name = name
+        self.interval = 1 / rate
+        self.ahead = (capacity - 1) * self.interval
+        self.reserve = max(1, reserve)
+        self._session_factory = session_factory
+        self._local = TokenBucket(rate, capacity)
+        self._failing = False
+        self._slots: Deque[float] = deque()  # reserved start times, earliest first
+        self._waiting = 0
+        self._lock = asyncio.Lock()
+
+    async def _push(self, at_least: float, step: float) -> float:
+        """tat = max(tat, the database's now, at_least) + step; returns the new tat."""
+        from ..db.dialect import insert_for, unix_time
+        from ..db.session import AsyncSessionLocal, write_lock
+        from ..models.models import RateLimit
+
+        async with (self._session_factory or AsyncSessionLocal)() as db:
+            now = unix_time(db)
+            start = case((now > at_least, now), else_=at_least)
+            stmt = insert_for(db, RateLimit).values(name=self.name, tat=start + step)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[RateLimit.name],
+                set_={"tat": case((RateLimit.tat > start, RateLimit.tat), else_=start) + step},
+            ).returning(RateLimit.tat)
+            # one statement in autocommit, as /register: the SQLite write lock is held for it only
+            conn = await db.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+            async with write_lock():
+                tat = (await conn.execute(stmt)).scalar_one()
+        if self._failing:
+            logger.info("Shared rate limit %s available again", self.name)
+            self._failing = False
+        return tat
+
+    def _failed(self, e: Exception) -> None:
+        if not self._failing:
+            logger.warning("Shared rate limit %s unavailable, limiting this process only: %s", self.name, e)
+            self._failing = True
+
+    async def _slot(self) -> Optional[float]:
+        """Start time of a reserved slot; None if the database failed."""
+        # slots are kept as the earliest time they may be used, `ahead` before their own
+        late = time.time() - self.interval - self.ahead
+        while self._slots and self._slots[0] < late:
+            self._slots.popleft()  # missed: using it now could bunch up with the next ones
+        if not self._slots:
+            n = min(self.reserve, self._waiting)
+            try:
+                tat = await self._push(0.0, n * self.interval)
+            except Exception as e:
+                self._failed(e)
+                return None
+            first = tat - n * self.interval - self.ahead
+            self._slots.extend(first + i * self.interval for i in range(n))
+        return self._slots.popleft()
+
+    async def acquire(self) -> None:
+        self._waiting += 1
+        try:
+            async with self._lock:
+                slot = await self._slot()
+        finally:
+            self._waiting -= 1
+        if slot is None:
+            await self._local.acquire()
+            return
+        wait = slot - time.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def pause(self, seconds: float) -> None:
+        # nobody gets a slot for `seconds`: the next one is at now + seconds at the earliest;
+        # the slots reserved for after the pause are still ours
+        until = time.time() + seconds
+        while self._slots and self._slots[0] < until:
+            self._slots.popleft()
+        try:
+            await self._push(until + self.ahead, 0)
+        except Exception as e:
+            self._failed(e)
+            await self._local.pause(seconds)
+
+
+class TelegramClient:
+    """Bot API client sharing one pooled httpx.AsyncClient and Telegram's rate limits.
+
+    Meant to live for the whole application: keep-alive connections (HTTP/2 when
+    available) are reused by every call. Errors after which the call can't have been
+    carried out (connect errors) are retried with exponential backoff, and for the get*
+    methods 5xx and any transport error too. A 429 holds back the call's chat for
+    `retry_after`, or every call when it has no chat_id or two chats hit 429s in a row
+    (the global limit). The global limit is shared with the other API processes
+    (shared_rate, the default); the per-chat ones are per process.
+    """
+
+    MAX_CHAT_BUCKETS = 10000
+    BACKOFF_BASE = 0.5
+
+    def __init__(
+        self,
+        token: Optional[str] = TELEGRAM_BOT_TOKEN,
+        base_url: str = TELEGRAM_API_BASE,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        per_chat_rate: float = TELEGRAM_PER_CHAT_RATE,
+        global_burst: int = TELEGRAM_GLOBAL_BURST,
+        timeout: float = TELEGRAM_TIMEOUT,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+        shared_rate: bool = TELEGRAM_RATE_SHARED,
+    ):
+        self.token = token
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.per_chat_rate = per_chat_rate
+        # burst + refill never exceed global_rate within any 1s window
+        burst = max(1, min(global_burst, int(global_rate) - 1))
+        if shared_rate:
+            self.global_bucket = SharedTokenBucket("telegram", global_rate - burst + 1, capacity=burst)
+        else:
+            self.global_bucket = TokenBucket(global_rate - burst + 1, capacity=burst)
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._last_429: tuple = (None, 0.0)  # (chat_id, until) of the last 429 for a chat
+        self._http: Optional["httpx.AsyncClient"] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    @property
+    def http(self) -> "httpx.AsyncClient":
+        if self._http is None:
+            import httpx
+
+            self._http = httpx.AsyncClient(
+                base_url=f"{self.base_url}/bot{self.token}/",
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+                http2=HTTP2_AVAILABLE,
+            )
+        return self._http
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _flooded(self, chat_id, retry_after: float) -> bool:
+        """Whether a 429 for chat_id is the bot's global limit rather than the chat's: another
+        chat got one within its retry_after too (Telegram's answer doesn't say which)."""
+        now = time.monotonic()
+        other, until = self._last_429
+        self._last_429 = (chat_id, now + retry_after)
+        return other != chat_id and until > now
+
+    def _backoff(self, attempt: int) -> float:
+        return self.BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def call(self, method: str, payload: Dict[str, Any]) -> Any:
+        """Call a Bot API method and return its `result`; raises TelegramError."""
+        import httpx
+
+        error = TelegramError("Too Many Requests: retries exhausted", 429)
+        for attempt in range(self.max_retries + 1):
+            if method.startswith("send") and "chat_id" in payload:
+                await self._chat_bucket(payload["chat_id"]).acquire()
+            await self.global_bucket.acquire()
+            start = time.perf_counter()
+            try:
+                r = await self.http.post(method, json=payload)
+            except httpx.TransportError as e:
+                observe_telegram(method, "error", time.perf_counter() - start)
+                error = TelegramError(f"{type(e).__name__}: {e}")
+                if not (method.startswith("get") or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout,
+                                                                    httpx.PoolTimeout))):
+                    # the request may have reached Telegram (e.g. a read timeout): a sendMessage or
+                    # banChatMember repeated here would be done twice
+                    raise error
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            observe_telegram(method, str(r.status_code), time.perf_counter() - start)
+            if r.status_code >= 500:
+                error = TelegramError(r.text or r.reason_phrase, r.status_code)
+                if not method.startswith("get"):
+                    # a 502/504 from Telegram's frontend may come after the call was carried out:
+                    # left to the caller (the outbox retries it, a delivery job records it failed)
+                    raise error
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            try:
+                data = r.json()
+            except ValueError:
+                raise TelegramError(r.text or r.reason_phrase, r.status_code)
+            if r.status_code == 429:
+                retry_after = data.get("parameters", {}).get("retry_after", 1)
+                if "chat_id" in payload and not self._flooded(payload["chat_id"], retry_after):
+                    # a chat's flood limit: the other chats (and the other workers) go on
+                    await self._chat_bucket(payload["chat_id"]).pause(retry_after)
+                    if not method.startswith("send"):
+                        await asyncio.sleep(retry_after)  # only sends wait for the chat's bucket
+                else:
+                    await self.global_bucket.pause(retry_after)
+                error = TelegramError(data.get("description", "Too Many Requests"), 429)
+                continue
+            if not data.get("ok"):
+                raise TelegramError(data.get("description", "Unknown error"), r.status_code)
+            return data.get("result")
+        logger.warning("Telegram %s failed after %d attempts: %s", method, self.max_retries + 1, error)
+        raise error
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+MAX_MESSAGE_LENGTH = 4096  # sendMessage text limit, in UTF-16 code units
+MESSAGE_SEPARATOR = "\n\n———\n\n"
+
+
+def message_length(text: str) -> int:
+    """Length as Telegram counts it: UTF-16 code units (an emoji is 2)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into pieces of at most `limit`, at a paragraph, line or word break when
+    one falls in the second half of the piece, mid-word otherwise."""
+    pieces = []
+    while message_length(text) > limit:
+        # longest prefix within the limit, never half of a surrogate pair
+        head = text.encode("utf-16-le")[:limit * 2].decode("utf-16-le", errors="ignore")
+        cut = len(head)
+        for separator in ("\n\n", "\n", " "):
+            at = head.rfind(separator)
+            if at > cut // 2:
+                cut = at
+                break
+        pieces.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def pack_messages(texts: List[str], limit: int = MAX_MESSAGE_LENGTH, separator: str = MESSAGE_SEPARATOR) -> List[str]:
+    """Join texts, in order, into as few messages of at most `limit` as possible.
+
+    A text goes whole into the current message if it fits, else into a new one; a text
+    longer than a message is split (split_message) and the messages after it may start
+    in its last piece.
+    """
+    messages: List[str] = []
+    for text in texts:
+        if messages and message_length(messages[-1]) + message_length(separator + text) <= limit:
+            messages[-1] += separator + text
+        else:
+            messages.extend(split_message(text, limit))
+    return messages
+
+
+_client: Optional[TelegramClient] = None
+
+
+def get_telegram() -> TelegramClient:
+    global _client
+    if _client is None:
+        _client = TelegramClient()
+    return _client
+
+
+async def close_telegram() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,64 @@
+import asyncio
+from collections import deque
+from typing import Iterable, Optional, Tuple
+
+from ..config import USER_EVENTS_BUFFER
+
+
+class UserEvents:
+    """Log of recent user changes, by telegram_id, for clients caching users (the bot).
+
+    Filled by the change feed (services/change_feed.py), with the ids of the change log as
+    seqs: every API worker hands out the same seqs, so a client may long-poll any of
+    them. Clients long-poll GET /api/users/changes with the last seq they saw and drop the
+    listed users from their cache. Only the last `size` changes are kept, from the start
+    of this process: a client that is further behind, or ahead of the log (a new
+    database), gets reset=True and must drop its whole cache.
+    """
+
+    def __init__(self, size: int = USER_EVENTS_BUFFER):
+        self._log = deque(maxlen=size)  # (seq, telegram_id)
+        self._seq = 0
+        self._base = 0  # seq of the last change not in the log any more
+        self._wakeup = asyncio.Event()
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def start_at(self, seq: int) -> None:
+        """Log from `seq` on: the changes up to it are unknown to this process (it just
+        started, or fell behind the change log), clients behind it are reset."""
+        self._log.clear()
+        self._seq = self._base = seq
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    def changed(self, changes: Iterable[Tuple[int, Optional[int]]]) -> None:
+        """Record committed changes as (seq, telegram_id), seqs increasing."""
+        for seq, telegram_id in changes:
+            if len(self._log) == self._log.maxlen:
+                self._base = self._log[0][0]
+            self._log.append((seq, telegram_id))
+            self._seq = seq
+        # wake the current waiters; later ones wait on a fresh event
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def since(self, after: int, timeout: float) -> dict:
+        """Changes after seq `after`, waiting up to `timeout` seconds for one if there is none yet."""
+        if after == self._seq and timeout > 0:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        ids = {telegram_id for seq, telegram_id in self._log if seq > after}
+        reset = after > self._seq or after < self._base
+        return {
+            "seq": self._seq,
+            "reset": reset,
+            "telegram_ids": [] if reset else sorted(ids),
+        }
+
+
+user_events = UserEvents()
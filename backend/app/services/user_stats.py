@@ -0,0 +1,55 @@
+import asyncio
+import time
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from ..config import USER_STATS_TTL
+from ..db.session import AsyncSessionLocal
+from ..models.models import User, UserStatus
+
+
+class UserStats:
+    """Per-level/per-status user totals for the dashboard counters.
+
+    Counts come from index-only GROUP BYs and are then served for `ttl` seconds or until a
+    write calls invalidate(). Concurrent misses share one computation, and a result
+    computed across an invalidation is not stored.
+    """
+
+    def __init__(self, ttl: float = USER_STATS_TTL, session_factory=AsyncSessionLocal):
+        self.ttl = ttl
+        self._session_factory = session_factory
+        self._value: Optional[dict] = None
+        self._expires = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._value = None
+
+    async def get(self) -> dict:
+        if self._value is not None and time.monotonic() < self._expires:
+            return self._value
+        async with self._lock:
+            if self._value is not None and time.monotonic() < self._expires:
+                return self._value
+            generation = self._generation
+            value = await self._count()
+            if generation == self._generation:
+                self._value, self._expires = value, time.monotonic() + self.ttl
+            return value
+
+    async def _count(self) -> dict:
+        # two GROUP BYs that only read ix_users_level_id / ix_users_status_id
+        async with self._session_factory() as db:
+            by_level = dict((await db.execute(select(User.level, func.count()).group_by(User.level))).all())
+            by_status = dict((await db.execute(select(User.status, func.count()).group_by(User.status))).all())
+        return {
+            "total": sum(by_level.values()),
+            "by_level": {str(l): by_level.get(l, 0) for l in sorted({1, 2, 3, 4} | set(by_level))},
+            "by_status": {s.value: by_status.get(s, 0) for s in UserStatus},
+        }
+
+user_stats = UserStats()
@@ -0,0 +1,51 @@
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+
+from backend.app.db.session import Base, SQLALCHEMY_DATABASE_URL, sync_url
+from backend.app.models import models  # noqa: F401 (register tables on Base.metadata)
+
+config = context.config
+DATABASE_URL = sync_url(SQLALCHEMY_DATABASE_URL)
+config.set_main_option("sqlalchemy.url", DATABASE_URL)
+target_metadata = Base.metadata
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # the full-text index (migration 0006, db/fulltext.py) lives outside the models
+    if type_ == "table" and name.startswith("contents_fts"):
+        return False
+    if type_ == "column" and name == "search_vector":
+        return False
+    return True
+
+
+def run_migrations_offline():
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section, {}),
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+    with connectable.connect() as connection:
+        # batch mode so ALTERs work on SQLite too
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True,
+                          include_object=include_object)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
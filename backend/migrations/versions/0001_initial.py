@@ -0,0 +1,65 @@
+"""initial schema: users, contents, content_visibility
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("telegram_id", sa.BigInteger(), nullable=False),
+        sa.Column("first_name", sa.String()),
+        sa.Column("last_name", sa.String()),
+        sa.Column("phone", sa.String()),
+        sa.Column("email", sa.String()),
+        sa.Column("indirizzo", sa.String()),
+        sa.Column("varie", sa.Text()),
+        sa.Column("level", sa.Integer(), nullable=False),
+        sa.Column("status", sa.Enum("active", "pending", "rejected", name="userstatus"), nullable=False),
+        sa.Column("approved_by", sa.Integer(), nullable=True),
+        sa.Column("approved_at", sa.DateTime()),
+        sa.Column("registered_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_telegram_id", "users", ["telegram_id"], unique=True)
+
+    op.create_table(
+        "contents",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.Column("link", sa.String()),
+        sa.Column("author_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("published_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_contents_id", "contents", ["id"])
+
+    op.create_table(
+        "content_visibility",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("content_id", sa.Integer(), sa.ForeignKey("contents.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=True),
+        sa.Column("level_target", sa.Integer(), nullable=True),
+        sa.UniqueConstraint("content_id", "user_id", name="ux_visibility_user"),
+        sa.UniqueConstraint("content_id", "level_target", name="ux_visibility_level"),
+    )
+
+
+def downgrade():
+    op.drop_table("content_visibility")
+    op.drop_index("ix_contents_id", table_name="contents")
+    op.drop_table("contents")
+    op.drop_index("ix_users_telegram_id", table_name="users")
+    op.drop_index("ix_users_id", table_name="users")
+    op.drop_table("users")
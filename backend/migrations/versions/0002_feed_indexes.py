@@ -0,0 +1,23 @@
+"""indexes for history pagination and per-user feed
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_contents_published_at_id", "contents", ["published_at", "id"])
+    op.create_index("ix_visibility_user_content", "content_visibility", ["user_id", "content_id"])
+
+
+def downgrade():
+    op.drop_index("ix_visibility_user_content", table_name="content_visibility")
+    op.drop_index("ix_contents_published_at_id", table_name="contents")
@@ -0,0 +1,30 @@
+"""shared invite link cache
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "invite_links",
+        sa.Column("channel_id", sa.String(), primary_key=True),
+        sa.Column("invite_link", sa.String(), nullable=False),
+        sa.Column("expire_date", sa.DateTime(), nullable=True),
+        sa.Column("member_limit", sa.Integer(), nullable=True),
+        sa.Column("handed_out", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("invite_links")
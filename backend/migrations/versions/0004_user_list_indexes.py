@@ -0,0 +1,32 @@
+"""indexes for /api/users filters, prefix search, sorting and stats
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_users_level_id", "users", ["level", "id"])
+    op.create_index("ix_users_status_id", "users", ["status", "id"])
+    op.create_index("ix_users_first_name_lower", "users", [sa.text("lower(first_name)")])
+    op.create_index("ix_users_last_name_lower_id", "users", [sa.text("coalesce(lower(last_name), '')"), "id"])
+    op.create_index("ix_users_email_lower", "users", [sa.text("lower(email)")])
+    op.create_index("ix_users_phone", "users", ["phone"])
+
+
+def downgrade():
+    op.drop_index("ix_users_phone", table_name="users")
+    op.drop_index("ix_users_email_lower", table_name="users")
+    op.drop_index("ix_users_last_name_lower_id", table_name="users")
+    op.drop_index("ix_users_first_name_lower", table_name="users")
+    op.drop_index("ix_users_status_id", table_name="users")
+    op.drop_index("ix_users_level_id", table_name="users")
@@ -0,0 +1,43 @@
+"""transactional outbox for Telegram side effects
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "telegram_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("idempotency_key", sa.String(), nullable=False, unique=True),
+        sa.Column("batch_id", sa.String(), nullable=True),
+        sa.Column("ordering_key", sa.String(), nullable=False),
+        sa.Column("method", sa.String(), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("status", sa.Enum("pending", "done", "failed", name="outboxstatus"), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("done_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_outbox_status_next_attempt", "telegram_outbox", ["status", "next_attempt_at"])
+    op.create_index("ix_outbox_key_status_id", "telegram_outbox", ["ordering_key", "status", "id"])
+    op.create_index("ix_outbox_batch", "telegram_outbox", ["batch_id"])
+
+
+def downgrade():
+    op.drop_index("ix_outbox_batch", table_name="telegram_outbox")
+    op.drop_index("ix_outbox_key_status_id", table_name="telegram_outbox")
+    op.drop_index("ix_outbox_status_next_attempt", table_name="telegram_outbox")
+    op.drop_table("telegram_outbox")
+    sa.Enum(name="outboxstatus").drop(op.get_bind(), checkfirst=True)
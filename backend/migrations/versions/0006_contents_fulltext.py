@@ -0,0 +1,52 @@
+"""full-text index over contents (FTS5 on SQLite, tsvector + GIN on PostgreSQL)
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE contents_fts USING fts5("
+    "title, body, content='contents', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "INSERT INTO contents_fts(contents_fts, rank) VALUES('rank', 'bm25(10.0, 1.0)')",
+    "CREATE TRIGGER contents_fts_ai AFTER INSERT ON contents BEGIN "
+    "INSERT INTO contents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER contents_fts_ad AFTER DELETE ON contents BEGIN "
+    "INSERT INTO contents_fts(contents_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER contents_fts_au AFTER UPDATE OF title, body ON contents BEGIN "
+    "INSERT INTO contents_fts(contents_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO contents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    # index the existing contents
+    "INSERT INTO contents_fts(contents_fts) VALUES('rebuild')",
+]
+
+POSTGRES_UPGRADE = [
+    "ALTER TABLE contents ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('italian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('italian', coalesce(body, '')), 'B')) STORED",
+    "CREATE INDEX ix_contents_search ON contents USING gin (search_vector)",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for sql in SQLITE_UPGRADE if dialect == "sqlite" else POSTGRES_UPGRADE if dialect == "postgresql" else []:
+        op.execute(sql)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        for trigger in ("contents_fts_au", "contents_fts_ad", "contents_fts_ai"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS contents_fts")
+    elif dialect == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_contents_search")
+        op.execute("ALTER TABLE contents DROP COLUMN IF EXISTS search_vector")
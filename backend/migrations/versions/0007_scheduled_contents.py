@@ -0,0 +1,39 @@
+"""scheduled publishing of contents
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "scheduled_contents",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.Column("link", sa.String(), nullable=True),
+        sa.Column("levels", sa.Text(), nullable=False),
+        sa.Column("user_ids", sa.Text(), nullable=False),
+        sa.Column("notify", sa.Boolean(), nullable=False),
+        sa.Column("publish_at", sa.DateTime(), nullable=False),
+        sa.Column("status", sa.Enum("scheduled", "published", "cancelled", name="schedulestatus"), nullable=False),
+        sa.Column("content_id", sa.Integer(), sa.ForeignKey("contents.id", ondelete="SET NULL"), nullable=True),
+        sa.Column("batch_id", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_scheduled_status_publish_at", "scheduled_contents", ["status", "publish_at"])
+
+
+def downgrade():
+    op.drop_index("ix_scheduled_status_publish_at", table_name="scheduled_contents")
+    op.drop_table("scheduled_contents")
+    sa.Enum(name="schedulestatus").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,47 @@
+"""channel memberships, users.updated_at and job checkpoints for the membership reconciliation
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("users", sa.Column("updated_at", sa.DateTime(), nullable=True))
+    op.execute("UPDATE users SET updated_at = registered_at")
+    op.create_index("ix_users_updated_at", "users", ["updated_at"])
+    op.create_table(
+        "channel_members",
+        sa.Column("channel_id", sa.String(), primary_key=True),
+        sa.Column("telegram_id", sa.BigInteger(), primary_key=True),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("changed_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_channel_members_telegram_id", "channel_members", ["telegram_id"])
+    op.create_index("ix_channel_members_updated_at", "channel_members", ["updated_at"])
+    op.create_table(
+        "job_checkpoints",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("position", sa.DateTime(), nullable=False),
+        sa.Column("batch_id", sa.String(), nullable=True),
+        sa.Column("ran_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("job_checkpoints")
+    op.drop_index("ix_channel_members_updated_at", table_name="channel_members")
+    op.drop_index("ix_channel_members_telegram_id", table_name="channel_members")
+    op.drop_table("channel_members")
+    op.drop_index("ix_users_updated_at", table_name="users")
+    # a plain DROP COLUMN (SQLite >= 3.35): batch mode would rebuild users without its expression indexes
+    op.drop_column("users", "updated_at")
@@ -0,0 +1,98 @@
+"""state shared by the API workers: change log (with its triggers), rate limits, delivery job progress
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+SQLITE_UPGRADE = [
+    "CREATE TRIGGER users_change_log_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', new.id, new.telegram_id); END",
+    "CREATE TRIGGER users_change_log_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', new.id, new.telegram_id); "
+    "INSERT INTO change_log (topic, row_id, telegram_id) "
+    "SELECT 'user', old.id, old.telegram_id WHERE old.telegram_id IS NOT new.telegram_id; END",
+    "CREATE TRIGGER users_change_log_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', old.id, old.telegram_id); END",
+    "CREATE TRIGGER contents_change_log_ai AFTER INSERT ON contents BEGIN "
+    "INSERT INTO change_log (topic, row_id) VALUES ('content', new.id); END",
+    "CREATE TRIGGER contents_change_log_au AFTER UPDATE ON contents BEGIN "
+    "INSERT INTO change_log (topic, row_id) VALUES ('content', new.id); END",
+    "CREATE TRIGGER contents_change_log_ad AFTER DELETE ON contents BEGIN "
+    "INSERT INTO change_log (topic, row_id) VALUES ('content', old.id); END",
+]
+
+POSTGRES_UPGRADE = [
+    "CREATE FUNCTION change_log_users() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "PERFORM pg_advisory_xact_lock(hashtext('change_log')); "
+    "IF TG_OP = 'DELETE' THEN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', OLD.id, OLD.telegram_id); RETURN NULL; END IF; "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', NEW.id, NEW.telegram_id); "
+    "IF TG_OP = 'UPDATE' THEN IF OLD.telegram_id IS DISTINCT FROM NEW.telegram_id THEN "
+    "INSERT INTO change_log (topic, row_id, telegram_id) VALUES ('user', OLD.id, OLD.telegram_id); END IF; END IF; "
+    "RETURN NULL; END $$",
+    "CREATE FUNCTION change_log_contents() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "PERFORM pg_advisory_xact_lock(hashtext('change_log')); "
+    "IF TG_OP = 'DELETE' THEN INSERT INTO change_log (topic, row_id) VALUES ('content', OLD.id); "
+    "ELSE INSERT INTO change_log (topic, row_id) VALUES ('content', NEW.id); END IF; "
+    "RETURN NULL; END $$",
+    # deferred: the log rows, and the lock keeping their ids in commit order, come at COMMIT
+    "CREATE CONSTRAINT TRIGGER users_change_log AFTER INSERT OR UPDATE OR DELETE ON users "
+    "DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION change_log_users()",
+    "CREATE CONSTRAINT TRIGGER contents_change_log AFTER INSERT OR UPDATE OR DELETE ON contents "
+    "DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION change_log_contents()",
+]
+
+
+def upgrade():
+    op.create_table(
+        "change_log",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("topic", sa.String(), nullable=False),
+        sa.Column("row_id", sa.Integer(), nullable=False),
+        sa.Column("telegram_id", sa.BigInteger(), nullable=True),
+        sqlite_autoincrement=True,
+    )
+    op.create_table(
+        "rate_limits",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("tat", sa.Float(), nullable=False),
+    )
+    op.create_table(
+        "delivery_jobs",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("sent", sa.Integer(), nullable=False),
+        sa.Column("failed", sa.Integer(), nullable=False),
+        sa.Column("errors", sa.Text(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_delivery_jobs_updated_at", "delivery_jobs", ["updated_at"])
+    dialect = op.get_bind().dialect.name
+    for sql in SQLITE_UPGRADE if dialect == "sqlite" else POSTGRES_UPGRADE if dialect == "postgresql" else []:
+        op.execute(sql)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        for table in ("users", "contents"):
+            for op_name in ("ai", "au", "ad"):
+                op.execute(f"DROP TRIGGER IF EXISTS {table}_change_log_{op_name}")
+    elif dialect == "postgresql":
+        op.execute("DROP TRIGGER IF EXISTS users_change_log ON users")
+        op.execute("DROP TRIGGER IF EXISTS contents_change_log ON contents")
+        op.execute("DROP FUNCTION IF EXISTS change_log_users()")
+        op.execute("DROP FUNCTION IF EXISTS change_log_contents()")
+    op.drop_index("ix_delivery_jobs_updated_at", table_name="delivery_jobs")
+    op.drop_table("delivery_jobs")
+    op.drop_table("rate_limits")
+    op.drop_table("change_log")
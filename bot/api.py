@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class BackendClient:
+    """The bot's connection to the backend API: one pooled httpx client for the bot's
+    lifetime (optionally over a Unix domain socket) and a short-TTL cache of
+    GET /api/users/{telegram_id}.
+
+    Cached users are dropped when the backend reports a change to them on its
+    /api/users/changes long poll (see watch()), and when the bot itself writes them;
+    the TTL bounds staleness if the feed is unreachable.
+    """
+
+    def __init__(self, base_url: str, uds: Optional[str] = None, user_ttl: float = 30,
+                 cache_size: int = 10000, timeout: float = 10.0):
+        self.base_url = base_url
+        self.uds = uds
+        self.user_ttl = user_ttl
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._users: "OrderedDict[int, tuple]" = OrderedDict()  # telegram_id -> (expires, user or None)
+        self._fetching = {}  # telegram_id -> token of the latest in-flight fetch
+        self._watcher: Optional[asyncio.Task] = None
+        self.hits = self.misses = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            transport = httpx.AsyncHTTPTransport(uds=self.uds) if self.uds else None
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, transport=transport, timeout=self.timeout,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def health(self) -> dict:
+        r = await self.client.get("/api/health")
+        r.raise_for_status()
+        return r.json()
+
+    async def get_user(self, telegram_id: int) -> Optional[dict]:
+        """The user registered with this telegram_id, or None (cached either way)."""
+        entry = self._users.get(telegram_id)
+        if entry is not None and time.monotonic() < entry[0]:
+            self._users.move_to_end(telegram_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        token = self._fetching[telegram_id] = object()
+        try:
+            r = await self.client.get(f"/api/users/{telegram_id}")
+            if r.status_code == 404:
+                user = None
+            else:
+                r.raise_for_status()
+                user = r.json()
+        finally:
+            # not stored if the user changed meanwhile (invalidate() dropped the token):
+            # the response may predate the change
+            current = self._fetching.get(telegram_id) is token
+            if current:
+                del self._fetching[telegram_id]
+        if current:
+            self._users[telegram_id] = (time.monotonic() + self.user_ttl, user)
+            self._users.move_to_end(telegram_id)
+            while len(self._users) > self.cache_size:
+                self._users.popitem(last=False)
+        return user
+
+    async def register_user(self, payload: dict) -> dict:
+        r = await self.client.post("/api/users/register_user", json=payload)
+        r.raise_for_status()
+        self.invalidate([payload["telegram_id"]])
+        return r.json()
+
+    async def invite_links(self, level: int) -> list:
+        r = await self.client.get("/api/users/invite_links", params={"level": level})
+        r.raise_for_status()
+        return r.json()["links"]
+
+    async def record_memberships(self, updates: list) -> None:
+        r = await self.client.post("/api/memberships", json={"updates": updates})
+        r.raise_for_status()
+
+    def invalidate(self, telegram_ids=None) -> None:
+        """Drop the given users from the cache, or every user."""
+        if telegram_ids is None:
+            self._users.clear()
+            self._fetching.clear()
+        else:
+            for telegram_id in telegram_ids:
+                self._users.pop(telegram_id, None)
+                self._fetching.pop(telegram_id, None)
+
+    def start(self) -> None:
+        """Follow the backend's change feed in the background."""
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self.watch())
+
+    async def watch(self) -> None:
+        seq, delay = 0, 1.0
+        while True:
+            try:
+                r = await self.client.get(
+                    "/api/users/changes", params={"after": seq, "timeout": 25},
+                    timeout=self.timeout + 25,
+                )
+                r.raise_for_status()
+                data = r.json()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # changes may be missed while the backend is unreachable: start over from scratch
+                logger.warning("User change feed unavailable: %s", e)
+                self.invalidate()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            delay = 1.0
+            if data["reset"]:
+                self.invalidate()
+            elif data["telegram_ids"]:
+                self.invalidate(data["telegram_ids"])
+            seq = data["seq"]
@@ -1,28 +1,69 @@
 import asyncio
+import logging
 import os
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message
-from dotenv import load_dotenv
+from aiogram.types import ChatMemberUpdated, Message
 import httpx
 
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"), override=True)
+# bot/.env is loaded by backend.app.config, imported first
+from backend.app.config import LEVEL_CHANNELS  # the same channels the backend posts to
+from backend.app.services.supervisor import Supervisor
+from bot.api import BackendClient
+from bot.polling import Poller
+from bot.webhook import ChatSequencer, WebhookServer
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
+# optional Unix socket of the backend (uvicorn --uds) when both run on the same host;
+# API_BASE_URL then only provides the Host header
+API_UDS = os.getenv("API_UDS") or None
+# seconds a GET /api/users/{telegram_id} result is reused (changes made in the backend drop it sooner)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+
+# Bot API endpoint; point it to scripts/fake_telegram.py for tests/benchmarks
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+
+# "polling" (getUpdates) or "webhook" (Telegram POSTs updates to WEBHOOK_URL + WEBHOOK_PATH)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# public base URL registered with setWebhook at startup; leave empty if the webhook is set elsewhere
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/bot/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# handlers running at once, in both modes (across chats; a chat's updates are always handled one at a time)
+BOT_CONCURRENCY = int(os.getenv("BOT_CONCURRENCY", "32"))
+# updates accepted but not handled yet; beyond this the webhook answers 503 and Telegram retries,
+# and polling waits before the next getUpdates
+BOT_MAX_PENDING = int(os.getenv("BOT_MAX_PENDING", "1000"))
+# seconds the handlers get to finish on SIGTERM/SIGINT; updates not handled by then are delivered again
+BOT_SHUTDOWN_TIMEOUT = float(os.getenv("BOT_SHUTDOWN_TIMEOUT", "20"))
 
 if not TELEGRAM_BOT_TOKEN:
     raise RuntimeError("TELEGRAM_BOT_TOKEN is not set. Create bot/.env from bot/.env.example")
 
-LEVEL_CHANNELS = {
-    1: os.getenv("CHANID_LIV1"),
-    2: os.getenv("CHANID_LIV2"),
-    3: os.getenv("CHANID_LIV3"),
-    4: os.getenv("CHANID_LIV4"),
-}
+logger = logging.getLogger(__name__)
 
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+bot = Bot(token=TELEGRAM_BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)))
 dp = Dispatcher()
+api = BackendClient(API_BASE_URL, uds=API_UDS, user_ttl=USER_CACHE_TTL)
+
+async def invite_lines_for(level: int) -> list:
+    # Links come from the backend's shared invite link cache instead of a new link per request
+    links = await api.invite_links(level)
+    lines = []
+    for item in links:
+        l = item["level"]
+        if item["invite_link"]:
+            lines.append(f"Livello {l}: {item['invite_link']}")
+        elif not LEVEL_CHANNELS.get(l):
+            lines.append(f"Livello {l}: Canale non configurato")
+        else:
+            lines.append(f"Livello {l}: Errore nel generare link - {item['error']}")
+    return lines
 
 @dp.message(CommandStart())
 async def start(message: Message):
@@ -30,12 +71,8 @@ async def start(message: Message):
 
 @dp.message(Command("health"))
 async def health(message: Message):
-    url = f"{API_BASE_URL}/api/health"
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            data = r.json()
+        data = await api.health()
         await message.answer(f"Backend status: {data}")
     except Exception as e:
         await message.answer(f"Errore nel chiamare il backend: {e}")
@@ -56,25 +93,11 @@ async def register(message: Message):
         "last_name": message.from_user.last_name,
         "level": level,
     }
-    url = f"{API_BASE_URL}/api/users/register_user"
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.post(url, json=payload)
-            r.raise_for_status()
-            data = r.json()
+        data = await api.register_user(payload)
         status = data.get("status")
         response_text = f"Registrazione completata con successo! Il tuo stato è: {status}."
-        invite_lines = []
-        for l in range(1, level + 1):
-            ch_id = LEVEL_CHANNELS.get(l)
-            if ch_id:
-                try:
-                    inv_link = await bot.create_chat_invite_link(ch_id)
-                    invite_lines.append(f"Livello {l}: {inv_link.invite_link}")
-                except Exception as e:
-                    invite_lines.append(f"Livello {l}: Errore nel generare link - {str(e)}")
-            else:
-                invite_lines.append(f"Livello {l}: Canale non configurato")
+        invite_lines = await invite_lines_for(level)
         if invite_lines:
             response_text += "\nLink per unirti ai canali:\n" + "\n".join(invite_lines)
         else:
@@ -95,44 +118,62 @@ async def channels(message: Message):
 @dp.message(Command("my_level"))
 async def my_level(message: Message):
     telegram_id = message.from_user.id
-    url = f"{API_BASE_URL}/api/users/{telegram_id}"
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            data = r.json()
+        data = await api.get_user(telegram_id)
+        if data is None:
+            await message.answer("Utente non trovato. Usa /register per registrarti.")
+            return
         level = data.get("level", 0)
         status = data.get("status", "unknown")
         if status != "active":
             await message.answer("Il tuo account non è attivo.")
             return
         response_text = f"Il tuo livello attuale è {level}."
-        invite_lines = []
-        for l in range(1, level + 1):
-            ch_id = LEVEL_CHANNELS.get(l)
-            if ch_id:
-                try:
-                    inv_link = await bot.create_chat_invite_link(ch_id)
-                    invite_lines.append(f"Livello {l}: {inv_link.invite_link}")
-                except Exception as e:
-                    invite_lines.append(f"Livello {l}: Errore nel generare link - {str(e)}")
-            else:
-                invite_lines.append(f"Livello {l}: Canale non configurato")
+        invite_lines = await invite_lines_for(level)
         if invite_lines:
             response_text += "\nLink per unirti ai canali:\n" + "\n".join(invite_lines)
         else:
             response_text += "\nNessun canale disponibile."
         await message.answer(response_text)
     except httpx.HTTPStatusError as e:
-        if e.response.status_code == 404:
-            await message.answer("Utente non trovato. Usa /register per registrarti.")
-        else:
-            await message.answer(f"Errore durante la richiesta: {e.response.text}")
+        await message.answer(f"Errore durante la richiesta: {e.response.text}")
     except Exception as e:
         await message.answer(f"Errore: {e}")
 
+@dp.chat_member()
+async def channel_member_changed(event: ChatMemberUpdated):
+    # joins/leaves of the level channels (the bot must be an admin there to receive them):
+    # the backend checks the members against the users' levels and kicks the extra ones
+    if str(event.chat.id) not in {str(ch) for ch in LEVEL_CHANNELS.values() if ch}:
+        return
+    status = event.new_chat_member.status
+    try:
+        await api.record_memberships([{
+            "channel_id": str(event.chat.id),
+            "telegram_id": event.new_chat_member.user.id,
+            "status": getattr(status, "value", status),
+            "date": event.date.isoformat(),
+        }])
+    except Exception as e:
+        logger.warning("Membership update for %s in %s not recorded: %s", event.new_chat_member.user.id, event.chat.id, e)
+
 async def main():
-    await dp.start_polling(bot)
+    sequencer = ChatSequencer(BOT_CONCURRENCY, BOT_MAX_PENDING)
+    if BOT_MODE == "webhook":
+        updates = WebhookServer(dp, bot, sequencer, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+                                url=WEBHOOK_URL, max_connections=min(100, BOT_CONCURRENCY))
+    else:
+        updates = Poller(dp, bot, sequencer)
+    supervisor = Supervisor(BOT_SHUTDOWN_TIMEOUT)
+    supervisor.add("telegram session", stop=bot.session.close)
+    supervisor.add("backend client", start=api.start, stop=api.close)
+    supervisor.add("updates", start=updates.start, drain=updates.drain, stop=updates.stop)
+    try:
+        await supervisor.start()
+        await supervisor.wait_for_signal()
+    finally:
+        await supervisor.shutdown()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     asyncio.run(main())
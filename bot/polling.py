@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+
+from bot.webhook import ChatSequencer, chat_key
+
+logger = logging.getLogger(__name__)
+
+
+class Poller:
+    """Long polling (getUpdates) feeding the same ChatSequencer as the webhook: a chat's
+    updates are handled in order, at most `sequencer.max_pending` at a time.
+
+    Telegram forgets the updates before the offset of the next getUpdates, so the offset
+    asked for never goes past the first update not handled yet: the updates after it come
+    back with every getUpdates and those already running or handled are skipped. On drain
+    the poller stops asking for more, waits for the handlers with the given deadline and
+    only then confirms what was handled: a restarted bot neither replays the updates it
+    answered nor misses the ones it got but didn't handle (those are delivered again).
+
+    Telegram returns at most 100 updates from the offset, so while the first unhandled
+    update runs, at most 100 updates past it are taken in.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, sequencer: ChatSequencer, timeout: int = 30):
+        self.dp = dp
+        self.bot = bot
+        self.sequencer = sequencer
+        self.timeout = timeout
+        self.offset: Optional[int] = None  # past the last update_id received
+        self._unfinished: Set[int] = set()  # update_ids received and not handled yet
+        self._handled: Set[int] = set()  # update_ids handled but not confirmed yet
+        self._progress = asyncio.Event()  # set when an update is handled
+        self._allowed = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await self.bot.delete_webhook()  # getUpdates is refused while a webhook is set
+        self._allowed = self.dp.resolve_used_update_types()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        backoff = 1
+        while True:
+            while self.sequencer.full():
+                await asyncio.sleep(0.05)
+            offset = self._confirmable()
+            self._progress.clear()
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=self.timeout,
+                                                     allowed_updates=self._allowed)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("getUpdates failed: %s; retrying in %ds", e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = 1
+            new = [u for u in updates if u.update_id not in self._unfinished and u.update_id not in self._handled]
+            for update in new:
+                self.offset = max(self.offset or 0, update.update_id + 1)
+                self._unfinished.add(update.update_id)
+                task = self.sequencer.submit(chat_key(update), lambda update=update: self.dp.feed_update(self.bot, update))
+                task.add_done_callback(lambda _, update_id=update.update_id: self._done(update_id))
+            if updates and not new:
+                # only updates already taken in: ask again once one of them is handled
+                await self._progress.wait()
+
+    def _done(self, update_id: int) -> None:
+        self._unfinished.discard(update_id)
+        self._handled.add(update_id)
+        self._progress.set()
+
+    def _confirmable(self) -> Optional[int]:
+        """The offset confirming every update before the first one not handled yet."""
+        offset = min(self._unfinished, default=self.offset)
+        if offset is not None:
+            self._handled = {u for u in self._handled if u >= offset}
+        return offset
+
+    async def drain(self, timeout: float) -> None:
+        if self._task is not None:
+            # updates of a getUpdates cut short weren't confirmed: Telegram keeps them
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if not await self.sequencer.close(timeout):
+            logger.warning("%d updates not handled before the shutdown deadline: Telegram will deliver them again",
+                           len(self._unfinished))
+        # confirm up to the first update not handled; a later one already handled is handled twice
+        offset = self._confirmable()
+        if offset is not None:
+            try:
+                await self.bot.get_updates(offset=offset, timeout=0, limit=1, allowed_updates=self._allowed)
+            except Exception as e:
+                logger.warning("Handled updates not confirmed to Telegram (they will be delivered again): %s", e)
+
+    async def stop(self) -> None:
+        await self.sequencer.cancel()
@@ -0,0 +1,153 @@
+import asyncio
+import hmac
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Telegram echoes the secret_token given to setWebhook in this header
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def chat_key(update: Update) -> int:
+    """The chat an update belongs to (falling back to its sender), used to keep its updates in order."""
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
+
+
+class ChatSequencer:
+    """Runs jobs concurrently across keys (at most `concurrency` at a time) and one after
+    the other, in submission order, within the same key.
+
+    Each job waits for the previous job of its key before taking a slot, so a busy chat
+    never holds more than one slot and can't starve the others.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int):
+        self.max_pending = max_pending
+        self._sem = asyncio.Semaphore(concurrency)
+        self._tails: Dict[int, asyncio.Task] = {}  # last job submitted per key
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def full(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def submit(self, key: int, job: Callable[[], Awaitable]) -> asyncio.Task:
+        task = asyncio.create_task(self._run(key, self._tails.get(key), job))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, key: int, previous: Optional[asyncio.Task], job: Callable[[], Awaitable]) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with self._sem:
+                await job()
+        except Exception:
+            logger.exception("Update handling failed (chat %s)", key)
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    async def close(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the jobs already accepted, at most `timeout` seconds; False if some are left."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self._tasks:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            # asyncio.wait, unlike gather, doesn't cancel the jobs when the wait is cut short
+            await asyncio.wait(list(self._tasks), timeout=remaining)
+        return True
+
+    async def cancel(self) -> None:
+        """Cancel the jobs still waiting or running (after close() ran out of time)."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def webhook_app(dp: Dispatcher, bot: Bot, path: str, secret: str, sequencer: ChatSequencer) -> web.Application:
+    """aiohttp app receiving Telegram updates on `path`.
+
+    Updates are acknowledged as soon as they are queued, so Telegram doesn't wait for the
+    handlers; beyond `sequencer.max_pending` queued updates the webhook answers 503 and
+    Telegram redelivers the update later.
+    """
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        if sequencer.full():
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception:
+            return web.Response(status=400)
+        sequencer.submit(chat_key(update), lambda: dp.feed_update(bot, update))
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+class WebhookServer:
+    """Serves webhook_app and, if `url` is given, registers it with setWebhook.
+
+    On drain the server stops first: updates POSTed from then on fail and Telegram
+    delivers them again (to another replica behind the same URL, or to this one once
+    restarted); those already acknowledged are handled within the deadline.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, sequencer: ChatSequencer, path: str, secret: str,
+                 host: str, port: int, url: str = "", max_connections: int = 40):
+        self.dp = dp
+        self.bot = bot
+        self.sequencer = sequencer
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.url = url
+        self.max_connections = max_connections
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        if self.url:
+            # every replica registers the same URL; the load balancer in front spreads the updates
+            await self.bot.set_webhook(
+                self.url + self.path,
+                secret_token=self.secret or None,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=self.max_connections,
+            )
+        self._runner = web.AppRunner(webhook_app(self.dp, self.bot, self.path, self.secret, self.sequencer))
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def drain(self, timeout: float) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if not await self.sequencer.close(timeout):
+            logger.warning("%d acknowledged updates not handled before the shutdown deadline", self.sequencer.pending)
+
+    async def stop(self) -> None:
+        await self.sequencer.cancel()
@@ -1,41 +1,89 @@
-import React, { useState, useEffect } from 'react';
-import { getUsers, approveUser, changeUserLevel, deleteUser, updateUser } from '../services/api';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
+import { getUsers, getUserStats, approveUser, changeUserLevel, deleteUser, updateUser, subscribeEvents } from '../services/api';
+
+// same matching as the server's ?q= (prefix of name/email/phone, or the exact telegram_id)
+const matchesSearch = (user, term) => {
+    const q = term.trim().toLowerCase();
+    if (!q) return true;
+    return String(user.telegram_id) === q ||
+        [user.first_name, user.last_name, user.email, user.phone].some(v => (v || '').toLowerCase().startsWith(q));
+};
 
 const Users = () => {
     const [users, setUsers] = useState([]);
     const [loading, setLoading] = useState(true);
     const [searchTerm, setSearchTerm] = useState('');
     const [editingUser, setEditingUser] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [stats, setStats] = useState(null);
 
-    useEffect(() => {
-        fetchUsers();
-    }, []);
-
-    const fetchUsers = async () => {
+    // first page for the current search; the server searches and pages, we only append
+    const fetchUsers = useCallback(async () => {
         setLoading(true);
         try {
-            const allUsers = await getUsers();
-            const pendingUsers = await getUsers('pending');
-            if (Array.isArray(allUsers) && Array.isArray(pendingUsers)) {
-                const usersWithStatus = allUsers.map(u => ({
-                    ...u,
-                    status: pendingUsers.some(p => p.id === u.id) ? 'pending' : 'active'
-                }));
-                setUsers(usersWithStatus);
-            } else {
-                setUsers([]);
-            }
+            const page = await getUsers({ q: searchTerm.trim() });
+            setUsers(Array.isArray(page.users) ? page.users : []);
+            setNextCursor(page.nextCursor);
+            setStats(await getUserStats());
         } catch (error) {
             console.error("Error fetching users:", error);
             setUsers([]);
         }
         setLoading(false);
+    }, [searchTerm]);
+
+    useEffect(() => {
+        const timer = setTimeout(fetchUsers, 300);
+        return () => clearTimeout(timer);
+    }, [fetchUsers]);
+
+    // live updates: patch the loaded rows from the server's change events instead of reloading
+    const searchRef = useRef(searchTerm);
+    searchRef.current = searchTerm;
+    const fetchRef = useRef(fetchUsers);
+    fetchRef.current = fetchUsers;
+    useEffect(() => {
+        let statsTimer;
+        const statsChanged = () => {
+            clearTimeout(statsTimer);
+            statsTimer = setTimeout(async () => setStats(await getUserStats()), 500);
+        };
+        const source = subscribeEvents({
+            user: (user) => {
+                setUsers(prev => {
+                    const rest = prev.filter(u => u.id !== user.id);
+                    if (!matchesSearch(user, searchRef.current)) return rest;
+                    return rest.length === prev.length ? [user, ...prev] : prev.map(u => (u.id === user.id ? user : u));
+                });
+                statsChanged();
+            },
+            user_deleted: ({ id }) => {
+                setUsers(prev => prev.filter(u => u.id !== id));
+                statsChanged();
+            },
+            // many users changed (import) or events were missed: reload once
+            users_changed: () => fetchRef.current(),
+            reset: () => fetchRef.current(),
+        });
+        return () => {
+            clearTimeout(statsTimer);
+            source.close();
+        };
+    }, []);
+
+    const loadMore = async () => {
+        try {
+            const page = await getUsers({ q: searchTerm.trim(), after: nextCursor });
+            setUsers(prev => [...prev, ...page.users]);
+            setNextCursor(page.nextCursor);
+        } catch (error) {
+            console.error("Error fetching users:", error);
+        }
     };
 
     const handleApprove = async (userId) => {
         try {
             await approveUser(userId, true);
-            fetchUsers();
         } catch (error) {
             console.error("Error approving user:", error);
         }
@@ -44,7 +92,6 @@ const Users = () => {
     const handleLevelChange = async (userId, level) => {
         try {
             await changeUserLevel(userId, level);
-            fetchUsers();
         } catch (error) {
             console.error("Error changing user level:", error);
         }
@@ -54,7 +101,6 @@ const Users = () => {
         if (window.confirm('Are you sure you want to delete this user?')) {
             try {
                 await deleteUser(userId);
-                fetchUsers();
             } catch (error) {
                 console.error("Error deleting user:", error);
             }
@@ -65,27 +111,27 @@ const Users = () => {
         try {
             await updateUser(user.id, user);
             setEditingUser(null);
-            fetchUsers();
         } catch (error) {
             console.error("Error updating user:", error);
         }
     };
 
-    const filteredUsers = users.filter(user =>
-        (user.first_name && user.first_name.toLowerCase().includes(searchTerm.toLowerCase())) ||
-        (user.last_name && user.last_name.toLowerCase().includes(searchTerm.toLowerCase())) ||
-        user.telegram_id.toString().includes(searchTerm)
-    );
-
-    if (loading) {
-        return <div className="text-center py-8">Loading users...</div>;
-    }
-
     return (
         <div>
+            {stats && (
+                <div className="flex flex-wrap gap-4 mb-4 text-sm text-gray-600">
+                    <span>Total: {stats.total}</span>
+                    {Object.entries(stats.by_level).map(([level, count]) => (
+                        <span key={level}>Level {level}: {count}</span>
+                    ))}
+                    {Object.entries(stats.by_status).map(([status, count]) => (
+                        <span key={status}>{status}: {count}</span>
+                    ))}
+                </div>
+            )}
             <input
                 type="text"
-                placeholder="Search by name or Telegram ID"
+                placeholder="Search by name, email, phone or Telegram ID"
                 value={searchTerm}
                 onChange={(e) => setSearchTerm(e.target.value)}
                 className="w-full p-3 mb-4 border border-gray-300 rounded focus:outline-none focus:ring-2 focus:ring-blue-500"
@@ -108,7 +154,7 @@ const Users = () => {
                         </tr>
                     </thead>
                     <tbody>
-                        {filteredUsers.map(user => (
+                        {users.map(user => (
                             <tr key={user.id} className="hover:bg-gray-50">
                                 <td className="border border-gray-300 p-2">{user.id}</td>
                                 <td className="border border-gray-300 p-2">{user.telegram_id}</td>
@@ -240,6 +286,15 @@ const Users = () => {
                     </tbody>
                 </table>
             </div>
+            {loading && <div className="text-center py-8">Loading users...</div>}
+            {!loading && nextCursor && (
+                <button
+                    onClick={loadMore}
+                    className="mt-4 px-4 py-2 border border-gray-300 rounded hover:bg-gray-100"
+                >
+                    Load more
+                </button>
+            )}
         </div>
     );
 };
@@ -6,12 +6,30 @@ export const getHealth = async () => {
     return response.json();
 };
 
-export const getUsers = async (status = '') => {
-    let url = `${API_BASE_URL}/users`;
-    if (status) {
-        url += `?status=${status}`;
-    }
-    const response = await fetch(url);
+// One page of users; pass the returned nextCursor as `after` to get the following page.
+export const getUsers = async ({ status, level, q, after, limit = 100 } = {}) => {
+    const params = new URLSearchParams({ limit });
+    if (status) params.set('status', status);
+    if (level) params.set('level', level);
+    if (q) params.set('q', q);
+    if (after) params.set('after', after);
+    const response = await fetch(`${API_BASE_URL}/users?${params}`);
+    return { users: await response.json(), nextCursor: response.headers.get('X-Next-Cursor') };
+};
+
+// Server-sent user/content changes (GET /api/events). handlers: { user, user_deleted,
+// users_changed, content, reset } called with the parsed event data; EventSource reconnects
+// by itself and resumes after the last event received. Call .close() to unsubscribe.
+export const subscribeEvents = (handlers) => {
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    Object.entries(handlers).forEach(([event, handler]) => {
+        source.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+    });
+    return source;
+};
+
+export const getUserStats = async () => {
+    const response = await fetch(`${API_BASE_URL}/users/stats`);
     return response.json();
 };
 
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Replay benchmark for the bot: feeds the same stream of updates through
+long polling (bot/polling.py, getUpdates answered by the fake Telegram
+server) and through the webhook (POSTed to bot/webhook.py's app),
+with the backend running in a uvicorn subprocess on a temp SQLite file.
+
+Updates come from --updates (a JSON-lines file of recorded Telegram updates)
+or are generated: --chats users sending /start, then /register,
+/my_level, /channels and /health, one round of all chats per command. For every update
+the time until the bot's reply reaches the fake server is measured, and
+each chat's replies are checked against the order of its commands (a
+/my_level handled before its /register answers "Utente non trovato").
+
+Usage:
+    python scripts/bench_bot.py --chats 100 --rate 15
+    python scripts/bench_bot.py --updates recorded.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+from collections import defaultdict
+
+from bench_env import ROOT, make_workdir, sqlite_url, start_fake_telegram
+
+
+COMMANDS = ["/start", "/register", "/my_level", "/channels", "/health"]
+# first words of the reply each command gets when handled in order
+EXPECTED = {
+    "/start": "Benvenuto",
+    "/register": "Registrazione completata",
+    "/my_level": "Il tuo livello",
+    "/channels": "Canali configurati",
+    "/health": "Backend status",
+}
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def generate(n_chats, chat_offset):
+    updates, update_id = [], chat_offset
+    for command in COMMANDS:
+        for chat in range(chat_offset, chat_offset + n_chats):
+            update_id += 1
+            updates.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id, "date": int(time.time()), "text": command,
+                    "chat": {"id": chat, "type": "private"},
+                    "from": {"id": chat, "is_bot": False, "first_name": f"User{chat}"},
+                    "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+                },
+            })
+    return updates
+
+
+def report(mode, fake, updates, sent_at, calls0):
+    replies = defaultdict(list)
+    for t, method, payload in fake.calls[calls0:]:
+        if method == "sendMessage":
+            replies[payload["chat_id"]].append((t, payload["text"]))
+    latencies, out_of_order, missing = [], 0, 0
+    by_chat = defaultdict(list)
+    for u in updates:
+        by_chat[u["message"]["chat"]["id"]].append(u)
+    for chat, chat_updates in by_chat.items():
+        got = replies.get(chat, [])
+        missing += max(0, len(chat_updates) - len(got))
+        for u, (t, text) in zip(chat_updates, got):
+            latencies.append((t - sent_at[u["update_id"]]) * 1000)
+            expected = EXPECTED.get(u["message"]["text"].split()[0])
+            if expected and not text.startswith(expected):
+                out_of_order += 1
+    span = max(t for chat in by_chat for t, _ in replies.get(chat, [])) - min(sent_at.values())
+    print(f"{mode:>8}: {len(latencies)} replies in {span:.2f}s  p50={pct(latencies, .5):7.1f}ms "
+          f"p95={pct(latencies, .95):7.1f}ms p99={pct(latencies, .99):7.1f}ms  "
+          f"out of order={out_of_order} missing={missing}")
+
+
+async def replay(updates, rate, send):
+    # latency counts from the scheduled send time, so a slow bot can't slow down the replay itself
+    sent_at, tasks = {}, []
+    t0 = time.monotonic()
+    for i, u in enumerate(updates):
+        sent_at[u["update_id"]] = t0 + i / rate
+        delay = sent_at[u["update_id"]] - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(u)))
+    await asyncio.gather(*tasks)
+    return sent_at
+
+
+async def wait_replies(fake, calls0, n, timeout=120):
+    deadline = time.monotonic() + timeout
+    while sum(1 for _, m, _ in fake.calls[calls0:] if m == "sendMessage") < n:
+        if time.monotonic() > deadline:
+            break
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)  # let stragglers (e.g. duplicates) arrive
+
+
+async def start_backend(workdir):
+    import httpx
+
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL=sqlite_url(workdir))
+    migrate = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "alembic", "-c", os.path.join(ROOT, "alembic.ini"), "upgrade", "head",
+        env=env, cwd=workdir, stderr=asyncio.subprocess.DEVNULL,
+    )
+    assert await migrate.wait() == 0, "alembic upgrade head failed"
+    server = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "--factory", "backend.app.main:create_app", "--port", str(port),
+        "--log-level", "warning", env=env, cwd=workdir,
+    )
+    url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"{url}/api/health")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    return server, url
+
+
+async def run(args):
+    # no flood limits here: this measures the bot, not Telegram's rate limiting
+    fake = await start_fake_telegram(latency=args.telegram_latency, global_rate=1e9, per_chat_rate=1e9)
+    server, backend_url = await start_backend(make_workdir())
+    try:
+        await replay_both(args, fake, backend_url)
+    finally:
+        server.terminate()
+        await server.wait()
+        await fake.stop()
+
+
+async def replay_both(args, fake, backend_url):
+    import aiohttp
+    from aiohttp import web
+    from bot import main as bot_main
+    from bot.api import BackendClient
+    from bot.polling import Poller
+    from bot.webhook import SECRET_HEADER, ChatSequencer, webhook_app
+    bot_main.api = BackendClient(backend_url)  # bot/.env's API_BASE_URL overrides the environment
+    bot_main.api.start()
+
+    def load(offset):
+        if args.updates:
+            with open(args.updates) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        return generate(args.chats, offset)
+
+    # long polling
+    updates = load(1_000_000)
+    calls0 = len(fake.calls)
+    poller = Poller(bot_main.dp, bot_main.bot, ChatSequencer(args.concurrency, args.max_pending))
+    await poller.start()
+
+    async def enqueue(u):
+        fake.updates.put_nowait(u)
+
+    sent_at = await replay(updates, args.rate, enqueue)
+    await wait_replies(fake, calls0, len(updates))
+    await poller.drain(30)
+    report("polling", fake, updates, sent_at, calls0)
+
+    # webhook
+    updates = load(2_000_000)
+    calls0 = len(fake.calls)
+    sequencer = ChatSequencer(args.concurrency, args.max_pending)
+    runner = web.AppRunner(webhook_app(bot_main.dp, bot_main.bot, "/bot/webhook", "s3cret", sequencer),
+                           access_log=None)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    async with aiohttp.ClientSession() as http:
+        url = f"http://127.0.0.1:{port}/bot/webhook"
+        async with http.post(url, json=updates[0], headers={SECRET_HEADER: "wrong"}) as r:
+            assert r.status == 401, r.status
+
+        async def post(u):
+            async with http.post(url, json=u, headers={SECRET_HEADER: "s3cret"}) as r:
+                assert r.status == 200, r.status
+
+        sent_at = await replay(updates, args.rate, post)
+    await wait_replies(fake, calls0, len(updates))
+    await runner.cleanup()
+    await sequencer.close()
+    report("webhook", fake, updates, sent_at, calls0)
+
+    await bot_main.api.close()
+    await bot_main.bot.session.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=100)
+    ap.add_argument("--updates", help="JSON-lines file of recorded updates to replay instead")
+    ap.add_argument("--rate", type=float, default=15, help="updates sent per second")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--max-pending", type=int, default=1000)
+    ap.add_argument("--telegram-latency", type=float, default=0.03)
+    args = ap.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
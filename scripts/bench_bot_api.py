@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the bot's calls to the backend (GET /api/users/{telegram_id},
+the lookup behind /my_level), with the backend in uvicorn subprocesses on a
+temp SQLite file, one listening on TCP and one on a Unix socket:
+  - a new httpx.AsyncClient per call, the way the bot handlers used to do it,
+  - bot/api.py's pooled client over TCP and over the Unix socket (cache off),
+  - the pooled client with its user cache warm,
+and prints p50/p99 latency, calls/s and the bot-side CPU time per call.
+Then it changes users' level through the API and measures how long the
+bot's cache takes to serve the new level (via GET /api/users/changes).
+
+Usage:
+    python scripts/bench_bot_api.py --calls 2000 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import time
+from datetime import datetime
+
+from bench_env import ROOT, start_fake_telegram, use_workdir
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed(n_users):
+    from sqlalchemy import insert, select
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"telegram_id": 1_000_000 + i, "first_name": f"user{i}", "level": 1,
+             "status": UserStatus.active, "registered_at": datetime(2024, 1, 1)}
+            for i in range(n_users)
+        ])
+        return conn.execute(select(User.id, User.telegram_id)).all()
+
+
+async def start_backend(workdir, *listen):
+    import httpx
+
+    server = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "backend.app.main:app", *listen, "--log-level", "warning",
+        env=dict(os.environ, PYTHONPATH=ROOT), cwd=workdir,
+    )
+    uds = listen[1] if listen[0] == "--uds" else None
+    url = "http://localhost" if uds else f"http://127.0.0.1:{listen[1]}"
+    async with httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(uds=uds) if uds else None) as client:
+        for _ in range(100):
+            try:
+                await client.get(f"{url}/api/health")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    return server
+
+
+async def measure(name, calls, concurrency, fn):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(arg):
+        async with sem:
+            t = time.perf_counter()
+            await fn(arg)
+            latencies.append((time.perf_counter() - t) * 1000)
+
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(one(arg) for arg in calls))
+    elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+    print(f"{name:>22}: p50={pct(latencies, .5):6.2f}ms p99={pct(latencies, .99):6.2f}ms "
+          f"{len(calls) / elapsed:7.0f} calls/s  cpu {cpu / len(calls) * 1000:.2f}ms/call")
+
+
+async def run(args, workdir):
+    import httpx
+    from bot.api import BackendClient
+
+    users = seed(args.users)
+    fake = await start_fake_telegram(global_rate=1e9, per_chat_rate=1e9)
+    port, uds = free_port(), os.path.join(workdir, "api.sock")
+    servers = [await start_backend(workdir, "--port", str(port)), await start_backend(workdir, "--uds", uds)]
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        calls = [random.choice(users).telegram_id for _ in range(args.calls)]
+
+        async def fresh_client(telegram_id):
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                r = await client.get(f"{base_url}/api/users/{telegram_id}")
+                r.raise_for_status()
+
+        await measure("new client per call", calls, args.concurrency, fresh_client)
+        for name, api in [("pooled, TCP", BackendClient(base_url, user_ttl=0)),
+                          ("pooled, Unix socket", BackendClient("http://localhost", uds=uds, user_ttl=0))]:
+            await api.get_user(calls[0])  # open the connection first
+            await measure(name, calls, args.concurrency, api.get_user)
+            await api.close()
+
+        api = BackendClient(base_url, user_ttl=30)
+        api.start()
+        for telegram_id in set(calls):
+            await api.get_user(telegram_id)
+        await measure("pooled, cached", calls, args.concurrency, api.get_user)
+
+        # invalidation: level changes made through the API reach the bot's cache
+        delays = []
+        async with httpx.AsyncClient(base_url=base_url) as admin:
+            for user_id, telegram_id in random.sample(users, min(50, len(users))):
+                assert (await api.get_user(telegram_id))["level"] == 1  # cached
+                r = await admin.post("/api/users/change_level", params={"user_id": user_id, "level": 2})
+                assert r.status_code == 200, r.text
+                t = time.perf_counter()
+                while (await api.get_user(telegram_id))["level"] != 2:
+                    await asyncio.sleep(0.0005)
+                delays.append((time.perf_counter() - t) * 1000)
+        print(f"{'change -> bot cache':>22}: p50={pct(delays, .5):6.2f}ms p99={pct(delays, .99):6.2f}ms "
+              f"(after the API answered; cache hits={api.hits} misses={api.misses})")
+        await api.close()
+    finally:
+        for server in servers:
+            server.terminate()
+            await server.wait()
+        await fake.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--calls", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    args = ap.parse_args()
+    workdir = use_workdir()
+    asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Bulk approve + level change benchmark against the fake Telegram server
+(real flood limits, --telegram-latency per call) on a temp SQLite file.
+
+Seeds N pending users at --from-level, then approves them and moves them to
+--to-level twice:
+  - one user per request, the way the admin panel used to do it
+    (POST /approve_user + POST /change_level for every user),
+  - with POST /bulk/approve + POST /bulk/change_level, polling
+    GET /jobs/{job_id} until the channel updates are done,
+and prints HTTP time, total time, Telegram calls/s and 429s for both.
+
+Usage:
+    python scripts/bench_bulk.py --users 300
+    python scripts/bench_bulk.py --users 300 --skip-single
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from bench_env import start_fake_telegram, use_workdir
+
+
+def seed(n_users, level, offset):
+    from sqlalchemy import insert, select
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"telegram_id": offset + i, "first_name": f"user{i}", "level": level,
+             "status": UserStatus.pending, "registered_at": datetime(2024, 1, 1)}
+            for i in range(n_users)
+        ])
+        return conn.execute(select(User.id).where(User.telegram_id >= offset,
+                                                  User.telegram_id < offset + n_users)).scalars().all()
+
+
+async def run(args):
+    fake = await start_fake_telegram(latency=args.telegram_latency)
+
+    import httpx
+    from backend.app.db.session import Base, engine
+    from backend.app.main import app
+
+    Base.metadata.create_all(bind=engine)
+    transport = httpx.ASGITransport(app=app)
+
+    def report(name, http_s, total_s, calls, rejected):
+        print(f"{name:>7}: http {http_s:7.2f}s  done {total_s:7.2f}s  telegram calls={calls} "
+              f"({calls / total_s:.1f}/s) 429s={rejected}")
+
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # warm the invite link cache so both runs only pay for the per-user calls
+        await client.get("/api/users/invite_links", params={"level": 4})
+
+        if not args.skip_single:
+            ids = seed(args.users, args.from_level, 1_000_000)
+            calls0, rejected0 = fake.count(), fake.rejected
+            t0 = time.perf_counter()
+            for uid in ids:
+                r = await client.post("/api/users/approve_user", json={"user_id": uid, "approve": True})
+                assert r.status_code == 200, r.text
+                r = await client.post(f"/api/users/change_level?user_id={uid}&level={args.to_level}")
+                assert r.status_code == 200, r.text
+            elapsed = time.perf_counter() - t0
+            report("single", elapsed, elapsed, fake.count() - calls0, fake.rejected - rejected0)
+
+        ids = seed(args.users, args.from_level, 2_000_000)
+        calls0, rejected0 = fake.count(), fake.rejected
+        t0 = time.perf_counter()
+        r = await client.post("/api/users/bulk/approve", json={"user_ids": ids})
+        assert r.status_code == 200 and r.json()["updated"] == len(ids), r.text
+        r = await client.post("/api/users/bulk/change_level", json={"user_ids": ids, "level": args.to_level})
+        assert r.status_code == 200, r.text
+        http_s = time.perf_counter() - t0
+        job = r.json()
+        while job["status"] in ("queued", "running"):
+            await asyncio.sleep(0.1)
+            job = (await client.get(f"/api/users/jobs/{job['job_id']}")).json()
+        report("bulk", http_s, time.perf_counter() - t0, fake.count() - calls0, fake.rejected - rejected0)
+        print(f"   job: {job['status']} total={job['total']} sent={job['sent']} failed={job['failed']} "
+              f"{job['errors'][:3]}")
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=300)
+    ap.add_argument("--from-level", type=int, default=3)
+    ap.add_argument("--to-level", type=int, default=2)
+    ap.add_argument("--telegram-latency", type=float, default=0.05)
+    ap.add_argument("--skip-single", action="store_true", help="only run the bulk endpoints")
+    args = ap.parse_args()
+    use_workdir()
+    asyncio.run(run(args))
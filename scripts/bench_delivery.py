@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Throughput/latency benchmark for the notification delivery engine against the
+local fake Telegram server (scripts/fake_telegram.py).
+
+Submits one job that notifies the 4 level channels plus N direct recipients and
+reports submit latency, delivered msgs/s, per-message latency and how many
+429s the fake server had to answer (should be 0 if the token buckets hold).
+
+Usage:
+    python scripts/bench_delivery.py --recipients 300
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from bench_env import start_fake_telegram, use_workdir
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(args):
+    from backend.app.services.delivery import DeliveryEngine
+    from backend.app.services.telegram import TelegramClient
+
+    fake = await start_fake_telegram(latency=args.latency)
+    client = TelegramClient(token="TEST", base_url=fake.url, global_rate=args.rate)
+    engine = DeliveryEngine(workers=args.workers, client=client)
+
+    chats = [-1001, -1002, -1003, -1004] + list(range(1, args.recipients + 1))
+    payloads = [{"chat_id": chat, "text": "benchmark"} for chat in chats]
+
+    t0 = time.monotonic()
+    job = engine.submit("sendMessage", payloads)
+    submit_ms = (time.monotonic() - t0) * 1000
+    while job.finished_at is None:
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - t0
+
+    latencies = [(at - t0) * 1000 for at, method, _ in fake.calls if method == "sendMessage"]
+    print(f"submit:     {submit_ms:.2f}ms for {job.total} messages")
+    print(f"delivered:  sent={job.sent} failed={job.failed} in {elapsed:.2f}s "
+          f"({job.sent / elapsed:.1f} msg/s, limit {args.rate}/s)")
+    print(f"latency:    p50={pct(latencies, .5):.0f}ms p95={pct(latencies, .95):.0f}ms "
+          f"max={max(latencies):.0f}ms mean={statistics.mean(latencies):.0f}ms")
+    print(f"429s:       {fake.rejected}")
+
+    await engine.stop()
+    await client.aclose()
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--recipients", type=int, default=300)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--rate", type=float, default=30, help="global msgs/s")
+    ap.add_argument("--latency", type=float, default=0.05, help="fake server latency (s)")
+    args = ap.parse_args()
+    use_workdir()
+    asyncio.run(run(args))
@@ -0,0 +1,42 @@
+"""
+Setup shared by the bench_* and check_* scripts: the repo root on sys.path, a
+temp work dir with its own SQLite file, the fake Telegram server.
+
+    from bench_env import ROOT, start_fake_telegram, use_workdir
+
+    workdir = use_workdir()  # before the backend is imported, it reads DATABASE_URL once
+    fake = await start_fake_telegram(latency=0.1)  # before the Telegram client is created
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def make_workdir() -> str:
+    return tempfile.mkdtemp(prefix="fdi-bench-")
+
+
+def sqlite_url(workdir: str, name: str = "bench.db") -> str:
+    return f"sqlite:///{os.path.join(workdir, name)}"
+
+
+def use_workdir() -> str:
+    """Create a temp work dir, point DATABASE_URL at a SQLite file in it (unless it is set
+    already, e.g. to a PostgreSQL database) and make it the current directory."""
+    workdir = make_workdir()
+    os.environ.setdefault("DATABASE_URL", sqlite_url(workdir))
+    os.chdir(workdir)
+    return workdir
+
+
+async def start_fake_telegram(**kwargs):
+    """Start a FakeTelegram (kwargs go to its constructor) and point TELEGRAM_API_BASE at it."""
+    from fake_telegram import FakeTelegram
+
+    fake = FakeTelegram(**kwargs)
+    os.environ["TELEGRAM_API_BASE"] = await fake.start()
+    return fake
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Memory/throughput check for the bulk user endpoints.
+
+Seeds N users in a temp SQLite file, starts the API with uvicorn in a
+subprocess and measures the server's resident memory (peak VmHWM growth
+over the idle baseline) while:
+  - streaming GET /api/users/export as NDJSON and as CSV,
+  - uploading an N-row NDJSON file to POST /api/users/import,
+  - (with --with-list) loading the plain GET /api/users array, for comparison.
+
+SQLite's mmap'd database pages count towards RSS too; run with
+SQLITE_MMAP_SIZE=0 to see the heap alone.
+
+Usage:
+    python scripts/bench_export.py --users 1000000
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench_env import ROOT, make_workdir, sqlite_url
+
+
+def seed(n_users):
+    from sqlalchemy import insert
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    now = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for start in range(0, n_users, 50_000):
+            conn.execute(insert(User), [
+                {"telegram_id": 1_000_000 + i, "first_name": f"user{i}", "last_name": "Rossi",
+                 "email": f"user{i}@example.com", "level": 1 + i % 4,
+                 "status": UserStatus.active, "registered_at": now}
+                for i in range(start, min(n_users, start + 50_000))
+            ])
+
+
+def memory_kb(pid, field):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def reset_peak(pid):
+    # writing 5 to clear_refs resets VmHWM to the current RSS (Linux >= 4.0)
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def measure(name, pid, fn):
+    reset_peak(pid)
+    base = memory_kb(pid, "VmRSS")
+    t0 = time.perf_counter()
+    detail = fn()
+    elapsed = time.perf_counter() - t0
+    peak = memory_kb(pid, "VmHWM")
+    print(f"{name:>14}: {elapsed:6.2f}s  rss {base / 1024:6.1f}MB -> peak {peak / 1024:6.1f}MB "
+          f"(+{(peak - base) / 1024:.1f}MB)  {detail}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200_000)
+    ap.add_argument("--with-list", action="store_true", help="also load GET /api/users")
+    args = ap.parse_args()
+
+    import httpx
+
+    workdir = make_workdir()
+    os.environ["DATABASE_URL"] = sqlite_url(workdir)
+    seed(args.users)
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, PYTHONPATH=ROOT), cwd=workdir,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/api/health")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+
+        client = httpx.Client(base_url=base_url, timeout=None)
+
+        def export(format):
+            def run():
+                size = lines = 0
+                with client.stream("GET", "/api/users/export", params={"format": format}) as r:
+                    for chunk in r.iter_bytes():
+                        size += len(chunk)
+                        lines += chunk.count(b"\n")
+                return f"{lines} lines, {size / 1e6:.1f}MB"
+            return run
+
+        def upload():
+            def body():
+                for start in range(0, args.users, 10_000):
+                    yield "".join(
+                        json.dumps({"telegram_id": 1_000_000 + i, "first_name": f"imported{i}", "level": 2}) + "\n"
+                        for i in range(start, min(args.users, start + 10_000))
+                    ).encode()
+            r = client.post("/api/users/import", content=body(), headers={"Content-Type": "application/x-ndjson"})
+            return r.json()
+
+        def list_all():
+            r = client.get("/api/users")
+            return f"{len(r.json())} users"
+
+        print(f"{args.users} users")
+        measure("export ndjson", server.pid, export("ndjson"))
+        measure("export csv", server.pid, export("csv"))
+        measure("import ndjson", server.pid, upload)
+        if args.with_list:
+            measure("GET /api/users", server.pid, list_all)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the per-user feed (/api/contents/history/{telegram_id}).
+
+Seeds a throw-away SQLite database with N users and M contents (each content
+targeted to 1-2 levels, ~5% with a direct user grant), then times the first
+page and a deep page of the feed for random users.
+
+Usage:
+    source .venv/bin/activate
+    python scripts/bench_feed.py --users 50000 --contents 100000
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bench_env import use_workdir
+
+
+def seed(engine, n_users, n_contents):
+    from sqlalchemy import insert
+    from backend.app.db.session import Base
+    from backend.app.models.models import User, Content, ContentVisibility, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+
+    rnd = random.Random(42)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {
+                "telegram_id": 1_000_000 + i,
+                "first_name": f"user{i}",
+                "level": rnd.randint(1, 4),
+                "status": UserStatus.active if rnd.random() < 0.9 else UserStatus.pending,
+                "registered_at": start,
+            }
+            for i in range(n_users)
+        ])
+        conn.execute(insert(Content), [
+            {
+                "title": f"content {i}",
+                "body": "lorem ipsum " * 10,
+                "author_id": 0,
+                "published_at": start + timedelta(minutes=i),
+            }
+            for i in range(n_contents)
+        ])
+        vis = []
+        for cid in range(1, n_contents + 1):
+            for lvl in rnd.sample([1, 2, 3, 4], rnd.randint(1, 2)):
+                vis.append({"content_id": cid, "user_id": None, "level_target": lvl})
+            if rnd.random() < 0.05:
+                vis.append({"content_id": cid, "user_id": rnd.randint(1, n_users), "level_target": None})
+        conn.execute(insert(ContentVisibility), vis)
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50_000)
+    ap.add_argument("--contents", type=int, default=100_000)
+    ap.add_argument("--requests", type=int, default=500)
+    args = ap.parse_args()
+
+    workdir = use_workdir()
+
+    from fastapi.testclient import TestClient
+    from backend.app.main import app
+    from backend.app.db.session import engine
+
+    t0 = time.perf_counter()
+    seed(engine, args.users, args.contents)
+    print(f"seeded {args.users} users / {args.contents} contents in {time.perf_counter() - t0:.1f}s ({workdir})")
+
+    client = TestClient(app)
+    rnd = random.Random(7)
+    first, deep = [], []
+    for _ in range(args.requests):
+        tg = 1_000_000 + rnd.randrange(args.users)
+        t = time.perf_counter()
+        r = client.get(f"/api/contents/history/{tg}", params={"limit": 50})
+        first.append((time.perf_counter() - t) * 1000)
+        r.raise_for_status()
+        cursor = r.headers.get("X-Next-Cursor")
+        for _ in range(20):  # walk 20 pages deep
+            if not cursor:
+                break
+            t = time.perf_counter()
+            r = client.get(f"/api/contents/history/{tg}", params={"limit": 50, "before": cursor})
+            deep.append((time.perf_counter() - t) * 1000)
+            cursor = r.headers.get("X-Next-Cursor")
+
+    for name, values in (("first page", first), ("next pages", deep)):
+        if values:
+            print(f"{name:>10}: n={len(values)} mean={statistics.mean(values):.2f}ms "
+                  f"p50={pct(values, .5):.2f}ms p95={pct(values, .95):.2f}ms p99={pct(values, .99):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
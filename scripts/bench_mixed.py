@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Mixed-load latency benchmark: user lookups, history and feed pages,
+registrations and level changes (with Telegram side effects answered by the
+fake Telegram server) hitting the app concurrently on a temp SQLite file.
+Prints throughput and p50/p95/p99 per endpoint.
+
+Usage:
+    python scripts/bench_mixed.py --requests 3000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bench_env import start_fake_telegram, use_workdir
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed(n_users, n_contents):
+    from sqlalchemy import insert
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, Content, ContentVisibility, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"telegram_id": 1_000_000 + i, "first_name": f"user{i}", "level": 1 + i % 4,
+             "status": UserStatus.active, "registered_at": start}
+            for i in range(n_users)
+        ])
+        conn.execute(insert(Content), [
+            {"title": f"content {i}", "body": "lorem ipsum", "author_id": 0,
+             "published_at": start + timedelta(minutes=i)}
+            for i in range(n_contents)
+        ])
+        conn.execute(insert(ContentVisibility), [
+            {"content_id": i + 1, "user_id": None, "level_target": 1 + i % 4} for i in range(n_contents)
+        ])
+
+
+async def run(args):
+    fake = await start_fake_telegram(latency=args.telegram_latency, global_rate=1e9, per_chat_rate=1e9)
+    os.environ["TELEGRAM_GLOBAL_RATE"] = "1000000"
+    os.environ["TELEGRAM_PER_CHAT_RATE"] = "1000000"
+
+    import httpx
+    from backend.app.main import app
+
+    seed(args.users, args.contents)
+    rnd = random.Random(1)
+    ops = (
+        [("get_user", 50), ("history", 15), ("feed", 15), ("register", 12), ("change_level", 8)]
+    )
+    names = [n for n, w in ops for _ in range(w)]
+
+    def request(name):
+        tg = 1_000_000 + rnd.randrange(args.users)
+        if name == "get_user":
+            return "GET", f"/api/users/{tg}", None
+        if name == "history":
+            return "GET", "/api/contents/history?limit=50", None
+        if name == "feed":
+            return "GET", f"/api/contents/history/{tg}?limit=50", None
+        if name == "register":
+            return "POST", "/api/users/register_user", {"telegram_id": tg, "first_name": "x", "level": 1}
+        return "POST", f"/api/users/change_level?user_id={rnd.randint(1, args.users)}&level={rnd.randint(1, 4)}", None
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    sem = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async def one(client, name):
+        method, url, body = request(name)
+        async with sem:
+            t = time.perf_counter()
+            r = await client.request(method, url, json=body)
+            latencies[name].append((time.perf_counter() - t) * 1000)
+            if r.status_code >= 400:
+                errors[name] += 1
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(client, rnd.choice(names)) for _ in range(args.requests)))
+            elapsed = time.perf_counter() - t0
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"{total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s), concurrency {args.concurrency}")
+    every = [x for v in latencies.values() for x in v]
+    for name, values in sorted(latencies.items()) + [("ALL", every)]:
+        print(f"{name:>13}: n={len(values):>5} p50={pct(values, .5):7.1f}ms p95={pct(values, .95):7.1f}ms "
+              f"p99={pct(values, .99):7.1f}ms errors={errors.get(name, 0)}")
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=5000)
+    ap.add_argument("--contents", type=int, default=5000)
+    ap.add_argument("--requests", type=int, default=3000)
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--telegram-latency", type=float, default=0.05)
+    args = ap.parse_args()
+    use_workdir()
+    asyncio.run(run(args))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Registration load test on a local SQLite file.
+
+Fires concurrent POST /api/users/register_user requests (new users and
+re-registrations) with concurrent GET /api/users/{telegram_id} readers, once
+with SQLite defaults (SQLITE_PRAGMAS=0, rollback journal) and once with the
+tuned connection pragmas (WAL, synchronous=NORMAL, busy_timeout, mmap), and
+prints throughput, latency and error counts for both.
+
+With --same-id requests come in bursts of 20 concurrent registrations for
+the same, not yet registered telegram_id (the /register spam case): it must
+end with zero errors and exactly requests/20 user rows.
+
+Usage:
+    python scripts/bench_register.py --requests 2000 --concurrency 50
+    python scripts/bench_register.py --same-id --requests 500 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from bench_env import ROOT, make_workdir, sqlite_url
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def child(args):
+    import httpx
+    from backend.app.main import app
+    from backend.app.db.session import engine, Base
+
+    Base.metadata.create_all(bind=engine)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], {}
+
+    async def one(client, i):
+        tg = 5_000_000 + (i % (args.requests // 2 or 1))  # half of the calls re-register
+        if args.same_id:
+            tg = 5_000_000 + i // 20
+        async with sem:
+            t = time.perf_counter()
+            if i % 4 == 3 and not args.same_id:
+                r = await client.get(f"/api/users/{tg}")
+                ok = r.status_code in (200, 404)
+            else:
+                r = await client.post("/api/users/register_user",
+                                      json={"telegram_id": tg, "first_name": f"u{i}", "level": 1 + i % 4})
+                ok = r.status_code == 200
+            latencies.append((time.perf_counter() - t) * 1000)
+            if not ok:
+                key = f"{r.status_code}: {r.text[:60]}"
+                errors[key] = errors.get(key, 0) + 1
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - t0
+
+    from sqlalchemy import func, select
+    from backend.app.models.models import User
+    with engine.connect() as conn:
+        rows = conn.execute(select(func.count()).select_from(User)).scalar()
+
+    print(json.dumps({
+        "users": rows,
+        "requests": args.requests,
+        "elapsed_s": round(elapsed, 3),
+        "req_per_s": round(args.requests / elapsed, 1),
+        "p50_ms": round(pct(latencies, .5), 2),
+        "p99_ms": round(pct(latencies, .99), 2),
+        "errors": errors,
+    }))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--same-id", action="store_true", help="bursts of 20 registrations per telegram_id")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    modes = (("sqlite defaults", "0"), ("WAL + pragmas", "1"))
+    if args.same_id:
+        modes = modes[1:]
+    for name, pragmas in modes:
+        workdir = make_workdir()
+        env = dict(os.environ, SQLITE_PRAGMAS=pragmas, DATABASE_URL=sqlite_url(workdir))
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--requests", str(args.requests),
+             "--concurrency", str(args.concurrency)] + (["--same-id"] if args.same_id else []),
+            env=env, capture_output=True, text=True, cwd=workdir,
+        )
+        if out.returncode != 0:
+            print(f"{name}: failed\n{out.stderr}")
+            continue
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{name:>16}: {res['req_per_s']:>7} req/s  p50={res['p50_ms']}ms p99={res['p99_ms']}ms "
+              f"users={res['users']} errors={sum(res['errors'].values())} {res['errors'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark and sync check for GET /api/contents/search on a temp SQLite file,
+in process through httpx's ASGI transport.
+
+Seeds N contents whose words follow a Zipf distribution over a synthetic
+vocabulary (so there are words in almost every post and words in a few),
+each visible to one level, and a few users. Then:
+
+1. latency of queries by selectivity (common / medium / rare word, two words,
+   "prefix*"), as an admin and as a level 1 user (visibility filter), and the
+   share of them ranked rather than answered newest first (too broad);
+2. the index follows the contents table: a new post, an edited title and a
+   deleted post are found / not found right away, and a user never gets a
+   post of a level above theirs.
+
+Usage:
+    python scripts/bench_search.py --contents 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from bench_env import use_workdir
+
+
+VOCABULARY = 20_000
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def word(rank):
+    # pronounceable, distinct words: rank 0 -> "baba", ...
+    syllables = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "zo"]
+    out, n = "", rank
+    for _ in range(4):
+        out += syllables[n % len(syllables)]
+        n //= len(syllables)
+    return out
+
+
+def seed(n_contents):
+    from sqlalchemy import insert
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import Content, ContentVisibility, User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(1)
+    weights = [1 / (r + 1) for r in range(VOCABULARY)]
+    words = [word(r) for r in range(VOCABULARY)]
+    start = datetime(2024, 1, 1)
+    t = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"telegram_id": 1_000_000 + level, "first_name": f"l{level}", "level": level,
+             "status": UserStatus.active, "registered_at": start} for level in (1, 2, 3, 4)
+        ])
+        for offset in range(0, n_contents, 20_000):
+            ids = range(offset, min(n_contents, offset + 20_000))
+            text = rnd.choices(words, weights, k=len(ids) * 46)
+            conn.execute(insert(Content), [
+                {"title": " ".join(text[j * 46:j * 46 + 6]), "body": " ".join(text[j * 46 + 6:(j + 1) * 46]),
+                 "author_id": 0, "published_at": start + timedelta(minutes=i)}
+                for j, i in enumerate(ids)
+            ])
+            conn.execute(insert(ContentVisibility), [
+                {"content_id": i + 1, "user_id": None, "level_target": 1 + i % 4} for i in ids
+            ])
+    print(f"seeded {n_contents} contents in {time.perf_counter() - t:.0f}s")
+    return words
+
+
+async def run(args):
+    import httpx
+    from backend.app.main import app
+
+    words = seed(args.contents)
+    queries = {
+        "common word": lambda r: words[r.randrange(0, 3)],
+        "medium word": lambda r: words[r.randrange(200, 1000)],
+        "rare word": lambda r: words[r.randrange(5000, 20000)],
+        "two words": lambda r: f"{words[r.randrange(0, 50)]} {words[r.randrange(200, 2000)]}",
+        "prefix": lambda r: words[r.randrange(200, 2000)][:6] + "*",
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for who, params in [("admin", {}), ("level 1 user", {"telegram_id": 1_000_001})]:
+            for name, make in queries.items():
+                rnd = random.Random(name)
+                latencies, hits, ranked = [], 0, 0
+                for _ in range(args.queries):
+                    t = time.perf_counter()
+                    r = await client.get("/api/contents/search", params={"q": make(rnd), "limit": 20, **params})
+                    latencies.append((time.perf_counter() - t) * 1000)
+                    assert r.status_code == 200, r.text
+                    hits += len(r.json())
+                    ranked += bool(r.json()) and r.json()[0]["score"] is not None
+                print(f"{who:>12} {name:<12} p50={pct(latencies, .5):6.1f}ms p95={pct(latencies, .95):6.1f}ms "
+                      f"max={max(latencies):6.1f}ms  avg results={hits / args.queries:.1f} ranked={ranked / args.queries:.0%}")
+
+        # 2: the index follows inserts, updates and deletes
+        async def found(q, content_id, **params):
+            r = await client.get("/api/contents/search", params={"q": q, **params})
+            assert r.status_code == 200, r.text
+            return any(c["id"] == content_id for c in r.json())
+
+        r = await client.post("/api/contents/publish_content",
+                              json={"title": "Assemblea straordinaria", "body": "Ordine del giorno: bilancio", "levels": [3]})
+        content_id = r.json()["content_id"]
+        assert await found("assemblea straord*", content_id)
+        assert await found("bilancio", content_id, telegram_id=1_000_003)
+        assert not await found("bilancio", content_id, telegram_id=1_000_001), "level 3 post shown to level 1"
+        hit = (await client.get("/api/contents/search", params={"q": "assemblea"})).json()[0]
+        assert "**Assemblea**" in hit["snippet"], hit
+
+        from sqlalchemy import delete, update
+        from backend.app.db.session import AsyncSessionLocal
+        from backend.app.models.models import Content
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Content).where(Content.id == content_id).values(title="Riunione straordinaria"))
+            await db.commit()
+        assert not await found("assemblea", content_id) and await found("riunione", content_id)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Content).where(Content.id == content_id))
+            await db.commit()
+        assert not await found("riunione", content_id)
+        print("sync: insert, update and delete reflected in the index; visibility respected")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--contents", type=int, default=1_000_000)
+    ap.add_argument("--queries", type=int, default=50, help="queries per kind")
+    args = ap.parse_args()
+    use_workdir()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the read endpoints' serialization on a temp SQLite file
+with --users users and --contents contents, read in pages (--page rows) with
+the async session the API uses. Objects/s for each stage:
+
+- before: ORM objects (select(User), identity map), a UserOut built field by
+  field, then FastAPI's response_model validation and JSONResponse rendering;
+- after: the same columns as row tuples, plain dicts, JSON bytes straight
+  from services/responses.py (orjson when installed, else the json fallback,
+  measured too).
+
+Then GET /api/users and GET /api/contents/history end to end through the app
+(httpx's ASGI transport), without and with If-None-Match: an unchanged page
+is answered 304 with no body.
+
+Usage:
+    python scripts/bench_serialize.py --users 100000 --contents 20000
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from bench_env import use_workdir
+
+
+def seed(n_users, n_contents):
+    from sqlalchemy import insert
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import Content, ContentVisibility, User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for offset in range(0, n_users, 50_000):
+            conn.execute(insert(User), [
+                {"telegram_id": 1_000_000 + i, "first_name": f"Utente{i}", "last_name": f"Cognome{i % 997}",
+                 "email": f"utente{i}@example.org", "phone": f"+39 333 {i:07d}", "level": 1 + i % 4,
+                 "status": UserStatus.active if i % 10 else UserStatus.pending, "registered_at": start}
+                for i in range(offset, min(n_users, offset + 50_000))
+            ])
+        for offset in range(0, n_contents, 50_000):
+            ids = range(offset, min(n_contents, offset + 50_000))
+            conn.execute(insert(Content), [
+                {"title": f"Comunicato {i}", "body": "Lorem ipsum dolor sit amet, perché è così. " * 5,
+                 "author_id": 0, "published_at": start + timedelta(minutes=i)} for i in ids
+            ])
+            conn.execute(insert(ContentVisibility), [
+                {"content_id": i + 1, "user_id": None, "level_target": 1 + i % 4} for i in ids
+            ])
+
+
+def old_user_out(u):
+    from backend.app.models.models import UserStatus
+    from backend.app.schemas.users import UserOut
+
+    # the routers' _to_user_out before the plain row path
+    return UserOut(
+        id=u.id, telegram_id=u.telegram_id, first_name=u.first_name, last_name=u.last_name, phone=u.phone,
+        email=u.email, indirizzo=u.indirizzo, varie=u.varie, level=u.level,
+        status=u.status.value if isinstance(u.status, UserStatus) else u.status, approved_by=u.approved_by,
+    )
+
+
+async def pages(db, query, key, page, orm=False):
+    """Keyset pages of query, ordered by key; yields the rows (ORM objects with orm) of each
+    page and the time spent getting them."""
+    after = None
+    while True:
+        q = query.order_by(key).limit(page)
+        if after is not None:
+            q = q.where(key > after)
+        t0 = time.perf_counter()
+        result = await db.execute(q)
+        rows = result.scalars().all() if orm else result.all()
+        fetch = time.perf_counter() - t0
+        if not rows:
+            return
+        yield rows, fetch
+        after = rows[-1].id
+        db.expunge_all()  # a fresh identity map per page, as per request
+
+
+async def bench_users(args):
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_model_field
+    from sqlalchemy import select
+    from backend.app.db.session import AsyncSessionLocal
+    from backend.app.models.models import User
+    from backend.app.routers.users import USER_OUT_COLUMNS, _user_dict
+    from backend.app.schemas.users import UserOut
+    from backend.app.services import responses
+
+    field = create_model_field(name="Response_list_users", type_=List[UserOut], mode="serialization")
+    results = {}
+
+    async with AsyncSessionLocal() as db:
+        fetch = build = encode = 0.0
+        n = size = 0
+        async for rows, t in pages(db, select(User), User.id, args.page, orm=True):
+            fetch += t
+            t0 = time.perf_counter()
+            objs = [old_user_out(u) for u in rows]
+            t1 = time.perf_counter()
+            content = await serialize_response(field=field, response_content=objs, is_coroutine=True)
+            body = JSONResponse(content).body
+            encode += time.perf_counter() - t1
+            build += t1 - t0
+            n, size = n + len(rows), size + len(body)
+        results["before"] = (n, fetch, build, encode, size)
+
+        for name, use_orjson in (("after, json", False), ("after, orjson", True)):
+            if use_orjson and not responses.ORJSON_AVAILABLE:
+                continue
+            saved, responses.ORJSON_AVAILABLE = responses.ORJSON_AVAILABLE, use_orjson
+            fetch = build = encode = 0.0
+            n = size = 0
+            async for rows, t in pages(db, select(*USER_OUT_COLUMNS), User.id, args.page):
+                fetch += t
+                t0 = time.perf_counter()
+                content = [_user_dict(row) for row in rows]
+                t1 = time.perf_counter()
+                body = responses.dumps(content)
+                encode += time.perf_counter() - t1
+                build += t1 - t0
+                n, size = n + len(rows), size + len(body)
+            responses.ORJSON_AVAILABLE = saved
+            results[name] = (n, fetch, build, encode, size)
+
+    base = None
+    for name, (n, fetch, build, encode, size) in results.items():
+        total = fetch + build + encode
+        base = base or total
+        print(f"users {name:>14}: {n / total:>9,.0f} objects/s (x{base / total:.1f}) | fetch {n / fetch:>9,.0f}/s, "
+              f"build {n / build:>10,.0f}/s, encode {n / encode:>10,.0f}/s | {size / n:.0f} bytes/object")
+
+
+async def bench_endpoints(args):
+    import httpx
+    from backend.app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for path, params in (("/api/users", {"limit": 500}), ("/api/contents/history", {"limit": 200})):
+            first = await client.get(path, params=params)
+            assert first.status_code == 200 and "etag" in first.headers, first.status_code
+            for name, headers in (("200", None), ("304", {"If-None-Match": first.headers["etag"]})):
+                t0 = time.perf_counter()
+                for _ in range(args.requests):
+                    r = await client.get(path, params=params, headers=headers)
+                    assert r.status_code == int(name), r.status_code
+                took = time.perf_counter() - t0
+                print(f"GET {path}?limit={params['limit']} -> {name}: {args.requests / took:,.0f} req/s, "
+                      f"{took / args.requests * 1000:.2f}ms each, {len(r.content):,} bytes")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--contents", type=int, default=20_000)
+    ap.add_argument("--page", type=int, default=500, help="rows per page (GET /api/users' maximum)")
+    ap.add_argument("--requests", type=int, default=200, help="requests per end-to-end case")
+    args = ap.parse_args()
+    use_workdir()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    t0 = time.perf_counter()
+    seed(args.users, args.contents)
+    print(f"seeded {args.users} users and {args.contents} contents in {time.perf_counter() - t0:.1f}s; "
+          f"pages of {args.page}")
+    asyncio.run(bench_users(args))
+    asyncio.run(bench_endpoints(args))
+
+
+if __name__ == "__main__":
+    main()
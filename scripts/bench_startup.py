@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Startup cost of the API, on a temp SQLite file migrated once with Alembic:
+
+1. import + create_app() in a fresh interpreter (median of --runs), and the
+   whole process until then;
+2. `python -X importtime` of the same, summed per top-level package, to see
+   where the time goes;
+3. uvicorn with --workers N (scripts/run_api.sh's command): time until every
+   worker has finished its startup and until the first request is answered.
+
+Usage:
+    python scripts/bench_startup.py --workers 4
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from bench_env import ROOT, make_workdir, sqlite_url
+
+BUILD = ("import time; t = time.perf_counter(); from backend.app.main import create_app; create_app(); "
+         "print((time.perf_counter() - t) * 1000)")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time(env, runs):
+    inside, whole = [], []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", BUILD], env=env, capture_output=True, text=True, check=True)
+        whole.append((time.perf_counter() - t0) * 1000)
+        inside.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(inside), statistics.median(whole)
+
+
+def by_package(env):
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", BUILD], env=env,
+                         capture_output=True, text=True, check=True).stderr
+    totals = Counter()
+    for line in err.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)", line)
+        if m:
+            name = m.group(2).split(".")[0]
+            totals["backend.app" if name == "backend" else name] += int(m.group(1)) / 1000
+    return totals
+
+
+def serve(env, workers, timeout=120):
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--factory", "backend.app.main:create_app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "info"],
+        env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True,
+    )
+    started, first = 0, None
+    import urllib.request
+    try:
+        for line in proc.stderr:
+            if "Application startup complete" in line:
+                started += 1
+                if first is None:
+                    while first is None and time.perf_counter() - t0 < timeout:
+                        try:
+                            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=5).read()
+                            first = time.perf_counter() - t0
+                        except OSError:
+                            time.sleep(0.01)
+                if started == workers:
+                    return first, time.perf_counter() - t0
+            if time.perf_counter() - t0 > timeout:
+                raise SystemExit("uvicorn workers didn't start")
+        raise SystemExit("uvicorn exited")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+    workdir = make_workdir()
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL=sqlite_url(workdir))
+
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "alembic", "-c", os.path.join(ROOT, "alembic.ini"), "upgrade", "head"],
+                   env=env, cwd=workdir, check=True, capture_output=True)
+    print(f"migrations:  alembic upgrade head on an empty DB, once: {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+    inside, whole = import_time(env, args.runs)
+    print(f"create_app:  {inside:.0f}ms import + build, {whole:.0f}ms for the whole process (median of {args.runs})")
+    top = by_package(env).most_common(8)
+    print("importtime:  " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in top))
+
+    first, all_up = serve(env, args.workers)
+    print(f"uvicorn:     --workers {args.workers}: first response after {first * 1000:.0f}ms, "
+          f"all workers started after {all_up * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark and staleness check for the user lookup cache
+(backend/app/services/cache.py) on a temp SQLite file, in process through
+httpx's ASGI transport.
+
+1. GET /api/users/{telegram_id} latency with the cache off, with the memory
+   backend and with the Redis backend (scripts/fake_redis.py, --redis-latency
+   per round trip), plus the hit ratio from GET /api/users/cache_stats;
+2. readers hammer a few users while a writer changes their level: every read
+   started after a change_level response must see the new level;
+3. the race the fill tokens/versions guard against: a lookup loads the old
+   row, a write invalidates the key, then the lookup stores what it loaded;
+   the next lookup must still miss. Checked for both backends, the Redis one
+   with two "workers" sharing the fake server.
+
+Usage:
+    python scripts/bench_user_cache.py --users 100000 --lookups 5000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from bench_env import use_workdir
+from fake_redis import FakeRedis
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed(n_users):
+    from sqlalchemy import insert, select
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for start in range(0, n_users, 50_000):
+            conn.execute(insert(User), [
+                {"telegram_id": 1_000_000 + i, "first_name": f"user{i}", "level": 1 + i % 4,
+                 "status": UserStatus.active, "registered_at": datetime(2024, 1, 1)}
+                for i in range(start, min(n_users, start + 50_000))
+            ])
+        return conn.execute(select(User.id, User.telegram_id)).all()
+
+
+async def check_race(name, reader, writer):
+    """reader/writer: ReadThroughCaches sharing one store (or the same object)."""
+    released = asyncio.Event()
+
+    async def slow_load():
+        await released.wait()
+        return {"level": 1}  # what the row looked like before the write
+
+    lookup = asyncio.create_task(reader.get(42, slow_load))
+    await asyncio.sleep(0.01)
+    await writer.invalidate([42])  # the write commits and invalidates while the load is in flight
+    released.set()
+    assert (await lookup)["level"] == 1
+
+    async def fresh_load():
+        return {"level": 2}
+
+    value = await reader.get(42, fresh_load)
+    assert value["level"] == 2, f"{name}: stale value stored after invalidation"
+    print(f"race ({name}): value loaded before the write was not served after it")
+
+
+async def run(args):
+    import httpx
+    from backend.app.main import app
+    from backend.app.services.cache import MemoryBackend, ReadThroughCache, RedisBackend, user_cache
+
+    users = seed(args.users)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # 1: latency, Zipf-ish: most lookups hit a small set of active users
+        hot = [t for _, t in random.sample(users, min(len(users), 1000))]
+        lookups = [random.choice(hot) if random.random() < 0.9 else random.choice(users)[1]
+                   for _ in range(args.lookups)]
+        sem = asyncio.Semaphore(args.concurrency)
+        for name, backend in [("off", None), ("memory", MemoryBackend()),
+                              ("redis (fake)", RedisBackend(client=FakeRedis(latency=args.redis_latency)))]:
+            user_cache.backend = backend
+            user_cache.hits = user_cache.misses = 0
+            latencies = []
+
+            async def get(telegram_id):
+                async with sem:
+                    t = time.perf_counter()
+                    r = await client.get(f"/api/users/{telegram_id}")
+                    latencies.append((time.perf_counter() - t) * 1000)
+                    assert r.status_code == 200, r.text
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(get(t) for t in lookups))
+            elapsed = time.perf_counter() - t0
+            stats = (await client.get("/api/users/cache_stats")).json()
+            print(f"{name:>13}: p50={pct(latencies, .5):6.2f}ms p99={pct(latencies, .99):6.2f}ms "
+                  f"{len(lookups) / elapsed:6.0f} req/s  hit ratio={stats['hit_ratio']}")
+
+        # 2: reads racing level changes through the API
+        for name, backend in [("memory", MemoryBackend()),
+                              ("redis (fake)", RedisBackend(client=FakeRedis(latency=args.redis_latency)))]:
+            user_cache.backend = backend
+            targets = random.sample(users, 20)
+            levels, writing = {}, {}  # last level whose change_level answered / was sent
+            stop = False
+            stale = reads = 0
+
+            async def reader():
+                nonlocal stale, reads
+                while not stop:
+                    user_id, telegram_id = random.choice(targets)
+                    expected = levels.get(user_id)
+                    r = (await client.get(f"/api/users/{telegram_id}")).json()
+                    reads += 1
+                    # the level of a change_level still running may be committed already: not stale
+                    if (expected is not None and r["level"] not in (expected, writing.get(user_id))
+                            and levels.get(user_id) == expected):
+                        stale += 1
+
+            readers = [asyncio.create_task(reader()) for _ in range(16)]
+            for i in range(args.writes):
+                user_id, _ = random.choice(targets)
+                level = 1 + i % 4
+                writing[user_id] = level
+                r = await client.post("/api/users/change_level", params={"user_id": user_id, "level": level})
+                assert r.status_code == 200, r.text
+                levels[user_id] = level
+                await asyncio.sleep(0)
+            stop = True
+            await asyncio.gather(*readers)
+            print(f"consistency ({name}): {args.writes} level changes, {reads} concurrent reads, stale={stale}")
+            assert stale == 0
+
+    # 3: the load/invalidate/store race, directly on the cache
+    memory = ReadThroughCache(MemoryBackend(), "user", 60)
+    await check_race("memory", memory, memory)
+    shared = FakeRedis()
+    await check_race("redis, two workers",
+                     ReadThroughCache(RedisBackend(client=shared), "user", 60),
+                     ReadThroughCache(RedisBackend(client=shared), "user", 60))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--lookups", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--writes", type=int, default=300)
+    ap.add_argument("--redis-latency", type=float, default=0.0002, help="seconds per fake Redis round trip")
+    args = ap.parse_args()
+    use_workdir()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
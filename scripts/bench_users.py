@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for the paginated user list on a temp SQLite file.
+
+Seeds N users, then times GET /api/users pages (first page, deep keyset
+page, level/status filters, prefix search, last_name sort) and
+GET /api/users/stats cold and cached, in process through httpx's ASGI
+transport. With --explain the SQLite query plans of the list queries are
+printed too, to check that every variant is an index search.
+
+Usage:
+    python scripts/bench_users.py --users 500000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from bench_env import use_workdir
+
+
+FIRST = ["Mario", "Luca", "Anna", "Giulia", "Marco", "Sara", "Paolo", "Elena", "Ángela", "Zoe"]
+LAST = ["Rossi", "Bianchi", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Álvarez", None]
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed(n_users):
+    from sqlalchemy import insert
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(1)
+    statuses = [UserStatus.active] * 8 + [UserStatus.pending, UserStatus.rejected]
+    now = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for start in range(0, n_users, 50_000):
+            rows = []
+            for i in range(start, min(n_users, start + 50_000)):
+                first, last = rnd.choice(FIRST), rnd.choice(LAST)
+                rows.append({
+                    "telegram_id": 1_000_000 + i, "first_name": f"{first}{i % 997}",
+                    "last_name": last and f"{last}{i % 991}", "email": f"{first.lower()}.{i}@example.com",
+                    "phone": f"+39{3_000_000_000 + i}", "level": 1 + i % 4,
+                    "status": rnd.choice(statuses), "registered_at": now,
+                })
+            conn.execute(insert(User), rows)
+
+
+def explain(n_users):
+    from sqlalchemy import select
+    from backend.app.db.session import engine
+    from backend.app.models.models import User
+    from backend.app.routers import users as r
+
+    cases = {
+        "level": r._user_page(r._filter_users(select(User), 3, None), "id", None, 100),
+        "level+status": r._user_page(r._filter_users(select(User), 2, "pending"), "id", None, 100),
+        "status, deep": r._user_page(r._filter_users(select(User), None, "pending"), "id", str(n_users // 2), 100),
+        "search": r._user_page(r._search_users(select(User), "mar"), "id", None, 100, search=True),
+        "last_name": r._user_page(select(User, r.LAST_NAME_KEY), "last_name", "ricci,10", 100),
+    }
+    with engine.connect() as conn:
+        for name, q in cases.items():
+            # with bound parameters, as the API runs it: the plan can differ from literal values
+            compiled = q.compile(engine)
+            params = tuple(compiled.params[name] for name in compiled.positiontup)
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+            print(f"{name}:")
+            for row in plan:
+                print(f"    {row[-1]}")
+
+
+async def run(args):
+    import httpx
+    from backend.app.main import app
+    from backend.app.services.user_stats import user_stats
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def timed(url, reps=args.reps):
+            latencies = []
+            for _ in range(reps):
+                t = time.perf_counter()
+                r = await client.get(url)
+                latencies.append((time.perf_counter() - t) * 1000)
+                assert r.status_code == 200, r.text
+            return r, latencies
+
+        def report(name, latencies, extra=""):
+            print(f"{name:>22}: p50={pct(latencies, .5):7.2f}ms p99={pct(latencies, .99):7.2f}ms {extra}")
+
+        for name, url in [
+            ("first page", "/api/users?limit=100"),
+            ("deep page (after_id)", f"/api/users?limit=100&after_id={args.users // 2}"),
+            ("newest first", "/api/users?limit=100&sort=-id"),
+            ("level=3", "/api/users?limit=100&level=3"),
+            ("status=pending", "/api/users?limit=100&status=pending"),
+            ("level=2 rejected", "/api/users?limit=100&level=2&status=rejected"),
+            ("search name 'mar'", "/api/users?limit=100&q=mar"),
+            ("search last 'rossi12'", "/api/users?limit=100&q=rossi12"),
+            ("search email", "/api/users?limit=100&q=sara.12"),
+            ("search phone", "/api/users?limit=100&q=%2B3930000012"),
+            ("search telegram_id", f"/api/users?q={1_000_000 + args.users // 3}"),
+            ("sort last_name", "/api/users?limit=100&sort=last_name"),
+        ]:
+            r, latencies = await timed(url)
+            report(name, latencies, f"rows={len(r.json())}")
+
+        # walk the last_name order to check the cursor neither repeats nor skips users
+        seen, after, pages, latencies = set(), None, 0, []
+        while pages < args.walk:
+            params = {"limit": 500, "sort": "last_name"}
+            if after:
+                params["after"] = after
+            t = time.perf_counter()
+            r = await client.get("/api/users", params=params)
+            latencies.append((time.perf_counter() - t) * 1000)
+            ids = [u["id"] for u in r.json()]
+            assert not seen.intersection(ids), "cursor repeated rows"
+            seen.update(ids)
+            pages += 1
+            after = r.headers.get("X-Next-Cursor")
+            if not after:
+                break
+        report("last_name walk", latencies, f"pages={pages} rows={len(seen)}")
+
+        cold = []
+        for _ in range(max(3, args.reps // 10)):
+            user_stats.invalidate()
+            t = time.perf_counter()
+            await client.get("/api/users/stats")
+            cold.append((time.perf_counter() - t) * 1000)
+        report("stats (cold)", cold)
+        _, warm = await timed("/api/users/stats")
+        report("stats (cached)", warm)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=500_000)
+    ap.add_argument("--reps", type=int, default=50)
+    ap.add_argument("--walk", type=int, default=40, help="pages of 500 to walk in last_name order")
+    ap.add_argument("--explain", action="store_true")
+    args = ap.parse_args()
+
+    use_workdir()
+    seed(args.users)
+    if args.explain:
+        explain(args.users)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
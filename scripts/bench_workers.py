@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Throughput of the API with 1..N uvicorn workers (scripts/run_api.sh's
+command) on a temp SQLite file migrated with Alembic and seeded with users
+and contents. For each worker count, --clients load processes keep
+--concurrency requests each in flight for --duration seconds (after a warm-up)
+on GET /api/users/{telegram_id}, GET /api/contents/history and
+GET /api/contents/history/{telegram_id}, and the requests/s and p50/p99
+latencies are reported per endpoint.
+
+Workers only add throughput up to the CPU cores left by the load processes:
+the core count is printed with the results.
+
+Usage:
+    python scripts/bench_workers.py --workers 4 --users 20000 --contents 20000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bench_env import ROOT, make_workdir, sqlite_url
+
+ENDPOINTS = ("users/{telegram_id}", "history", "history/{telegram_id}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+def seed(env, n_users, n_contents):
+    subprocess.run([sys.executable, "-m", "alembic", "-c", os.path.join(ROOT, "alembic.ini"), "upgrade", "head"],
+                   env=env, cwd=env["WORKDIR"], check=True, capture_output=True)
+    os.environ["DATABASE_URL"] = env["DATABASE_URL"]
+    from sqlalchemy import insert
+    from backend.app.db.session import engine
+    from backend.app.models.models import Content, ContentVisibility, User, UserStatus
+
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for offset in range(0, n_users, 50_000):
+            conn.execute(insert(User), [
+                {"telegram_id": 1_000_000 + i, "first_name": f"user{i}", "level": 1 + i % 4,
+                 "status": UserStatus.active, "registered_at": start}
+                for i in range(offset, min(n_users, offset + 50_000))
+            ])
+        for offset in range(0, n_contents, 50_000):
+            ids = range(offset, min(n_contents, offset + 50_000))
+            conn.execute(insert(Content), [
+                {"title": f"content {i}", "body": "lorem ipsum", "author_id": 0,
+                 "published_at": start + timedelta(minutes=i)} for i in ids
+            ])
+            conn.execute(insert(ContentVisibility), [
+                {"content_id": i + 1, "user_id": None, "level_target": 1 + i % 4} for i in ids
+            ])
+    engine.dispose()
+
+
+def serve(env, workers, timeout=120):
+    """uvicorn --workers N, returned once every worker has started."""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--factory", "backend.app.main:create_app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "info", "--no-access-log"],
+        env=env, cwd=env["WORKDIR"], stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True,
+    )
+    started = threading.Semaphore(0)
+
+    def read_log():
+        # keep reading, or the workers block on a full pipe
+        for line in proc.stderr:
+            if "Application startup complete" in line:
+                started.release()
+            elif re.search(r"ERROR|Traceback", line):
+                sys.stderr.write(line)
+
+    threading.Thread(target=read_log, daemon=True).start()
+    t0 = time.perf_counter()
+    for _ in range(workers):
+        if not started.acquire(timeout=max(0.0, timeout - (time.perf_counter() - t0))):
+            proc.terminate()
+            raise SystemExit("uvicorn workers didn't start")
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def load(url, n_users, concurrency, warmup, duration, seed_, out):
+    """One load process: `concurrency` clients looping over the endpoints."""
+    import httpx
+
+    async def run():
+        rnd = random.Random(seed_)
+        latencies = defaultdict(list)
+        t_start = time.perf_counter() + warmup
+        t_end = t_start + duration
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=30, limits=limits) as client:
+            async def client_loop():
+                while True:
+                    endpoint = rnd.choice(ENDPOINTS)
+                    telegram_id = 1_000_000 + rnd.randrange(n_users)
+                    path = "/api/" + ("contents/" if endpoint.startswith("history") else "") + \
+                        endpoint.format(telegram_id=telegram_id)
+                    t0 = time.perf_counter()
+                    if t0 > t_end:
+                        return
+                    r = await client.get(path, params={"limit": 20} if endpoint.startswith("history") else None)
+                    t1 = time.perf_counter()
+                    assert r.status_code == 200, (path, r.status_code, r.text[:200])
+                    if t0 >= t_start:
+                        latencies[endpoint].append(t1 - t0)
+
+            await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+        return dict(latencies)
+
+    out.put(asyncio.run(run()))
+
+
+def measure(url, args):
+    ctx = multiprocessing.get_context("fork")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=load, args=(url, args.users, args.concurrency, args.warmup, args.duration, i, out))
+             for i in range(args.clients)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    latencies = defaultdict(list)
+    for result in results:
+        for endpoint, values in result.items():
+            latencies[endpoint] += values
+    return latencies
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4, help="measure 1..N workers")
+    ap.add_argument("--users", type=int, default=20_000)
+    ap.add_argument("--contents", type=int, default=20_000)
+    ap.add_argument("--clients", type=int, default=2, help="load processes")
+    ap.add_argument("--concurrency", type=int, default=32, help="requests in flight per load process")
+    ap.add_argument("--warmup", type=float, default=2)
+    ap.add_argument("--duration", type=float, default=10)
+    args = ap.parse_args()
+    workdir = make_workdir()
+    # Telegram is never called by these endpoints: an unused local port, not the real API
+    env = dict(os.environ, PYTHONPATH=ROOT, WORKDIR=workdir, LOG_LEVEL="WARNING", SLOW_REQUEST_MS="100000",
+               DATABASE_URL=sqlite_url(workdir),
+               TELEGRAM_API_BASE=f"http://127.0.0.1:{free_port()}")
+    t0 = time.perf_counter()
+    seed(env, args.users, args.contents)
+    print(f"seeded {args.users} users and {args.contents} contents in {time.perf_counter() - t0:.1f}s; "
+          f"{os.cpu_count()} CPU cores, {args.clients} load processes x {args.concurrency} requests in flight, "
+          f"{args.duration:g}s per run")
+
+    base = None
+    for workers in range(1, args.workers + 1):
+        proc, url = serve(env, workers)
+        try:
+            latencies = measure(url, args)
+        finally:
+            proc.terminate()
+            proc.wait()
+        total = sum(len(v) for v in latencies.values()) / args.duration
+        base = base or total
+        per_endpoint = ", ".join(
+            f"{endpoint} {len(latencies[endpoint]) / args.duration:.0f}/s "
+            f"p50 {pct(latencies[endpoint], 0.5) * 1000:.1f}ms p99 {pct(latencies[endpoint], 0.99) * 1000:.1f}ms"
+            for endpoint in ENDPOINTS
+        )
+        print(f"workers={workers}: {total:.0f} req/s (x{total / base:.2f}); {per_endpoint}")
+    if os.cpu_count() < args.workers + args.clients:
+        print(f"note: {os.cpu_count()} cores for {args.workers} workers and {args.clients} load processes: "
+              f"the workers beyond the free cores share them and cannot add throughput")
+
+
+if __name__ == "__main__":
+    main()
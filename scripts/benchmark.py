@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the API and bot flows.
+
+Starts the app in process (lifespan included) against a temp SQLite file,
+with Telegram answered by scripts/fake_telegram.py, seeds N users and M
+contents, then runs each workload with --concurrency requests in flight:
+
+  register   registration storm: POST /register_user, 80% new telegram_ids
+  my_level   the bot's /my_level: GET /users/{telegram_id} + GET /users/invite_links
+  history    GET /contents/history and /history/{telegram_id}, first and next page
+  publish    POST /publish_content + POST /send_notification to 50 users,
+             waiting until the notification job is delivered
+
+For every endpoint it reports throughput, p50/p95/p99 latency, errors and
+the number of SQL statements per request (counted with an engine hook),
+and with --json writes the results to a file; --compare prints the
+change against a previous run's file.
+
+Usage:
+    python scripts/benchmark.py --users 20000 --contents 20000 --json before.json
+    python scripts/benchmark.py --json after.json --compare before.json
+    python scripts/benchmark.py --workloads my_level,history --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bench_env import ROOT, start_fake_telegram, use_workdir
+
+
+WORKLOADS = ["register", "my_level", "history", "publish"]
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed(n_users, n_contents):
+    from sqlalchemy import insert
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, Content, ContentVisibility, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(1)
+    start = datetime(2024, 1, 1)
+    statuses = [UserStatus.active] * 8 + [UserStatus.pending, UserStatus.rejected]
+    with engine.begin() as conn:
+        for offset in range(0, n_users, 50_000):
+            conn.execute(insert(User), [
+                {"telegram_id": 1_000_000 + i, "first_name": f"user{i}", "level": 1 + i % 4,
+                 "status": rnd.choice(statuses), "registered_at": start}
+                for i in range(offset, min(n_users, offset + 50_000))
+            ])
+        for offset in range(0, n_contents, 50_000):
+            ids = range(offset, min(n_contents, offset + 50_000))
+            conn.execute(insert(Content), [
+                {"title": f"content {i}", "body": "lorem ipsum", "author_id": 0,
+                 "published_at": start + timedelta(minutes=i)} for i in ids
+            ])
+            conn.execute(insert(ContentVisibility), [
+                {"content_id": i + 1, "user_id": None, "level_target": 1 + i % 4} for i in ids
+            ])
+
+
+class QueryCounter:
+    """Counts the SQL statements each asyncio task runs.
+
+    An in-process request runs in the task of the client call that made it, so the
+    count can be read around the call; the background workers run in their own tasks.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.by_task = defaultdict(int)
+        event.listen(engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        try:
+            self.by_task[asyncio.current_task()] += 1
+        except RuntimeError:  # no running loop: a sync engine/script statement
+            pass
+
+    def take(self) -> int:
+        return self.by_task.pop(asyncio.current_task(), 0)
+
+
+class Recorder:
+    def __init__(self, counter):
+        self.counter = counter
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, endpoint, method, url, **kwargs):
+        self.counter.take()
+        t = time.perf_counter()
+        r = await client.request(method, url, **kwargs)
+        self.latencies[endpoint].append((time.perf_counter() - t) * 1000)
+        self.queries[endpoint] += self.counter.take()
+        if r.status_code >= 400:
+            self.errors[endpoint] += 1
+        return r
+
+    def results(self, elapsed):
+        out = {}
+        for endpoint, values in self.latencies.items():
+            out[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput": round(len(values) / elapsed, 1),
+                "p50_ms": round(pct(values, .5), 2),
+                "p95_ms": round(pct(values, .95), 2),
+                "p99_ms": round(pct(values, .99), 2),
+                "mean_ms": round(sum(values) / len(values), 2),
+                "queries_per_request": round(self.queries[endpoint] / len(values), 2),
+            }
+        return out
+
+
+async def workload(name, client, recorder, args, rnd, state):
+    users = args.users
+    if name == "register":
+        if rnd.random() < 0.8:
+            state["next_id"] += 1
+            telegram_id = state["next_id"]
+        else:
+            telegram_id = 1_000_000 + rnd.randrange(users)
+        await recorder.call(client, "POST /users/register_user", "POST", "/api/users/register_user",
+                            json={"telegram_id": telegram_id, "first_name": "x", "level": rnd.randint(1, 4)})
+    elif name == "my_level":
+        telegram_id = 1_000_000 + rnd.randrange(users)
+        r = await recorder.call(client, "GET /users/{telegram_id}", "GET", f"/api/users/{telegram_id}")
+        if r.status_code == 200 and r.json()["status"] == "active":
+            await recorder.call(client, "GET /users/invite_links", "GET", "/api/users/invite_links",
+                                params={"level": r.json()["level"]})
+    elif name == "history":
+        if rnd.random() < 0.5:
+            endpoint, url = "GET /contents/history", "/api/contents/history"
+        else:
+            endpoint, url = "GET /contents/history/{telegram_id}", f"/api/contents/history/{1_000_000 + rnd.randrange(users)}"
+        r = await recorder.call(client, endpoint, "GET", url, params={"limit": 50})
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor:
+            await recorder.call(client, endpoint + " (next page)", "GET", url, params={"limit": 50, "before": cursor})
+    elif name == "publish":
+        r = await recorder.call(client, "POST /contents/publish_content", "POST", "/api/contents/publish_content",
+                                json={"title": "news", "body": "lorem ipsum " * 20, "levels": [rnd.randint(1, 4)]})
+        content_id = r.json()["content_id"]
+        user_ids = rnd.sample(range(1, users + 1), min(50, users))
+        r = await recorder.call(client, "POST /contents/send_notification", "POST", "/api/contents/send_notification",
+                                json={"content_id": content_id, "user_ids": user_ids})
+        job = r.json()
+        t = time.perf_counter()
+        while job.get("status") in ("queued", "running"):
+            await asyncio.sleep(0.05)
+            job = (await client.get(f"/api/contents/notifications/{job['job_id']}")).json()
+        recorder.latencies["notification delivered (50 users)"].append((time.perf_counter() - t) * 1000)
+
+
+async def run(args):
+    fake = await start_fake_telegram(latency=args.telegram_latency, global_rate=1e9, per_chat_rate=1e9)
+    # measure the app, not Telegram's flood limits (the fake server doesn't enforce them here)
+    os.environ["TELEGRAM_GLOBAL_RATE"] = "1000000"
+    os.environ["TELEGRAM_PER_CHAT_RATE"] = "1000000"
+
+    import httpx
+    from backend.app.main import app
+    from backend.app.db.session import async_engine
+
+    seed(args.users, args.contents)
+    counter = QueryCounter(async_engine)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    results = {}
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        state = {"next_id": 5_000_000}
+        for name in args.workloads:
+            rnd = random.Random(name)
+            recorder = Recorder(counter)
+            sem = asyncio.Semaphore(args.concurrency)
+            requests = args.requests if name != "publish" else max(1, args.requests // 20)
+
+            async def one():
+                async with sem:
+                    await workload(name, client, recorder, args, rnd, state)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(requests)))
+            elapsed = time.perf_counter() - t0
+            results[name] = {"seconds": round(elapsed, 2), "endpoints": recorder.results(elapsed)}
+    await fake.stop()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline=None):
+    for name, workload_result in results.items():
+        print(f"\n{name} ({workload_result['seconds']}s)")
+        base_endpoints = (baseline or {}).get(name, {}).get("endpoints", {})
+        for endpoint, r in workload_result["endpoints"].items():
+            line = (f"  {endpoint:<40} n={r['requests']:>5} {r['throughput']:>7.1f}/s "
+                    f"p50={r['p50_ms']:>7.2f} p95={r['p95_ms']:>7.2f} p99={r['p99_ms']:>7.2f}ms "
+                    f"sql/req={r['queries_per_request']:>5.2f} errors={r['errors']}")
+            base = base_endpoints.get(endpoint)
+            if base:
+                def delta(key):
+                    return f"{(r[key] - base[key]) / base[key] * 100:+.0f}%" if base[key] else "n/a"
+                line += f"  vs baseline: {delta('throughput')}/s p50 {delta('p50_ms')} p99 {delta('p99_ms')}"
+                if r["queries_per_request"] != base["queries_per_request"]:
+                    line += f" sql/req {base['queries_per_request']} -> {r['queries_per_request']}"
+            print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=20_000)
+    ap.add_argument("--contents", type=int, default=20_000)
+    ap.add_argument("--requests", type=int, default=2000, help="iterations per workload (publish: 1/20th)")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--workloads", default=",".join(WORKLOADS), help=f"comma separated: {','.join(WORKLOADS)}")
+    ap.add_argument("--telegram-latency", type=float, default=0.05)
+    ap.add_argument("--json", help="write the results to this file")
+    ap.add_argument("--compare", help="results file of a previous run to compare against")
+    args = ap.parse_args()
+    args.workloads = [w for w in args.workloads.split(",") if w]
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        ap.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    use_workdir()
+    results = asyncio.run(run(args))
+    report(results, baseline)
+    if args.json:
+        with open(os.path.join(ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w") as f:
+            json.dump({
+                "revision": git_revision(),
+                "date": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                "python": platform.python_version(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Check of the admin event stream (GET /api/events, server-sent events) against
+a real uvicorn server on a temp SQLite file:
+
+1. fan-out: K panels connected while N users register; every panel gets
+   every `user` event, in order, and the push latency is measured (from
+   before the POST to the event reaching the panel); compared with what one
+   full reload of the list (the old way to spot new registrations) costs;
+2. backpressure: a panel that stops reading while a burst of events goes out
+   doesn't slow the others down; once it reads again it gets a `reset`
+   (it fell out of the log) instead of the server buffering for it;
+3. replay: a panel reconnecting with Last-Event-ID gets exactly the events it
+   missed; an id the log doesn't have (ahead of it: a new database) gets a
+   `reset`.
+
+Usage:
+    python scripts/check_events.py --panels 50 --users 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from bench_env import use_workdir
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Panel:
+    """An SSE client recording (arrival time, id, event, data)."""
+
+    def __init__(self, client, url, last_event_id=None):
+        self.client, self.url, self.last_event_id = client, url, last_event_id
+        self.events = []
+        self.connected = asyncio.Event()
+        self.paused = False
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        headers = {"Last-Event-ID": self.last_event_id} if self.last_event_id else {}
+        async with self.client.stream("GET", self.url, headers=headers) as r:
+            self.connected.set()
+            event = {}
+            async for line in r.aiter_lines():
+                while self.paused:
+                    await asyncio.sleep(0.05)
+                if line.startswith(("id:", "event:", "data:")):
+                    key, _, value = line.partition(": ")
+                    event[key.rstrip(":")] = value
+                elif not line and "event" in event:
+                    self.events.append((time.perf_counter(), event["id"], event["event"], json.loads(event["data"])))
+                    event = {}
+
+    def of(self, kind):
+        return [e for e in self.events if e[2] == kind]
+
+    async def close(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def wait_for(cond, timeout=60, what="condition"):
+    t0 = time.perf_counter()
+    while not cond():
+        if time.perf_counter() - t0 > timeout:
+            raise SystemExit(f"timed out waiting for {what}")
+        await asyncio.sleep(0.02)
+    return time.perf_counter() - t0
+
+
+async def run(args):
+    import httpx
+    import uvicorn
+    from backend.app.db.session import Base, engine
+    from backend.app.main import app
+    from backend.app.services.admin_events import admin_events
+
+    Base.metadata.create_all(bind=engine)
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    await wait_for(lambda: server.started)
+    base = "http://127.0.0.1:%d" % server.servers[0].sockets[0].getsockname()[1]
+    url = f"{base}/api/events"
+    limits = httpx.Limits(max_connections=args.panels + 10)
+    async with httpx.AsyncClient(base_url=base, timeout=None, limits=limits) as client:
+        # 1: fan-out and latency
+        panels = [Panel(client, url) for _ in range(args.panels)]
+        await asyncio.gather(*(p.connected.wait() for p in panels))
+        sent = {}
+        for i in range(args.users):
+            tid = 5_000_000 + i
+            sent[tid] = time.perf_counter()
+            r = await client.post("/api/users/register_user", json={"telegram_id": tid, "first_name": f"u{i}", "level": 2})
+            assert r.status_code == 200, r.text
+        await wait_for(lambda: all(len(p.of("user")) >= args.users for p in panels))
+        latencies = []
+        for p in panels:
+            got = [data["telegram_id"] for _, _, _, data in p.of("user")]
+            assert got == list(sent), "missing or out of order events"
+            latencies += [(t - sent[data["telegram_id"]]) * 1000 for t, _, _, data in p.of("user")]
+        reload = await client.get("/api/users", params={"limit": 100, "status": "pending"})
+        event_bytes = len(json.dumps(panels[0].of("user")[0][3])) + 60
+        print(f"fan-out:      {args.users} registrations pushed to {args.panels} panels, all in order; "
+              f"push latency p50={pct(latencies, .5):.1f}ms p99={pct(latencies, .99):.1f}ms "
+              f"(~{event_bytes} bytes per event, vs {len(reload.content)} bytes per reload of one page)")
+
+        # 2: a panel stops reading during a burst, larger than the socket buffers can absorb
+        for p in panels[6:]:
+            await p.close()
+        panels = panels[:6]
+        slow, fast = panels[0], panels[1:]
+        slow.paused = True
+        burst = max(3 * args.buffer, 20_000)
+        before = [len(p.events) for p in fast]
+        t0 = time.perf_counter()
+        step = args.buffer // 2  # as fast as the reading panels keep up, they must not fall out of the log
+        for first in range(0, burst, step):
+            for i in range(first, min(burst, first + step)):
+                admin_events.publish("content", {"id": i, "title": "x" * 2000})
+            sent_now = min(burst, first + step)
+            await wait_for(lambda: all(len(p.events) - b >= sent_now for p, b in zip(fast, before)),
+                           what="the burst on the other panels")
+        slow.paused = False
+        await wait_for(lambda: slow.of("reset"), what="the reset of the slow panel")
+        assert not any(p.of("reset") for p in fast), "a fast panel was reset"
+        print(f"backpressure: burst of {burst} 2 KB events (log keeps {args.buffer}); the other {len(fast)} panels "
+              f"got all of them in {(time.perf_counter() - t0) * 1000:.0f}ms "
+              f"while one panel wasn't reading; it got a reset when it read again")
+
+        # 3: replay after a reconnection, and from an id ahead of the log
+        last_id = fast[0].events[-1][1]
+        for p in panels:
+            await p.close()
+        for i in range(10):
+            admin_events.publish("content", {"id": -i, "title": f"missed {i}"})
+        resumed = Panel(client, url, last_event_id=last_id)
+        await wait_for(lambda: len(resumed.events) >= 10)
+        assert [data["title"] for _, _, _, data in resumed.events] == [f"missed {i}" for i in range(10)]
+        stale = Panel(client, url, last_event_id="999999999")
+        await wait_for(lambda: stale.events)
+        assert stale.events[0][2] == "reset"
+        print("replay:       reconnecting with Last-Event-ID returned exactly the 10 missed events; "
+              "an id ahead of the log got a reset")
+        await resumed.close()
+        await stale.close()
+    server.should_exit = True
+    await serving
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--panels", type=int, default=50)
+    ap.add_argument("--users", type=int, default=300)
+    ap.add_argument("--buffer", type=int, default=2000, help="ADMIN_EVENTS_BUFFER for the test")
+    args = ap.parse_args()
+    use_workdir()
+    os.environ["ADMIN_EVENTS_BUFFER"] = str(args.buffer)
+    asyncio.run(run(args))
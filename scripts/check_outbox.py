@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+End-to-end check of the Telegram outbox against the fake Telegram server, on
+a temp SQLite file:
+
+1. latency: N concurrent POST /change_level (4 -> 1, i.e. 3 kicks + message
+   per user) with --telegram-latency per call; prints HTTP p50/p99 and how
+   long the worker takes to drain the side effects;
+2. ordering: every unban comes after its ban (same channel and user) and each
+   user gets exactly one message;
+3. outage + crash: level changes while the API answers 502, the worker is
+   stopped mid-retry (as if the process died), the API comes back and a new
+   worker finishes every queued action;
+4. idempotency: replaying a request with the same Idempotency-Key queues
+   nothing new;
+5. lease: a batch running for several times OUTBOX_LEASE (one slow key)
+   while a second worker keeps claiming; its lease is renewed, so the other
+   worker never takes (and sends again) any of its actions.
+
+Usage:
+    python scripts/check_outbox.py --users 200
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from bench_env import start_fake_telegram, use_workdir
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed(n_users, offset):
+    from sqlalchemy import insert, select
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"telegram_id": offset + i, "first_name": f"user{i}", "level": 4,
+             "status": UserStatus.active, "registered_at": datetime(2024, 1, 1)}
+            for i in range(n_users)
+        ])
+        return conn.execute(select(User.id, User.telegram_id).where(User.telegram_id >= offset)
+                            .order_by(User.id)).all()
+
+
+def outbox_counts():
+    from sqlalchemy import func, select
+    from backend.app.db.session import engine
+    from backend.app.models.models import TelegramOutbox
+
+    with engine.connect() as conn:
+        return dict(conn.execute(select(TelegramOutbox.status, func.count()).group_by(TelegramOutbox.status)).all())
+
+
+async def drained(timeout=300):
+    from backend.app.models.models import OutboxStatus
+
+    t0 = time.perf_counter()
+    while outbox_counts().get(OutboxStatus.pending, 0):
+        if time.perf_counter() - t0 > timeout:
+            raise SystemExit(f"outbox not drained after {timeout}s: {outbox_counts()}")
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - t0
+
+
+def check_order(fake, telegram_ids):
+    seen = defaultdict(list)
+    messages = Counter()
+    for _, method, payload in fake.calls:
+        if method in ("banChatMember", "unbanChatMember") and payload["user_id"] in telegram_ids:
+            seen[(payload["chat_id"], payload["user_id"])].append(method)
+        if method == "sendMessage" and payload["chat_id"] in telegram_ids:
+            messages[payload["chat_id"]] += 1
+    # a ban cut mid-request when the worker stops may still reach Telegram and is repeated;
+    # what matters is that no ban lands after the unban (the user would stay banned)
+    bad = [k for k, calls in seen.items() if calls[0] != "banChatMember" or calls[-1] != "unbanChatMember"]
+    assert not bad, f"unban before ban for {bad[:5]}"
+    assert all(messages[t] == 1 for t in telegram_ids), "missing or duplicate messages"
+    return sum(len(v) for v in seen.values()), sum(messages.values())
+
+
+async def run(args):
+    fake = await start_fake_telegram(latency=args.telegram_latency)
+
+    import httpx
+    from backend.app.db.session import Base, engine
+    from backend.app.main import app
+    from backend.app.models.models import OutboxStatus
+    from backend.app.db.session import AsyncSessionLocal
+    from backend.app.services.outbox import OutboxWorker, action, enqueue, outbox
+
+    Base.metadata.create_all(bind=engine)
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.get("/api/users/invite_links", params={"level": 4})  # warm the invite link cache
+
+        # 1 + 2: latency and ordering
+        users = seed(args.users, 1_000_000)
+        sem = asyncio.Semaphore(16)
+        latencies = []
+
+        async def change(uid, level, key=None):
+            async with sem:
+                t = time.perf_counter()
+                r = await client.post(f"/api/users/change_level?user_id={uid}&level={level}",
+                                      headers={"Idempotency-Key": key} if key else None)
+                latencies.append((time.perf_counter() - t) * 1000)
+                assert r.status_code == 200, r.text
+                return r.json()
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(change(uid, 1) for uid, _ in users))
+        http_s = time.perf_counter() - t0
+        drain_s = await drained()
+        kicks, messages = check_order(fake, {t for _, t in users})
+        print(f"latency:     {len(users)} change_level in {http_s:.2f}s, p50={pct(latencies, .5):.1f}ms "
+              f"p99={pct(latencies, .99):.1f}ms; side effects drained {drain_s:.2f}s later")
+        print(f"ordering:    {kicks} ban/unban calls in order, {messages} messages (one per user)")
+
+        # 3: outage, then the worker dies mid-retry and a new one takes over
+        users = seed(args.users // 4, 2_000_000)
+        fake.outage = True
+        await asyncio.gather(*(change(uid, 1) for uid, _ in users))
+        await asyncio.sleep(3)
+        await outbox.stop()
+        pending = outbox_counts().get(OutboxStatus.pending, 0)
+        fake.outage = False
+        worker = OutboxWorker()  # picks up the stopped worker's actions once their lease expires
+        worker.register("sendLevelMessage", outbox._handlers["sendLevelMessage"])
+        t0 = time.perf_counter()
+        worker.start()
+        drain_s = await drained()
+        await worker.stop()
+        kicks, messages = check_order(fake, {t for _, t in users})
+        counts = outbox_counts()
+        print(f"outage:      {pending} actions pending when the worker was stopped; new worker finished "
+              f"them in {drain_s:.2f}s: {kicks} ban/unban calls, {messages} messages, "
+              f"failed={counts.get(OutboxStatus.failed, 0)}")
+
+        # 4: idempotency
+        uid, _ = users[0]
+        before = sum(outbox_counts().values())
+        first = await change(uid, 3, key="replay-1")
+        again = await change(uid, 3, key="replay-1")
+        after = sum(outbox_counts().values())
+        print(f"idempotency: queued {first['queued']} then {again['queued']} for the replay, "
+              f"outbox rows +{after - before}")
+        assert after - before == first["queued"]
+
+        # 5: a batch outliving its first lease, next to another worker
+        calls = Counter()
+
+        async def slow(_, payload):
+            calls[payload["n"]] += 1
+            await asyncio.sleep(0.5)
+
+        async with AsyncSessionLocal() as db:
+            await enqueue(db, [action("slowCall", {"n": i}, "lease-check") for i in range(8)])
+            await db.commit()
+        first, other = OutboxWorker(lease=1, concurrency=1), OutboxWorker(lease=1)
+        for w in (first, other):
+            w.register("slowCall", slow)
+        t0 = time.perf_counter()
+        batch = asyncio.create_task(first.drain_once())
+        await asyncio.sleep(0.1)
+        taken = 0
+        while not batch.done():
+            taken += await other.drain_once()
+            await asyncio.sleep(0.1)
+        assert not taken and sorted(calls) == list(range(8)) and set(calls.values()) == {1}, (taken, calls)
+        print(f"lease:       a batch of 8 slow actions ran {time.perf_counter() - t0:.1f}s with a 1s lease, "
+              f"renewed; the other worker claimed none of them")
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--telegram-latency", type=float, default=0.1)
+    args = ap.parse_args()
+    use_workdir()
+    os.environ.setdefault("OUTBOX_LEASE", "5")
+    asyncio.run(run(args))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+End-to-end check of scheduled publishing against the fake Telegram server, on
+a temp SQLite file:
+
+1. batching: N contents for random levels (some longer than a Telegram
+   message, some also sent to users) scheduled over a few due times; each is
+   published once, no earlier than its publish_at, and every due time sends
+   the fewest messages per channel, none longer than 4096 UTF-16 units;
+2. restart: contents scheduled, the scheduler stopped before they are due and
+   a new one started (heap rebuilt from the table) publishes them;
+3. no double-send: several schedulers publishing the same due contents at
+   once publish and announce each of them once;
+4. cancel: a cancelled content is neither published nor announced.
+
+Usage:
+    python scripts/check_scheduler.py --contents 200
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from bench_env import start_fake_telegram, use_workdir
+
+
+CHANNELS = {level: str(-1000000000000 - level) for level in (1, 2, 3, 4)}
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed_users(n):
+    from sqlalchemy import insert, select
+    from backend.app.db.session import engine, Base
+    from backend.app.models.models import User, UserStatus
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"telegram_id": 1_000_000 + i, "first_name": f"user{i}", "level": 1,
+             "status": UserStatus.active, "registered_at": datetime(2024, 1, 1)} for i in range(n)
+        ])
+        return dict(conn.execute(select(User.id, User.telegram_id)).all())
+
+
+def published():
+    """schedule id -> (status, content published_at, publish_at) from the DB."""
+    from sqlalchemy import select
+    from backend.app.db.session import engine
+    from backend.app.models.models import Content, ScheduledContent
+
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(ScheduledContent.id, ScheduledContent.status, Content.published_at, ScheduledContent.publish_at)
+            .outerjoin(Content, Content.id == ScheduledContent.content_id)
+        ).all()
+    return {r.id: r for r in rows}
+
+
+async def settled(fake, timeout=60):
+    # scheduler done and outbox drained: no new Telegram call for a while
+    t0, n = time.perf_counter(), -1
+    while n != len(fake.calls):
+        n = len(fake.calls)
+        await asyncio.sleep(1.5)
+        if time.perf_counter() - t0 > timeout:
+            raise SystemExit(f"Telegram calls still going after {timeout}s")
+
+
+def messages(fake, since=0):
+    from backend.app.services.telegram import message_length
+
+    sent = [p for _, m, p in fake.calls[since:] if m == "sendMessage"]
+    assert all(message_length(p["text"]) <= 4096 for p in sent), "message over 4096"
+    return sent
+
+
+async def run(args):
+    fake = await start_fake_telegram()
+
+    import httpx
+    from backend.app import config
+    config.LEVEL_CHANNELS.update(CHANNELS)  # not bot/.env's channels
+    from backend.app.main import app
+    from backend.app.models.models import ScheduleStatus
+    from backend.app.services.scheduler import PublishScheduler, scheduler
+
+    rnd = random.Random(1)
+    users = list(seed_users(20))
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def schedule(at, **extra):
+            body = " ".join(rnd.choice(["assemblea", "bilancio", "verbale", "riunione"]) for _ in range(rnd.randrange(20, 200)))
+            if rnd.random() < 0.05:
+                body = " ".join(f"Comunicato {rnd.randrange(10**6)}." for _ in range(400)) + "😀" * 500  # > 1 message
+            payload = {"title": f"Post {rnd.randrange(10**6)}", "body": body, "publish_at": at.isoformat(),
+                       "levels": rnd.sample([1, 2, 3, 4], rnd.randrange(1, 3)), **extra}
+            if rnd.random() < 0.1:
+                payload["user_ids"] = rnd.sample(users, 2)
+            r = await client.post("/api/contents/schedule_content", json=payload)
+            assert r.status_code == 200, r.text
+            return r.json()
+
+        # 1: batching
+        start = datetime.utcnow() + timedelta(seconds=3)
+        due_times = [start + timedelta(seconds=2 * i) for i in range(4)]
+        t0 = time.perf_counter()
+        scheduled = [await schedule(rnd.choice(due_times)) for _ in range(args.contents)]
+        print(f"scheduled:   {len(scheduled)} contents over {len(due_times)} due times "
+              f"({(time.perf_counter() - t0) * 1000 / len(scheduled):.1f}ms per request)")
+        await asyncio.sleep((due_times[-1] - datetime.utcnow()).total_seconds())
+        await settled(fake)
+        rows = published()
+        assert all(rows[s["id"]].status == ScheduleStatus.published for s in scheduled), "not published"
+        lag = [(rows[s["id"]].published_at - rows[s["id"]].publish_at).total_seconds() * 1000 for s in scheduled]
+        assert min(lag) >= 0, "published early"
+        sent = messages(fake)
+        per_chat = Counter(p["chat_id"] for p in sent)
+        announcements = sum(len(s["levels"]) + len(s["user_ids"]) for s in scheduled)
+        print(f"batching:    published {len(scheduled)} contents {pct(lag, .5):.0f}ms (p50) / {max(lag):.0f}ms (max) "
+              f"after publish_at; {announcements} announcements sent as {len(sent)} messages "
+              f"({', '.join(f'{c}: {n}' for c, n in sorted(per_chat.items(), key=str) if c in CHANNELS.values())})")
+
+        # 2: restart before the due time
+        since = len(fake.calls)
+        at = datetime.utcnow() + timedelta(seconds=3)
+        restarted = [await schedule(at) for _ in range(10)]
+        await scheduler.stop()
+        await asyncio.sleep(1)
+        other = PublishScheduler()
+        other.start()
+        await asyncio.sleep((at - datetime.utcnow()).total_seconds())
+        await settled(fake)
+        rows = published()
+        assert all(rows[s["id"]].status == ScheduleStatus.published for s in restarted)
+        print(f"restart:     {len(restarted)} contents scheduled before the restart published by the new "
+              f"scheduler, {len(messages(fake, since))} messages")
+        await other.stop()
+
+        # 3: concurrent schedulers, 4: cancel
+        since = len(fake.calls)
+        at = datetime.utcnow() + timedelta(days=1)
+        raced = [await schedule(at) for _ in range(30)]
+        cancelled = await schedule(at)
+        r = await client.delete(f"/api/contents/scheduled/{cancelled['id']}")
+        assert r.status_code == 200 and r.json()["status"] == "cancelled", r.text
+        assert (await client.delete(f"/api/contents/scheduled/{cancelled['id']}")).status_code == 409
+        racers = [PublishScheduler() for _ in range(4)]
+        results = await asyncio.gather(*(s.publish_due(at) for s in racers))
+        await settled(fake)
+        rows = published()
+        published_ids = [cid for ids in results for cid in ids]
+        assert len(published_ids) == len(set(published_ids)) == len(raced), results
+        assert rows[cancelled["id"]].status == ScheduleStatus.cancelled and rows[cancelled["id"]].published_at is None
+        texts = Counter((p["chat_id"], p["text"]) for p in messages(fake, since))
+        assert all(n == 1 for n in texts.values()), "message sent twice"
+        print(f"no doubles:  {len(racers)} schedulers racing published {len(published_ids)} contents once "
+              f"(per scheduler: {[len(ids) for ids in results]}), {sum(texts.values())} messages, none repeated; "
+              f"cancelled content not published")
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--contents", type=int, default=200)
+    args = ap.parse_args()
+    use_workdir()
+    asyncio.run(run(args))
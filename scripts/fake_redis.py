@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+In-memory stand-in for a redis.asyncio client, covering the calls made by
+backend/app/services/cache.py's RedisBackend (mget, set with px, incr,
+non-transactional pipelines). `latency` adds a round trip per command or
+pipeline, like a Redis server on the network. Several RedisBackend
+instances sharing one FakeRedis behave like API workers sharing a Redis.
+
+Usage (in a benchmark/test):
+    from fake_redis import FakeRedis
+    user_cache.backend = RedisBackend(client=FakeRedis(latency=0.0002))
+"""
+import asyncio
+import time
+
+
+class FakeRedis:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.commands = 0
+        self._data = {}  # key -> (value, expires monotonic time or None)
+
+    async def _round_trip(self, n=1):
+        self.commands += n
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and time.monotonic() >= expires:
+            del self._data[key]
+            return None
+        return value
+
+    def _incr(self, key):
+        value = int(self._get(key) or 0) + 1
+        self._data[key] = (str(value).encode(), None)
+        return value
+
+    async def get(self, key):
+        await self._round_trip()
+        return self._get(key)
+
+    async def mget(self, *keys):
+        await self._round_trip()
+        return [self._get(k) for k in keys]
+
+    async def set(self, key, value, px=None, ex=None):
+        await self._round_trip()
+        ttl = px / 1000 if px else ex
+        self._data[key] = (value.encode() if isinstance(value, str) else value,
+                           time.monotonic() + ttl if ttl else None)
+        return True
+
+    async def incr(self, key):
+        await self._round_trip()
+        return self._incr(key)
+
+    async def delete(self, *keys):
+        await self._round_trip()
+        return sum(self._data.pop(k, None) is not None for k in keys)
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+    async def aclose(self):
+        pass
+
+
+class _Pipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._ops = []
+
+    def incr(self, key):
+        self._ops.append(key)
+        return self
+
+    async def execute(self):
+        await self._redis._round_trip(len(self._ops))
+        return [self._redis._incr(k) for k in self._ops]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Minimal fake Telegram Bot API server for local tests and benchmarks.
+
+It answers the Bot API methods used by the backend and the bot, records every
+call with its arrival time, can add artificial latency, and enforces
+Telegram's flood limits (global msgs/s, msgs/s per chat) by answering 429 with
+`retry_after`, the way the real API does. `outage` / `fail_rate` simulate 502s.
+
+Usage:
+    python scripts/fake_telegram.py --port 8081
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 ./scripts/run_api.sh
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, global_rate: float = 30, per_chat_rate: float = 1):
+        self.latency = latency
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.calls = []  # (arrival monotonic time, method, payload)
+        self.rejected = 0
+        self.outage = False  # answer every call with 502, like an API outage
+        self.fail_rate = 0.0  # fraction of calls answered with 502
+        self.updates = asyncio.Queue()  # served by getUpdates
+        self._unconfirmed = []  # served, kept until a getUpdates offset goes past them
+        self._ids = itertools.count(1)
+        self._global = deque()
+        self._per_chat = defaultdict(deque)
+        self._runner = None
+        self.url = None
+
+    def _flooded(self, now, window, limit):
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        return len(window) >= limit
+
+    def _retry_after(self, description="Too Many Requests: retry after 1"):
+        self.rejected += 1
+        return web.json_response(
+            {"ok": False, "error_code": 429, "description": description, "parameters": {"retry_after": 1}},
+            status=429,
+        )
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        try:
+            payload = await request.json()
+        except Exception:
+            # aiogram posts form fields: ids arrive as strings
+            payload = {k: int(v) if k in ("chat_id", "user_id") and v.lstrip("-").isdigit() else v
+                       for k, v in (await request.post()).items()}
+        if method == "getUpdates":
+            return await self._get_updates(payload)
+        # decided on arrival: a call made during an outage fails even if the answer comes after it
+        failing = self.outage or (self.fail_rate and random.random() < self.fail_rate)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if failing:
+            return web.Response(status=502, text="Bad Gateway")
+        now = time.monotonic()
+        if method.startswith("send"):
+            chat_window = self._per_chat[payload.get("chat_id")]
+            # small tolerance: our own clocks are not perfectly aligned with the client's buckets
+            if self._flooded(now, self._global, self.global_rate * 1.1) or \
+                    self._flooded(now, chat_window, self.per_chat_rate + 1):
+                return self._retry_after()
+            self._global.append(now)
+            chat_window.append(now)
+        self.calls.append((now, method, payload))
+        return web.json_response({"ok": True, "result": self._result(method, payload)})
+
+    def _result(self, method, payload):
+        if method == "sendMessage":
+            return {"message_id": next(self._ids), "date": int(time.time()),
+                    "chat": {"id": payload.get("chat_id"), "type": "private"}, "text": payload.get("text")}
+        if method == "createChatInviteLink":
+            return {"invite_link": f"https://t.me/+fake{next(self._ids)}", "creator": {"id": 0},
+                    "creates_join_request": False, "is_primary": False, "is_revoked": False,
+                    "expire_date": payload.get("expire_date"), "member_limit": payload.get("member_limit")}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        return True
+
+    async def _get_updates(self, payload):
+        # like Telegram: updates are served again until an offset above their id confirms them
+        offset = int(payload.get("offset") or 0)
+        limit = int(payload.get("limit") or 100)
+        self._unconfirmed = [u for u in self._unconfirmed if u["update_id"] >= offset]
+        if not self._unconfirmed:
+            timeout = float(payload.get("timeout") or 0)
+            try:
+                update = await asyncio.wait_for(self.updates.get(), timeout=timeout or 0.01)
+                self._unconfirmed.append(update)  # the list may have been replaced meanwhile
+            except asyncio.TimeoutError:
+                pass
+        while not self.updates.empty() and len(self._unconfirmed) < limit:
+            self._unconfirmed.append(self.updates.get_nowait())
+        return web.json_response({"ok": True, "result": self._unconfirmed[:limit]})
+
+    def count(self, method=None):
+        return sum(1 for _, m, _ in self.calls if method is None or m == method)
+
+    async def start(self, host="127.0.0.1", port=0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+async def _serve(args):
+    fake = FakeTelegram(latency=args.latency)
+    url = await fake.start(port=args.port)
+    print(f"Fake Telegram API listening on {url}")
+    while True:
+        await asyncio.sleep(3600)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    asyncio.run(_serve(ap.parse_args()))
@@ -6,6 +6,31 @@
 
 UVICORN_HOST=${UVICORN_HOST:-127.0.0.1}
 UVICORN_PORT=${UVICORN_PORT:-8000}
+# each worker is a process with its own caches and event loop; they share the DB (see README)
 UVICORN_WORKERS=${UVICORN_WORKERS:-1}
+# on SIGTERM, seconds open connections get to finish before the workers are drained (event
+# streams and long polls never end by themselves)
+UVICORN_GRACEFUL_TIMEOUT=${UVICORN_GRACEFUL_TIMEOUT:-5}
 
-exec uvicorn backend.app.main:app --host "$UVICORN_HOST" --port "$UVICORN_PORT" --workers "$UVICORN_WORKERS" --reload
+# schema changes run once here, not in every worker at import (DB_MIGRATE=0 to skip, e.g. when a
+# deploy step runs them)
+if [ "${DB_MIGRATE:-1}" != "0" ]; then
+  if ! alembic upgrade head; then
+    echo "alembic upgrade head failed; a data.db created before the migrations needs 'alembic stamp 0001' first" >&2
+    exit 1
+  fi
+fi
+
+args=(--factory backend.app.main:create_app --workers "$UVICORN_WORKERS" --timeout-graceful-shutdown "$UVICORN_GRACEFUL_TIMEOUT")
+# UVICORN_RELOAD=1 restarts on code changes, for development: uvicorn then runs a single worker
+if [ "${UVICORN_RELOAD:-0}" = "1" ]; then
+  args+=(--reload)
+fi
+
+# UVICORN_UDS=/run/fdi/api.sock listens on a Unix socket instead (e.g. behind nginx, with the bot
+# on the same host using API_UDS)
+if [ -n "$UVICORN_UDS" ]; then
+  exec uvicorn "${args[@]}" --uds "$UVICORN_UDS"
+fi
+
+exec uvicorn "${args[@]}" --host "$UVICORN_HOST" --port "$UVICORN_PORT"
@@ -91,11 +91,8 @@ def main():
         "title": "Assemblea Territoriale",
         "body": "Incontro il 10/10 ore 18",
         "link": "https://example.com",
-        "targets": {
-            "all_levels": False,
-            "levels": [2],
-            "user_ids": [u1["id"]]
-        }
+        "levels": [2],
+        "user_ids": [u1["id"]]
     })
     p("Publish content to L2 and user 1", pub)
 